@@ -1,4 +1,6 @@
 # config.py
+import os
+
 CONNECTION_CONFIG = {
     'login': 'sa',
     'password': 'tu_contraseña',
@@ -9,6 +11,65 @@ CONNECTION_CONFIG = {
 TOTAL_ROWS = 50000
 BATCH_SIZE = 10000
 
+# Archivo con la asignación de cada tienda (dimID_Tienda) a su región. Se sincroniza con la
+# tabla tbDimRegionTienda de la base de datos (ver connect/regiones.py).
+REGIONES_TIENDA_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'regiones_tienda.csv')
+
+# Parámetros de la conexión compartida a DuckDB (ver connect/conexion_duckdb.py)
+DUCKDB_CONFIG = {
+    'memory_limit': '2GB',
+    'threads': 4
+}
+
+# Caché local de resultados de consultas (ver query/cache_resultados.py)
+RESULT_CACHE_CONFIG = {
+    'habilitado': True,
+    'directorio': os.path.join(os.path.expanduser("~"), ".mi_app_cache_resultados"),
+    'max_bytes': 2 * 1024 * 1024 * 1024,  # 2 GB
+    'ttl_segundos': 15 * 60
+}
+
+# Marca de agua para el refresco incremental de la importación (ver connect/incremental.py).
+# 'columna' debe crecer con cada alta o modificación en tbHecInventario: un rowversion,
+# una fecha de modificación o el id del hecho.
+WATERMARK_CONFIG = {
+    'columna': 'FechaModificacion'
+}
+
+# Escritura de archivos Parquet (ver connect/exportacion.py). 'ordenar_por' ordena cada
+# grupo de filas por esas columnas y lo declara en los metadatos del archivo.
+PARQUET_CONFIG = {
+    'row_group_size': 128 * 1024,
+    'compression': 'zstd',
+    'compression_level': 3,
+    'use_dictionary': True,
+    'ordenar_por': None
+}
+
+# Presupuesto de memoria de los resultados acumulados en un AlmacenResultados (ver
+# model/almacen_resultados.py). Al superarlo, los bloques usados hace más tiempo se guardan
+# en archivos Arrow dentro de 'directorio' (None: el temporal del sistema) y se vuelven a
+# leer cuando la vista o un exportador los necesitan. presupuesto_bytes=None no limita.
+MEMORIA_CONFIG = {
+    'presupuesto_bytes': 1024 * 1024 * 1024,  # 1 GB
+    'directorio': None,
+    'tramos_texto': 1024  # Tramos de texto formateado que conserva la tabla (ver PandasModel)
+}
+
+# Pool de conexiones a SQL Server, uno por destino para todo el proceso (ver connect/motores.py).
+# pool_pre_ping descarta conexiones cortadas antes de entregarlas y pool_recycle (segundos)
+# las renueva antes de que el servidor o un firewall las cierre por inactividad.
+SQLSERVER_POOL_CONFIG = {
+    'driver': 'SQL Server Native Client 11.0',
+    'timeout_conexion': 30,
+    'pool_size': 10,
+    'max_overflow': 20,
+    'pool_timeout': 30,
+    'pool_pre_ping': True,
+    'pool_recycle': 30 * 60,
+    'calentar': 2  # Conexiones que se abren al iniciar la aplicación
+}
+
 def conectar_instancia():
     instance_name = "MiInstancia"
     return instance_name
@@ -1,7 +1,8 @@
 # logging_config.py
 import logging
 from logging.handlers import RotatingFileHandler
-from prometheus_client import start_http_server, Summary, Counter
+from prometheus_client import start_http_server, Summary, Counter, Gauge, Histogram
+from sqlalchemy.engine import make_url
 
 # Configuración del logger
 logger = logging.getLogger("ImportacionLogger")
@@ -24,5 +25,87 @@ logger.addHandler(file_handler)
 REQUEST_TIME = Summary('importacion_request_processing_seconds', 'Tiempo de procesamiento de un bloque')
 ERROR_COUNT = Counter('importacion_error_total', 'Número total de errores en la importación')
 
+# Métricas del pool de conexiones a SQL Server, por destino (servidor/base de datos)
+POOL_EN_USO = Gauge('sqlserver_pool_conexiones_en_uso', 'Conexiones del pool entregadas y no devueltas', ['destino'])
+POOL_DISPONIBLES = Gauge('sqlserver_pool_conexiones_disponibles', 'Conexiones abiertas y libres en el pool', ['destino'])
+POOL_OVERFLOW = Gauge('sqlserver_pool_overflow', 'Conexiones abiertas por encima de pool_size', ['destino'])
+POOL_ESPERA = Summary('sqlserver_pool_espera_segundos', 'Tiempo para obtener una conexión del pool', ['destino'])
+
+# Métricas de los resultados acumulados en memoria y de los bloques descargados a disco
+ALMACEN_BYTES_MEMORIA = Gauge('almacen_resultados_bytes_memoria', 'Bytes estimados de los bloques en memoria')
+ALMACEN_BYTES_DISCO = Gauge('almacen_resultados_bytes_disco', 'Bytes de los bloques descargados a disco')
+ALMACEN_DESCARGAS = Counter('almacen_resultados_descargas_total', 'Bloques descargados a disco por falta de memoria')
+ALMACEN_RECARGAS = Counter('almacen_resultados_recargas_total', 'Bloques leídos de nuevo desde disco')
+
+# Métricas por etapa de la importación. 'etapa' es una de: consulta (ejecución en el motor),
+# lectura (traer el resultado a pandas/Arrow), conversion (tipos compactos), espera_reintento,
+# modelo (actualización de la tabla en la interfaz) y exportacion. 'consulta' identifica la
+# consulta o el modo de paginación y 'destino' la base de datos (ver etiqueta_destino).
+ETAPA_SEGUNDOS = Histogram(
+    'importacion_etapa_segundos', 'Duración de cada etapa de la importación', ['etapa', 'consulta', 'destino'],
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+)
+FILAS_IMPORTADAS = Counter('importacion_filas_total', 'Filas entregadas por la importación', ['consulta', 'destino'])
+BYTES_IMPORTADOS = Counter('importacion_bytes_total', 'Bytes en memoria de los bloques entregados', ['consulta', 'destino'])
+LOTES_EN_VUELO = Gauge('importacion_lotes_en_vuelo', 'Bloques en curso que aún no llegaron a la vista', ['destino'])
+
+def url_sin_credenciales(url):
+    """
+    Retorna la URL de SQLAlchemy sin usuario ni contraseña, apta para logs y métricas.
+    En las URL 'odbc_connect' la cadena ODBC (que puede incluir UID/PWD) se reemplaza por
+    su SERVER y DATABASE. Si la URL no se puede interpretar retorna solo el dialecto.
+    """
+    try:
+        partes = make_url(url)
+    except Exception:
+        return str(url).split(":", 1)[0]
+    consulta = dict(partes.query)
+    odbc = consulta.pop("odbc_connect", None)
+    partes = partes._replace(username=None, password=None).set(query=consulta)
+    if odbc:
+        campos = {}
+        for par in str(odbc).split(";"):
+            clave, _, valor = par.partition("=")
+            campos[clave.strip().upper()] = valor.strip().strip("{}")
+        partes = partes._replace(host=campos.get("SERVER") or None, database=campos.get("DATABASE") or None)
+    return partes.render_as_string(hide_password=True)
+
+def etiqueta_destino(config):
+    """
+    Valor de la etiqueta 'destino': servidor/base para SQL Server, la base DuckDB en otro
+    caso, o 'local' sin configuración. No incluye credenciales.
+    """
+    if not config:
+        return "local"
+    if config.get('url'):
+        return url_sin_credenciales(config['url'])
+    if config.get('server_name'):
+        return f"{config['server_name']}/{config.get('database', 'BODEGA_DATOS')}"
+    return str(config.get('database', ':memory:'))
+
+def medir_etapa(etapa, consulta, config=None):
+    """Context manager que registra en ETAPA_SEGUNDOS la duración del bloque 'with'."""
+    return ETAPA_SEGUNDOS.labels(etapa, consulta, etiqueta_destino(config)).time()
+
+def registrar_lote(consulta, config, df):
+    """Suma las filas y los bytes de un bloque entregado a los contadores de la importación."""
+    if df is None or len(df) == 0:
+        return
+    destino = etiqueta_destino(config)
+    FILAS_IMPORTADAS.labels(consulta, destino).inc(len(df))
+    BYTES_IMPORTADOS.labels(consulta, destino).inc(int(df.memory_usage(index=False, deep=True).sum()))
+
+def registrar_espera_reintento(retry_state):
+    """
+    Callback before_sleep de tenacity: registra la espera antes del siguiente intento. La
+    consulta se identifica con el nombre de la función reintentada y el destino con su
+    primer argumento (la configuración de conexión).
+    """
+    espera = retry_state.next_action.sleep if retry_state.next_action else 0
+    config = retry_state.args[0] if retry_state.args and isinstance(retry_state.args[0], dict) else None
+    ETAPA_SEGUNDOS.labels("espera_reintento", retry_state.fn.__name__, etiqueta_destino(config)).observe(espera)
+    logger.warning(f"Reintento {retry_state.attempt_number} de {retry_state.fn.__name__} en {espera:.1f} segundos: "
+                   f"{retry_state.outcome.exception() if retry_state.outcome else ''}")
+
 # Inicializar el servidor de métricas en el puerto 8000
 start_http_server(8000)
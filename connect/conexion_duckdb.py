@@ -0,0 +1,159 @@
+# connect/conexion_duckdb.py
+import atexit
+import threading
+import duckdb
+from config.config import DUCKDB_CONFIG
+from config.logging_config import logger
+from connect.regiones import sincronizar_regiones_duckdb
+
+class GestorDuckDB:
+    """
+    Mantiene un único handle de DuckDB por base de datos y entrega un cursor por hilo.
+
+    Abrir la base en cada lote repite la carga del catálogo, el bloqueo del archivo y
+    el calentamiento del buffer pool; con un handle compartido la caché se conserva
+    entre lotes. Los cursores de DuckDB no deben compartirse entre hilos, por eso cada
+    hilo recibe el suyo.
+    """
+    def __init__(self, db_path=":memory:", memory_limit=None, threads=None):
+        self.db_path = db_path
+        self.ajustes = {
+            'memory_limit': memory_limit or DUCKDB_CONFIG.get('memory_limit'),
+            'threads': threads or DUCKDB_CONFIG.get('threads'),
+        }
+        self._conexion = None
+        self._cursores = {}  # threading.Thread -> cursor
+        self._dedicados = {}  # Cursores propios de lecturas en flujo (ver cursor_dedicado) -> hilo que lo pidió
+        self._lock = threading.Lock()
+
+    def conexion(self):
+        """Retorna el handle compartido, abriéndolo la primera vez."""
+        with self._lock:
+            if self._conexion is None:
+                ajustes = {k: v for k, v in self.ajustes.items() if v is not None}
+                self._conexion = duckdb.connect(database=self.db_path, config=ajustes)
+                logger.info(f"Conexión DuckDB abierta sobre '{self.db_path}' con {ajustes}.")
+                try:
+                    # La consulta de importación une con la dimensión de regiones: se sincroniza al abrir.
+                    sincronizar_regiones_duckdb(self._conexion)
+                except Exception as e:
+                    logger.error(f"No se pudo sincronizar la tabla de regiones: {e}", exc_info=True)
+            return self._conexion
+
+    def cursor(self):
+        """
+        Retorna el cursor del hilo actual. Los cursores de hilos que ya terminaron se cierran
+        al crear uno nuevo.
+        """
+        hilo = threading.current_thread()
+        cursor = self._cursores.get(hilo)
+        if cursor is not None:
+            return cursor
+
+        conexion = self.conexion()
+        with self._lock:
+            for otro in [h for h in self._cursores if not h.is_alive()]:
+                self._cerrar_silencioso(self._cursores.pop(otro))
+            cursor = conexion.cursor()
+            self._cursores[hilo] = cursor
+        return cursor
+
+    def cursor_dedicado(self):
+        """
+        Retorna un cursor nuevo, no asociado al hilo, para lecturas que deben mantenerse
+        abiertas mientras el mismo hilo ejecuta otras consultas. Se libera con liberar_cursor.
+        """
+        conexion = self.conexion()
+        with self._lock:
+            cursor = conexion.cursor()
+            self._dedicados[cursor] = threading.current_thread()
+        return cursor
+
+    def liberar_cursor(self, cursor):
+        """Cierra un cursor obtenido con cursor_dedicado."""
+        with self._lock:
+            self._dedicados.pop(cursor, None)
+        self._cerrar_silencioso(cursor)
+
+    def interrumpir(self, hilo=None):
+        """
+        Interrumpe las consultas en curso de los cursores del gestor: los del hilo indicado
+        (su cursor y los dedicados que pidió) o, sin 'hilo', los de todos. La consulta
+        interrumpida lanza duckdb.InterruptException (o un OSError si se leía con un lector
+        Arrow); los cursores siguen siendo utilizables. En un cursor sin consulta activa
+        no tiene efecto.
+        """
+        with self._lock:
+            if hilo is None:
+                cursores = list(self._cursores.values()) + list(self._dedicados)
+            else:
+                cursores = [c for h, c in self._cursores.items() if h is hilo]
+                cursores += [c for c, h in self._dedicados.items() if h is hilo]
+        for cursor in cursores:
+            try:
+                cursor.interrupt()
+            except Exception as e:
+                logger.debug(f"Error interrumpiendo cursor DuckDB: {e}")
+        if cursores:
+            origen = f" del hilo '{hilo.name}'" if hilo is not None else ""
+            logger.info(f"Consultas DuckDB{origen} sobre '{self.db_path}' interrumpidas.")
+
+    def cerrar(self):
+        """Cierra todos los cursores y el handle compartido."""
+        with self._lock:
+            for cursor in list(self._cursores.values()) + list(self._dedicados):
+                self._cerrar_silencioso(cursor)
+            self._cursores.clear()
+            self._dedicados.clear()
+            if self._conexion is not None:
+                self._cerrar_silencioso(self._conexion)
+                self._conexion = None
+                logger.info(f"Conexión DuckDB sobre '{self.db_path}' cerrada.")
+
+    @staticmethod
+    def _cerrar_silencioso(con):
+        try:
+            con.close()
+        except Exception as e:
+            logger.debug(f"Error cerrando conexión DuckDB: {e}")
+
+_gestores = {}
+_gestores_lock = threading.Lock()
+
+def obtener_gestor(db_path=":memory:", **ajustes):
+    """
+    Retorna el gestor compartido del proceso para 'db_path', creándolo si no existe.
+    Los ajustes (memory_limit, threads) solo se aplican al crear el gestor.
+    """
+    with _gestores_lock:
+        gestor = _gestores.get(db_path)
+        if gestor is None:
+            gestor = GestorDuckDB(db_path, **ajustes)
+            _gestores[db_path] = gestor
+        return gestor
+
+def obtener_cursor(config):
+    """
+    Retorna el cursor del hilo actual para la base indicada en config['database']
+    (":memory:" si no se indica). El cursor es compartido: no debe cerrarse ni usarse
+    como context manager.
+    """
+    return obtener_gestor(config.get("database", ":memory:")).cursor()
+
+def es_interrupcion(error):
+    """
+    Indica si el error proviene de una consulta interrumpida con GestorDuckDB.interrumpir.
+    Los lectores de lotes Arrow la entregan como OSError con el mensaje de DuckDB.
+    """
+    if isinstance(error, duckdb.InterruptException):
+        return True
+    return isinstance(error, OSError) and "INTERRUPT Error" in str(error)
+
+def cerrar_gestores():
+    """Cierra todas las conexiones DuckDB del proceso."""
+    with _gestores_lock:
+        for gestor in _gestores.values():
+            gestor.cerrar()
+        _gestores.clear()
+
+atexit.register(cerrar_gestores)
@@ -2,16 +2,15 @@
 import subprocess
 import re
 import pandas as pd
-from sqlalchemy import create_engine
 from tkinter import messagebox
-from urllib.parse import quote_plus
+from connect.motores import obtener_motor, calentar_motor
 
-# Variable global para el connection string
-DEFAULT_CONNECTION_STR = None
+# Configuración de la instancia por defecto
+DEFAULT_CONFIG = None
 
 def set_default_instance(config):
     """
-    Configura la cadena de conexión a partir del diccionario 'config'.
+    Configura la instancia por defecto a partir del diccionario 'config'.
     
     Parámetros esperados:
       - login: Usuario de acceso a la base de datos.
@@ -25,23 +24,23 @@ def set_default_instance(config):
           'server_name': 'SERVIDOR\\INSTANCIA'  # Por ejemplo: 'SERVERDOS\\SERVERSQL_DOS'
       }
     """
-    global DEFAULT_CONNECTION_STR
-    password_enc = quote_plus(config['password'])
+    global DEFAULT_CONFIG
     # Se fija la base de datos en 'BODEGA_DATOS'
-    DEFAULT_CONNECTION_STR = (
-        f"mssql+pyodbc://{config['login']}:{password_enc}@{config['server_name']}/BODEGA_DATOS?driver=SQL+Server"
-    )
+    DEFAULT_CONFIG = dict(config, database='BODEGA_DATOS')
 
-def get_db_connection(connection_str=None):
+def get_db_connection(config=None):
     """
-    Retorna una instancia de engine para la conexión a la base de datos.
-    Se configuran los parámetros del pool de conexiones (pool_size y max_overflow).
+    Retorna el engine compartido de la instancia (ver connect/motores.py): la importación
+    y las consultas de query/consulta.py usan el mismo pool para el mismo destino.
+    La primera vez se abren en segundo plano las conexiones iniciales del pool.
     """
     try:
-        connection_str = connection_str or DEFAULT_CONNECTION_STR
-        if not connection_str:
-            raise ValueError("No se ha configurado el connection string.")
-        return create_engine(connection_str, pool_size=10, max_overflow=20)
+        config = config or DEFAULT_CONFIG
+        if not config:
+            raise ValueError("No se ha configurado la instancia de conexión.")
+        engine = obtener_motor(config)
+        calentar_motor(config, en_segundo_plano=True)
+        return engine
     except Exception as e:
         messagebox.showerror("Error de conexión", f"No se pudo crear el engine: {e}")
         return None
@@ -0,0 +1,377 @@
+# connect/exportacion.py
+import json
+import logging
+import os
+import shutil
+import uuid
+from datetime import datetime
+from urllib.parse import quote
+import duckdb
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from config.config import PARQUET_CONFIG, DUCKDB_CONFIG
+from config.logging_config import medir_etapa
+from model.almacen_resultados import AlmacenResultados
+from query.sql import COLUMNAS_CLAVE, obtener_consulta_ordenada, origen_parquet
+
+logger = logging.getLogger("ImportacionLogger")
+
+class EscritorParquet:
+    """
+    Escribe un archivo Parquet por lotes, sin reunir antes todo el resultado en memoria.
+
+    El archivo se abre con el esquema del primer lote y cada lote siguiente se agrega como
+    uno o más grupos de filas (de hasta 'row_group_size' filas), de modo que la memoria
+    usada depende del tamaño del lote y no del archivo. Se escribe en un temporal que
+    reemplaza a 'ruta' al cerrar; si ocurre un error dentro del bloque 'with', el temporal
+    se descarta. Se usa como context manager:
+
+        with EscritorParquet("datos.parquet") as escritor:
+            for _, df in importar_datos_generator(...):
+                escritor.escribir(df)
+
+    Parámetros:
+      ruta (str): Archivo de destino.
+      row_group_size (int): Máximo de filas por grupo de filas.
+      compression (str): Códec ('zstd', 'snappy', 'gzip', 'lz4', 'brotli' o 'none').
+      compression_level (int): Nivel del códec, si lo admite.
+      use_dictionary (bool | list): Codificación por diccionario para todas las columnas o solo las indicadas.
+      ordenar_por (list): Columnas por las que se ordena cada lote antes de escribirlo; el
+                          orden queda declarado en los metadatos de los grupos de filas.
+    Los parámetros no indicados se toman de PARQUET_CONFIG.
+    """
+    def __init__(self, ruta, row_group_size=None, compression=None, compression_level=None,
+                 use_dictionary=None, ordenar_por=None):
+        self.ruta = ruta
+        self.row_group_size = row_group_size or PARQUET_CONFIG['row_group_size']
+        self.compression = compression or PARQUET_CONFIG['compression']
+        self.compression_level = (compression_level if compression_level is not None
+                                  else PARQUET_CONFIG.get('compression_level'))
+        self.use_dictionary = use_dictionary if use_dictionary is not None else PARQUET_CONFIG['use_dictionary']
+        self.ordenar_por = list(ordenar_por or PARQUET_CONFIG.get('ordenar_por') or [])
+        self.filas = 0
+        self._writer = None
+        self._temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"  # Se renombra a 'ruta' al cerrar sin errores
+        self._esquema_vacio = None  # Esquema de un lote vacío, para crear el archivo aunque no haya filas
+
+    def _abrir(self, esquema):
+        opciones = {}
+        if self.ordenar_por:
+            opciones['sorting_columns'] = pq.SortingColumn.from_ordering(
+                esquema, [(c, "ascending") for c in self.ordenar_por]
+            )
+        self._writer = pq.ParquetWriter(
+            self._temporal, esquema,
+            compression=self.compression,
+            compression_level=self.compression_level,
+            use_dictionary=self.use_dictionary,
+            **opciones
+        )
+
+    @staticmethod
+    def _esquema_archivo(esquema):
+        """
+        Esquema del archivo a partir del primer lote: los decimales pasan a float64 y los
+        diccionarios (columnas categóricas) usan índices int32, para que los lotes siguientes
+        con más categorías tengan el mismo tipo.
+        """
+        campos = []
+        for campo in esquema:
+            if pa.types.is_decimal(campo.type):
+                campo = pa.field(campo.name, pa.float64())
+            elif pa.types.is_dictionary(campo.type):
+                campo = pa.field(campo.name, pa.dictionary(pa.int32(), campo.type.value_type))
+            campos.append(campo)
+        return pa.schema(campos, metadata=esquema.metadata)
+
+    def _a_tabla(self, lote):
+        """
+        Convierte el lote a pyarrow.Table con el esquema del archivo (el del primer lote).
+        El esquema de un Parquet no puede cambiar a mitad del archivo: si una columna de
+        punto flotante de un lote no cabe sin pérdida en el tipo fijado (por ejemplo,
+        float64 sobre un archivo float32) se lanza ValueError en lugar de redondearla.
+        """
+        esquema = self._writer.schema if self._writer is not None else None
+        if isinstance(lote, pa.RecordBatch):
+            lote = pa.Table.from_batches([lote])
+        if not isinstance(lote, pa.Table):
+            lote = pa.Table.from_pandas(lote, preserve_index=False)
+        if esquema is None:
+            esquema = self._esquema_archivo(lote.schema)
+        lote = lote.select(esquema.names)
+        for campo, columna in zip(esquema, lote.columns):
+            if pa.types.is_floating(campo.type) and columna.type != campo.type and pa.types.is_floating(columna.type):
+                vuelta = columna.cast(campo.type).cast(columna.type)
+                if not np.array_equal(vuelta.to_numpy(), columna.to_numpy(), equal_nan=True):
+                    raise ValueError(f"La columna {campo.name} no cabe en {campo.type} sin pérdida "
+                                     f"(el archivo fijó ese tipo con el primer lote).")
+        return lote.cast(esquema)
+
+    def _ordenar(self, tabla):
+        """
+        Ordena la tabla por 'ordenar_por'. Arrow no ordena columnas de diccionario (las
+        categóricas de pandas), por lo que esas claves se comparan por su valor decodificado.
+        """
+        claves = pa.table({
+            c: tabla[c].cast(tabla[c].type.value_type) if pa.types.is_dictionary(tabla[c].type) else tabla[c]
+            for c in self.ordenar_por
+        })
+        return tabla.take(pc.sort_indices(claves, sort_keys=[(c, "ascending") for c in self.ordenar_por]))
+
+    def escribir(self, lote):
+        """
+        Agrega un lote (DataFrame, pyarrow.RecordBatch o pyarrow.Table) al archivo.
+
+        Retorna:
+          int: Filas escritas.
+        """
+        if lote is None:
+            return 0
+        if len(lote) == 0:
+            if self._writer is None and self._esquema_vacio is None:
+                self._esquema_vacio = self._a_tabla(lote).schema
+            return 0
+        with medir_etapa("exportacion", "parquet"):
+            tabla = self._a_tabla(lote)
+            if self.ordenar_por:
+                tabla = self._ordenar(tabla)
+            if self._writer is None:
+                self._abrir(tabla.schema)
+            self._writer.write_table(tabla, row_group_size=self.row_group_size)
+        self.filas += tabla.num_rows
+        return tabla.num_rows
+
+    def escribir_lotes(self, lotes):
+        """Escribe todos los lotes de un iterable (acepta también tuplas (offset, lote))."""
+        for lote in lotes:
+            self.escribir(lote[1] if isinstance(lote, tuple) else lote)
+        return self.filas
+
+    def cerrar(self):
+        """Cierra el archivo. Si solo llegaron lotes vacíos, se crea sin filas con su esquema."""
+        if self._writer is None and self._esquema_vacio is not None:
+            self._abrir(self._esquema_vacio)
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            os.replace(self._temporal, self.ruta)
+            logger.info(f"Parquet '{self.ruta}' escrito con {self.filas} filas.")
+
+    def descartar(self):
+        """Cierra y elimina el archivo a medio escribir; 'ruta' queda como estaba."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        try:
+            os.remove(self._temporal)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.cerrar()
+        else:
+            self.descartar()
+        return False
+
+def escribir_parquet(datos, ruta, particionar_por=None, **opciones):
+    """
+    Escribe en 'ruta' un DataFrame, un AlmacenResultados (bloque a bloque) o un iterable
+    de lotes, con las opciones de EscritorParquet. Con 'particionar_por' escribe un
+    dataset particionado en el directorio 'ruta' (ver EscritorDatasetParticionado).
+
+    Retorna:
+      int: Filas escritas.
+    """
+    if isinstance(datos, AlmacenResultados):
+        datos = datos.iterar_bloques() if datos.num_bloques else [datos.a_dataframe()]
+    elif not hasattr(datos, "__iter__") or hasattr(datos, "columns"):
+        datos = [datos]
+    with crear_escritor(ruta, particionar_por, **opciones) as escritor:
+        return escritor.escribir_lotes(datos)
+
+# Valor de directorio para las claves de partición nulas, el mismo que usan Hive y pyarrow.
+VALOR_NULO_PARTICION = "__HIVE_DEFAULT_PARTITION__"
+MANIFIESTO_DATASET = "_manifiesto.json"
+
+def _valor_particion(valor):
+    """Texto del valor en el nombre del directorio de la partición."""
+    if valor is None or (isinstance(valor, float) and valor != valor):
+        return VALOR_NULO_PARTICION
+    return quote(str(valor), safe=" -_.,()")
+
+class EscritorDatasetParticionado:
+    """
+    Escribe por lotes un dataset Parquet particionado al estilo Hive, por ejemplo
+    <directorio>/Region=Norte/CodigoMarca=M001/parte-0.parquet.
+
+    Los lotes llegan ordenados por la clave de la importación, no por partición: escribirlos
+    tal cual repartiría cada partición en muchos archivos y grupos de filas pequeños. Por eso
+    se acumulan primero en un único Parquet temporal y, al cerrar, DuckDB lo recorre ordenado
+    por las columnas de partición y 'ordenar_por' (fuera de memoria si hace falta), de modo
+    que cada partición se escribe de una vez en un solo archivo parte-0 con grupos de filas
+    completos. Las columnas de partición no se guardan dentro de los archivos (van en la
+    ruta), y como cada archivo queda ordenado por 'ordenar_por' (por defecto, COLUMNAS_CLAVE
+    sin las columnas de partición) las estadísticas min/max de sus grupos de filas permiten
+    saltarlos. Al cerrar se escribe MANIFIESTO_DATASET con los archivos, sus valores de
+    partición, filas y el mínimo y máximo de las columnas de orden.
+
+    El dataset se construye en un directorio temporal que reemplaza a 'directorio' al
+    cerrar; ante un error dentro del bloque 'with' se descarta.
+    """
+    def __init__(self, directorio, particionar_por=("Region", "CodigoMarca"), ordenar_por=None, **opciones):
+        self.directorio = directorio
+        self.particionar_por = list(particionar_por)
+        if ordenar_por is None:
+            ordenar_por = [c for c in COLUMNAS_CLAVE if c not in self.particionar_por]
+        self.ordenar_por = list(ordenar_por)
+        self.opciones = opciones
+        self.filas = 0
+        self._temporal = f"{directorio}.{uuid.uuid4().hex}.tmp"
+        self._lotes = EscritorParquet(os.path.join(self._temporal, "_lotes.parquet"), **opciones)
+        self._abierto = None   # (clave de partición, EscritorParquet, entrada del manifiesto) en escritura
+        self._archivos = []    # Entradas del manifiesto de los archivos cerrados
+
+    def _ruta_relativa(self, clave):
+        carpetas = [f"{col}={_valor_particion(v)}" for col, v in zip(self.particionar_por, clave)]
+        return os.path.join(*carpetas, "parte-0.parquet")
+
+    def _escritor(self, clave):
+        """
+        Retorna el escritor de la partición. Como las filas llegan ordenadas por partición,
+        al cambiar de clave la anterior ya está completa y su archivo se cierra.
+        """
+        if self._abierto is not None and self._abierto[0] == clave:
+            return self._abierto[1], self._abierto[2]
+        self._cerrar_abierto()
+        relativa = self._ruta_relativa(clave)
+        os.makedirs(os.path.join(self._temporal, os.path.dirname(relativa)), exist_ok=True)
+        escritor = EscritorParquet(os.path.join(self._temporal, relativa), ordenar_por=self.ordenar_por,
+                                   **self.opciones)
+        entrada = {"archivo": relativa.replace(os.sep, "/"), "filas": 0, "min": {}, "max": {}}
+        entrada.update({col: (None if v is None else str(v)) for col, v in zip(self.particionar_por, clave)})
+        self._abierto = (clave, escritor, entrada)
+        return escritor, entrada
+
+    def _cerrar_abierto(self):
+        if self._abierto is None:
+            return
+        _, escritor, entrada = self._abierto
+        self._abierto = None
+        escritor.cerrar()
+        entrada["filas"] = escritor.filas
+        self._archivos.append(entrada)
+
+    @staticmethod
+    def _escalar(valor):
+        return valor.item() if hasattr(valor, "item") else valor
+
+    def escribir(self, lote):
+        """Agrega el lote (DataFrame o lote Arrow) al dataset. Retorna las filas escritas."""
+        if lote is None or len(lote) == 0:
+            return 0
+        os.makedirs(self._temporal, exist_ok=True)
+        filas = self._lotes.escribir(lote)
+        self.filas += filas
+        return filas
+
+    def escribir_lotes(self, lotes):
+        """Escribe todos los lotes de un iterable (acepta también tuplas (offset, lote))."""
+        for lote in lotes:
+            self.escribir(lote[1] if isinstance(lote, tuple) else lote)
+        return self.filas
+
+    def _repartir(self, df):
+        """Escribe un tramo ya ordenado por partición en el archivo de cada partición."""
+        for clave, grupo in df.groupby(self.particionar_por, dropna=False, sort=False, observed=True):
+            clave = tuple(None if pd.isna(v) else v for v in (clave if isinstance(clave, tuple) else (clave,)))
+            escritor, entrada = self._escritor(clave)
+            escritor.escribir(grupo.drop(columns=self.particionar_por))
+            for col in self.ordenar_por:
+                # Las categóricas no ordenadas no admiten min/max: se comparan por valor
+                valores = grupo[col].dropna()
+                if isinstance(valores.dtype, pd.CategoricalDtype):
+                    valores = valores.astype(valores.cat.categories.dtype)
+                if valores.empty:
+                    continue
+                minimo, maximo = self._escalar(valores.min()), self._escalar(valores.max())
+                entrada["min"][col] = minimo if col not in entrada["min"] else min(entrada["min"][col], minimo)
+                entrada["max"][col] = maximo if col not in entrada["max"] else max(entrada["max"][col], maximo)
+
+    def _escribir_particiones(self):
+        """Recorre los lotes acumulados ordenados por partición y escribe cada partición."""
+        self._lotes.cerrar()
+        if not os.path.exists(self._lotes.ruta):
+            return
+        ajustes = {k: v for k, v in DUCKDB_CONFIG.items() if v is not None}
+        ajustes["temp_directory"] = os.path.join(self._temporal, "_orden.tmp")
+        con = duckdb.connect(config=ajustes)
+        try:
+            consulta = obtener_consulta_ordenada(origen_parquet(self._lotes.ruta), self.particionar_por + self.ordenar_por)
+            tamano = self.opciones.get("row_group_size") or PARQUET_CONFIG['row_group_size']
+            with medir_etapa("exportacion", "particionar"):
+                for lote in con.execute(consulta).fetch_record_batch(tamano):
+                    # Con tipos Arrow cada partición conserva exactamente el esquema de los lotes
+                    self._repartir(pa.Table.from_batches([lote]).to_pandas(types_mapper=pd.ArrowDtype))
+            self._cerrar_abierto()
+        finally:
+            con.close()
+            os.remove(self._lotes.ruta)
+            shutil.rmtree(ajustes["temp_directory"], ignore_errors=True)
+
+    def cerrar(self):
+        """Escribe las particiones y el manifiesto y publica el dataset en 'directorio'."""
+        os.makedirs(self._temporal, exist_ok=True)
+        self._escribir_particiones()
+        manifiesto = {
+            "creado": datetime.now().isoformat(timespec="seconds"),
+            "particionado_por": self.particionar_por,
+            "ordenado_por": self.ordenar_por,
+            "filas": self.filas,
+            "particiones": len(self._archivos),
+            "archivos": sorted(self._archivos, key=lambda e: e["archivo"]),
+        }
+        with open(os.path.join(self._temporal, MANIFIESTO_DATASET), "w", encoding="utf-8") as f:
+            json.dump(manifiesto, f, ensure_ascii=False, indent=2, default=str)
+        if os.path.isdir(self.directorio):
+            shutil.rmtree(self.directorio)
+        os.replace(self._temporal, self.directorio)
+        logger.info(f"Dataset '{self.directorio}' escrito con {self.filas} filas en {len(self._archivos)} archivos.")
+
+    def descartar(self):
+        """Descarta el dataset a medio escribir; 'directorio' queda como estaba."""
+        self._lotes.descartar()
+        if self._abierto is not None:
+            self._abierto[1].descartar()
+            self._abierto = None
+        shutil.rmtree(self._temporal, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, traza):
+        if tipo is None:
+            self.cerrar()
+        else:
+            self.descartar()
+        return False
+
+def leer_manifiesto(directorio):
+    """Retorna el manifiesto de un dataset escrito con EscritorDatasetParticionado."""
+    with open(os.path.join(directorio, MANIFIESTO_DATASET), encoding="utf-8") as f:
+        return json.load(f)
+
+def crear_escritor(ruta, particionar_por=None, **opciones):
+    """
+    Retorna un EscritorParquet para 'ruta', o un EscritorDatasetParticionado si se indican
+    columnas de partición (en ese caso 'ruta' es el directorio del dataset).
+    """
+    if particionar_por:
+        return EscritorDatasetParticionado(ruta, particionar_por, **opciones)
+    return EscritorParquet(ruta, **opciones)
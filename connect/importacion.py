@@ -7,11 +7,29 @@ if parent_dir not in sys.path:
     sys.path.insert(0, parent_dir)
 
 import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 import pandas as pd
+import pyarrow as pa
 import duckdb
-from tenacity import retry, stop_after_attempt, wait_exponential, RetryError
-from config.logging_config import logger, REQUEST_TIME, ERROR_COUNT
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_not_exception_type, RetryError
+from config.logging_config import logger, REQUEST_TIME, ERROR_COUNT, LOTES_EN_VUELO
+from config.logging_config import medir_etapa, registrar_lote, registrar_espera_reintento, etiqueta_destino
+from connect.conexion_duckdb import obtener_cursor, obtener_gestor, es_interrupcion
+from connect.exportacion import crear_escritor, escribir_parquet
 from query.sql import obtener_consulta_importacion  # Se importa la función que genera la consulta completa
+from query.sql import obtener_consulta_importacion_completa
+from query.cache_resultados import obtener_cache, destino_conexion, destino_archivo
+from query.esquema import EsquemaImportacion
+from query.sql import obtener_consulta_importacion_keyset, obtener_ultima_clave
+from query.sql import origen_dataset, _validar_identificador
+from query.sql import FILTROS_INVENTARIO, obtener_consulta_inventario
+from query.sql import (
+    TABLA_REGISTRO_SNAPSHOTS, nombre_tabla_snapshot,
+    obtener_consulta_snapshot, obtener_consulta_pagina_snapshot
+)
 
 def obtener_datos(config, offset, limit):
     """
@@ -39,60 +57,468 @@ def obtener_datos(config, offset, limit):
     
     logger.debug(f"Ejecutando consulta SQL con OFFSET {offset} y LIMIT {limit}:\n{consulta}")
     
-    # Extraer la ruta de la base de datos de la configuración; si no se indica, se usa ":memory:"
-    db_path = config.get("database", ":memory:")
-    
-    try:
-        # Conectarse a la base de datos; se elimina read_only para permitir la creación si es necesario.
-        with duckdb.connect(database=db_path) as con:
-            df = con.execute(consulta).fetchdf()
-        return df
-    except Exception as e:
-        logger.error(f"Error ejecutando la consulta SQL: {e}", exc_info=True)
-        return pd.DataFrame()
+    def ejecutar():
+        try:
+            # Cursor del hilo actual sobre la conexión compartida a la base indicada en config['database']
+            con = obtener_cursor(config)
+            with medir_etapa("consulta", "offset", config):
+                resultado = con.execute(consulta)
+            with medir_etapa("lectura", "offset", config):
+                return resultado.fetchdf()
+        except duckdb.InterruptException:
+            raise  # Una cancelación no se convierte en bloque vacío: no debe reintentarse
+        except Exception as e:
+            logger.error(f"Error ejecutando la consulta SQL: {e}", exc_info=True)
+            return pd.DataFrame()
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10))
+    # Una consulta repetida dentro del TTL se sirve desde la caché local de resultados
+    return obtener_cache().obtener_o_calcular(consulta, None, destino_conexion(config), ejecutar)
+
+# Las consultas interrumpidas (cancelación de la importación) no se reintentan.
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10),
+       retry=retry_if_not_exception_type(duckdb.InterruptException),
+       before_sleep=registrar_espera_reintento)
 def obtener_datos_con_reintento(config, offset, limit):
     df = obtener_datos(config, offset, limit)
     if df.empty:
         raise ValueError("No se obtuvo data o está vacía")
     return df
 
-def importar_datos_generator(config, total_rows, batch_size):
+def obtener_datos_keyset(config, ultima_clave=None, limit=10000):
     """
-    Generador que devuelve datos en bloques (offset, DataFrame) usando la consulta dinámica.
-    Se aplican reintentos para cada bloque para asegurar que, aunque la consulta no devuelva
-    resultados, se intente nuevamente.
+    Ejecuta la consulta de importación paginada por keyset y devuelve el bloque siguiente
+    a 'ultima_clave'.
+
+    A diferencia de obtener_datos, los errores se propagan en lugar de devolver un
+    DataFrame vacío: así un bloque vacío significa que no quedan filas y solo los
+    errores reales provocan reintentos.
+
+    Parámetros:
+      config (dict): Diccionario de configuración con la clave 'database'.
+      ultima_clave (tuple): Clave de la última fila del bloque anterior, o None para el primero.
+      limit (int): Número de filas a retornar.
+
+    Retorna:
+      DataFrame: El bloque obtenido (vacío si no quedan filas).
     """
-    for offset in range(0, total_rows, batch_size):
+    consulta, parametros = obtener_consulta_importacion_keyset(ultima_clave, limit)
+    logger.debug(f"Ejecutando consulta SQL por keyset después de {ultima_clave} con LIMIT {limit}:\n{consulta}")
+
+    con = obtener_cursor(config)
+    with medir_etapa("consulta", "keyset", config):
+        resultado = con.execute(consulta, parametros)
+    with medir_etapa("lectura", "keyset", config):
+        return resultado.fetchdf()
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=2, max=10),
+       retry=retry_if_not_exception_type(duckdb.InterruptException),
+       before_sleep=registrar_espera_reintento)
+def obtener_datos_keyset_con_reintento(config, ultima_clave, limit):
+    return obtener_datos_keyset(config, ultima_clave, limit)
+
+def _asegurar_registro_snapshots(con):
+    """Crea, si no existe, la tabla que registra los snapshots de importación."""
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {TABLA_REGISTRO_SNAPSHOTS} ("
+        "import_id VARCHAR PRIMARY KEY, tabla VARCHAR, filas BIGINT, creado TIMESTAMP)"
+    )
+
+def crear_snapshot_importacion(config, import_id=None):
+    """
+    Ejecuta QUERY_IMPORTACION una única vez y guarda el resultado en una tabla DuckDB
+    persistente asociada a la importación, de modo que todas las páginas posteriores
+    se sirvan desde la misma foto consistente sin repetir los joins ni la agregación.
+
+    La tabla se crea en la base indicada por config['database']; con ":memory:" el
+    snapshot solo vive mientras dure el proceso.
+
+    Parámetros:
+      config (dict): Diccionario de configuración con la clave 'database'.
+      import_id (str): Identificador de la importación; si no se indica se genera uno.
+
+    Retorna:
+      str: El identificador de la importación.
+    """
+    import_id = import_id or uuid.uuid4().hex[:12]
+    tabla = nombre_tabla_snapshot(import_id)
+
+    inicio = time.time()
+    con = obtener_cursor(config)
+    try:
+        with medir_etapa("consulta", "crear_snapshot", config):
+            con.execute(obtener_consulta_snapshot(import_id))
+        filas = con.execute(f"SELECT COUNT(*) FROM {tabla}").fetchone()[0]
+        _asegurar_registro_snapshots(con)
+        con.execute(
+            f"INSERT OR REPLACE INTO {TABLA_REGISTRO_SNAPSHOTS} VALUES (?, ?, ?, now())",
+            [import_id, tabla, filas]
+        )
+    except Exception:
+        # Un snapshot sin registrar no lo usaría nadie: no se deja la tabla en la base
+        eliminar_snapshot_importacion(config, import_id)
+        raise
+    fin = time.time()
+    logger.info(f"Snapshot {import_id} creado con {filas} filas en {fin - inicio:.2f} segundos.")
+    return import_id
+
+def contar_filas_snapshot(config, import_id):
+    """
+    Retorna el número de filas del snapshot de una importación, o 0 si no existe.
+    """
+    try:
+        con = obtener_cursor(config)
+        fila = con.execute(
+            f"SELECT filas FROM {TABLA_REGISTRO_SNAPSHOTS} WHERE import_id = ?", [import_id]
+        ).fetchone()
+        return fila[0] if fila else 0
+    except Exception as e:
+        logger.error(f"Error consultando el snapshot {import_id}: {e}", exc_info=True)
+        return 0
+
+def obtener_datos_snapshot(config, import_id, offset, limit):
+    """
+    Devuelve una página del snapshot de una importación.
+
+    Parámetros:
+      config (dict): Diccionario de configuración con la clave 'database'.
+      import_id (str): Identificador devuelto por crear_snapshot_importacion.
+      offset (int): Número de filas a saltar.
+      limit (int): Número de filas a retornar.
+
+    Retorna:
+      DataFrame: La página solicitada; vacío si no hay más filas o si ocurre un error.
+    """
+    consulta, parametros = obtener_consulta_pagina_snapshot(import_id, offset, limit)
+    try:
+        con = obtener_cursor(config)
+        with medir_etapa("consulta", "snapshot", config):
+            resultado = con.execute(consulta, parametros)
+        with medir_etapa("lectura", "snapshot", config):
+            return resultado.fetchdf()
+    except duckdb.InterruptException:
+        raise
+    except Exception as e:
+        logger.error(f"Error leyendo el snapshot {import_id} en OFFSET {offset}: {e}", exc_info=True)
+        return pd.DataFrame()
+
+def eliminar_snapshot_importacion(config, import_id):
+    """
+    Elimina la tabla del snapshot y su entrada en el registro.
+    """
+    tabla = nombre_tabla_snapshot(import_id)
+    try:
+        con = obtener_cursor(config)
+        con.execute(f"DROP TABLE IF EXISTS {tabla}")
+        _asegurar_registro_snapshots(con)
+        con.execute(f"DELETE FROM {TABLA_REGISTRO_SNAPSHOTS} WHERE import_id = ?", [import_id])
+        logger.info(f"Snapshot {import_id} eliminado.")
+    except Exception as e:
+        logger.error(f"Error eliminando el snapshot {import_id}: {e}", exc_info=True)
+
+def _importar_snapshot(config, total_rows, batch_size, import_id, workers=1, en_vuelo=None):
+    """
+    Recorre por páginas el snapshot de una importación, creándolo si no se indica uno.
+    """
+    if import_id is None:
         try:
-            inicio = time.time()
-            df = obtener_datos_con_reintento(config, offset, batch_size)
+            import_id = crear_snapshot_importacion(config)
+        except Exception as e:
+            ERROR_COUNT.inc()
+            logger.error(f"Error creando el snapshot de la importación: {e}", exc_info=True)
+            return
+
+    filas = min(total_rows, contar_filas_snapshot(config, import_id))
+    if workers > 1:
+        def leer_pagina(offset):
+            df = obtener_datos_snapshot(config, import_id, offset, min(batch_size, filas - offset))
+            if df.empty:
+                raise ValueError(f"El snapshot {import_id} no devolvió datos")
+            return df
+        yield from _importar_concurrente(leer_pagina, range(0, filas, batch_size), workers, en_vuelo, config)
+        return
+
+    for offset in range(0, filas, batch_size):
+        inicio = time.time()
+        try:
+            df = obtener_datos_snapshot(config, import_id, offset, min(batch_size, filas - offset))
+        except duckdb.InterruptException:
+            logger.info(f"Importación interrumpida en OFFSET {offset}.")
+            return
+        fin = time.time()
+        if df.empty:
+            ERROR_COUNT.inc()
+            logger.error(f"El snapshot {import_id} no devolvió datos en OFFSET {offset}.")
+            return
+        logger.info(f"Bloque OFFSET {offset} leído del snapshot {import_id} en {fin - inicio:.2f} segundos.")
+        yield offset, df
+
+def _importar_concurrente(obtener_bloque, offsets, workers, en_vuelo=None, config=None):
+    """
+    Obtiene bloques en paralelo en un pool de hilos y los entrega en orden de offset.
+
+    Como máximo hay 'en_vuelo' bloques lanzados o pendientes de entregar (por defecto el
+    doble de 'workers'), de modo que la memoria queda acotada aunque el consumidor sea
+    más lento que la red. Cada bloque conserva su propio manejo de errores: un bloque
+    fallido se registra, incrementa ERROR_COUNT y se omite sin detener a los demás.
+
+    Parámetros:
+      obtener_bloque (callable): Función offset -> DataFrame que aplica sus propios reintentos.
+      offsets (iterable): Offsets a obtener, en el orden de entrega.
+      workers (int): Número de hilos.
+      en_vuelo (int): Máximo de bloques en curso.
+      config (dict): Configuración de conexión; solo etiqueta el gauge LOTES_EN_VUELO.
+
+    Yields:
+      tuple: (offset, DataFrame) en el mismo orden que 'offsets'.
+    """
+    def tarea(offset):
+        inicio = time.time()
+        df = obtener_bloque(offset)
+        return df, time.time() - inicio
+
+    en_vuelo = max(en_vuelo or 2 * workers, 1)
+    en_curso = LOTES_EN_VUELO.labels(etiqueta_destino(config))
+    offsets = iter(offsets)
+    pendientes = deque()
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="importacion") as ejecutor:
+        try:
+            for offset in islice(offsets, en_vuelo):
+                pendientes.append((offset, ejecutor.submit(tarea, offset)))
+                en_curso.inc()
+
+            while pendientes:
+                offset, futuro = pendientes.popleft()
+                siguiente = next(offsets, None)
+                if siguiente is not None:
+                    pendientes.append((siguiente, ejecutor.submit(tarea, siguiente)))
+                    en_curso.inc()
+                try:
+                    df, segundos = futuro.result()
+                except duckdb.InterruptException:
+                    logger.info(f"Importación interrumpida en OFFSET {offset}.")
+                    return
+                except RetryError as re:
+                    ERROR_COUNT.inc()
+                    logger.error(f"Error en OFFSET {offset} tras varios intentos: {re}")
+                    continue
+                except Exception as e:
+                    ERROR_COUNT.inc()
+                    logger.error(f"Error inesperado en OFFSET {offset}: {e}", exc_info=True)
+                    continue
+                finally:
+                    en_curso.dec()
+                logger.info(f"Bloque OFFSET {offset} importado en {segundos:.2f} segundos.")
+                yield offset, df
+        finally:
+            # Si el consumidor abandona el generador, no se lanzan los bloques aún en cola.
+            for _, futuro in pendientes:
+                futuro.cancel()
+            en_curso.dec(len(pendientes))
+
+def iterar_lotes_arrow(config, batch_size=10000, consulta=None, parametros=None):
+    """
+    Ejecuta la consulta una sola vez y entrega el resultado como pyarrow.RecordBatch de
+    'batch_size' filas, leídos directamente del lector de lotes de DuckDB. No se
+    materializa el resultado completo ni se convierte a pandas: cada lote se libera
+    cuando el consumidor deja de referenciarlo.
+
+    Se usa un cursor propio durante la lectura para que otras consultas del mismo hilo
+    no invaliden el flujo.
+
+    Parámetros:
+      config (dict): Diccionario de configuración con la clave 'database'.
+      batch_size (int): Filas por lote.
+      consulta (str): Consulta a ejecutar; por defecto la consulta de importación completa.
+      parametros (list): Parámetros de la consulta, si los tiene.
+
+    Yields:
+      pyarrow.RecordBatch: Lotes del resultado en orden.
+    """
+    consulta = consulta or obtener_consulta_importacion_completa()
+    gestor = obtener_gestor(config.get("database", ":memory:"))
+    con = gestor.cursor_dedicado()
+    try:
+        with medir_etapa("consulta", "flujo", config):
+            lector = con.execute(consulta, parametros or []).fetch_record_batch(batch_size)
+        lotes = iter(lector)
+        while True:
+            with medir_etapa("lectura", "flujo", config):
+                lote = next(lotes, None)
+            if lote is None:
+                return
+            yield lote
+    finally:
+        gestor.liberar_cursor(con)
+
+def arrow_a_pandas(datos):
+    """
+    Convierte un pyarrow.RecordBatch o pyarrow.Table a DataFrame con los mismos tipos
+    que produce fetchdf: las sumas que DuckDB entrega como decimales (HUGEINT) pasan
+    a float64 en lugar de quedar como objetos Decimal.
+    """
+    esquema = pa.schema([
+        pa.field(f.name, pa.float64()) if pa.types.is_decimal(f.type) else f
+        for f in datos.schema
+    ])
+    if esquema != datos.schema:
+        datos = datos.cast(esquema)
+    return datos.to_pandas()
+
+def importar_datos_arrow(config, total_rows=50000, batch_size=10000):
+    """
+    Importa hasta 'total_rows' filas en una única ejecución y las devuelve como
+    pyarrow.Table sin copiar los lotes. El llamador decide si convertir a pandas
+    con arrow_a_pandas.
+    """
+    lotes = []
+    filas = 0
+    try:
+        for lote in iterar_lotes_arrow(config, batch_size):
+            lotes.append(lote.slice(0, total_rows - filas))
+            filas += len(lotes[-1])
+            if filas >= total_rows:
+                break
+    except Exception as e:
+        ERROR_COUNT.inc()
+        logger.error(f"Error en la importación por flujo Arrow: {e}", exc_info=True)
+    if not lotes:
+        return None
+    return pa.Table.from_batches(lotes)
+
+def _importar_flujo(config, total_rows, batch_size):
+    """
+    Recorre la importación con una sola ejecución de la consulta, convirtiendo a pandas
+    cada RecordBatch a medida que llega.
+    """
+    offset = 0
+    try:
+        inicio = time.time()
+        for lote in iterar_lotes_arrow(config, batch_size):
+            lote = lote.slice(0, total_rows - offset)
+            with medir_etapa("conversion", "flujo", config):
+                df = arrow_a_pandas(lote)
             fin = time.time()
             logger.info(f"Bloque OFFSET {offset} importado en {fin - inicio:.2f} segundos.")
             yield offset, df
+            offset += len(df)
+            if offset >= total_rows:
+                return
+            inicio = time.time()
+    except Exception as e:
+        if es_interrupcion(e):
+            logger.info(f"Importación interrumpida en OFFSET {offset}.")
+            return
+        ERROR_COUNT.inc()
+        logger.error(f"Error inesperado en OFFSET {offset}: {e}", exc_info=True)
+
+def _importar_keyset(config, total_rows, batch_size):
+    """
+    Recorre la importación por keyset: cada bloque arranca en la última clave del anterior,
+    por lo que el costo por página se mantiene constante. Un bloque fallido detiene la
+    importación, ya que sin su última clave no se puede continuar.
+    """
+    ultima_clave = None
+    offset = 0
+    while offset < total_rows:
+        limite = min(batch_size, total_rows - offset)
+        try:
+            inicio = time.time()
+            df = obtener_datos_keyset_con_reintento(config, ultima_clave, limite)
+            fin = time.time()
+        except duckdb.InterruptException:
+            logger.info(f"Importación interrumpida en OFFSET {offset}.")
+            return
         except RetryError as re:
             ERROR_COUNT.inc()
             logger.error(f"Error en OFFSET {offset} tras varios intentos: {re}")
-            continue
+            return
         except Exception as e:
             ERROR_COUNT.inc()
             logger.error(f"Error inesperado en OFFSET {offset}: {e}", exc_info=True)
-            continue
+            return
+
+        if df.empty:
+            return
+        logger.info(f"Bloque OFFSET {offset} importado en {fin - inicio:.2f} segundos.")
+        yield offset, df
 
-def importar_datos_con_metricas(config, total_rows=50000, batch_size=10000):
+        if len(df) < limite:
+            return
+        ultima_clave = obtener_ultima_clave(df)
+        offset += len(df)
+
+def _medir_lotes(lotes, paginacion, config, esquema=None):
     """
-    Ejecuta la consulta dinámica de forma paginada y concatena todos los bloques en un único DataFrame.
-    Así, cualquier cambio en el SQL se refleja automáticamente en los datos extraídos.
+    Aplica el esquema compacto a cada bloque de un generador de importación y registra
+    sus métricas: la conversión en ETAPA_SEGUNDOS, las filas y bytes entregados, y en
+    REQUEST_TIME el tiempo total de obtención del bloque. Al cerrarse cierra 'lotes',
+    de modo que el cursor de la importación se libera aunque el consumidor la abandone.
+    """
+    try:
+        inicio = time.time()
+        for offset, df in lotes:
+            if esquema is not None:
+                with medir_etapa("conversion", paginacion, config):
+                    df = esquema.aplicar(df)
+            registrar_lote(paginacion, config, df)
+            REQUEST_TIME.observe(time.time() - inicio)
+            yield offset, df
+            inicio = time.time()
+    finally:
+        lotes.close()
+
+def importar_datos_generator(config, total_rows, batch_size, paginacion="keyset", import_id=None,
+                             workers=1, en_vuelo=None, compactar=True):
+    """
+    Generador que devuelve datos en bloques (offset, DataFrame) usando la consulta dinámica.
+    Se aplican reintentos para cada bloque para asegurar que, aunque la consulta no devuelva
+    resultados, se intente nuevamente.
+
+    Parámetros:
+      paginacion (str): 'keyset' (por defecto) continúa desde la última clave de cada bloque;
+                        'offset' usa LIMIT/OFFSET sobre la consulta completa;
+                        'snapshot' ejecuta la consulta una sola vez y pagina desde su snapshot;
+                        'flujo' ejecuta la consulta una sola vez y lee lotes Arrow en streaming.
+      import_id (str): Snapshot existente a recorrer en el modo 'snapshot'.
+      workers (int): En los modos 'offset' y 'snapshot', número de bloques que se obtienen
+                     en paralelo; los bloques se entregan igualmente en orden de offset.
+      en_vuelo (int): Máximo de bloques en curso cuando workers > 1 (por defecto 2 * workers).
+      compactar (bool): Aplica a cada bloque los tipos de ESQUEMA_IMPORTACION (categorías
+                        compartidas entre bloques y numéricos reducidos).
     """
-    bloques = []
+    lotes = _importar_lotes(config, total_rows, batch_size, paginacion, import_id, workers, en_vuelo)
+    yield from _medir_lotes(lotes, paginacion, config, EsquemaImportacion() if compactar else None)
+
+def _importar_lotes(config, total_rows, batch_size, paginacion, import_id=None, workers=1, en_vuelo=None):
+    """Recorre la importación en el modo de paginación indicado (ver importar_datos_generator)."""
+    if paginacion == "flujo":
+        yield from _importar_flujo(config, total_rows, batch_size)
+        return
+    if paginacion == "keyset":
+        yield from _importar_keyset(config, total_rows, batch_size)
+        return
+    if paginacion == "snapshot":
+        yield from _importar_snapshot(config, total_rows, batch_size, import_id, workers, en_vuelo)
+        return
+    if paginacion != "offset":
+        raise ValueError(f"Modo de paginación no soportado: {paginacion}")
+
+    if workers > 1:
+        def obtener_bloque(offset):
+            return obtener_datos_con_reintento(config, offset, batch_size)
+        yield from _importar_concurrente(obtener_bloque, range(0, total_rows, batch_size), workers, en_vuelo, config)
+        return
+
     for offset in range(0, total_rows, batch_size):
         try:
             inicio = time.time()
             df = obtener_datos_con_reintento(config, offset, batch_size)
             fin = time.time()
             logger.info(f"Bloque OFFSET {offset} importado en {fin - inicio:.2f} segundos.")
-            bloques.append(df)
+            yield offset, df
+        except duckdb.InterruptException:
+            logger.info(f"Importación interrumpida en OFFSET {offset}.")
+            return
         except RetryError as re:
             ERROR_COUNT.inc()
             logger.error(f"Error en OFFSET {offset} tras varios intentos: {re}")
@@ -101,37 +527,148 @@ def importar_datos_con_metricas(config, total_rows=50000, batch_size=10000):
             ERROR_COUNT.inc()
             logger.error(f"Error inesperado en OFFSET {offset}: {e}", exc_info=True)
             continue
+
+def importar_datos_con_metricas(config, total_rows=50000, batch_size=10000, paginacion="keyset", import_id=None,
+                                workers=1, en_vuelo=None, compactar=True):
+    """
+    Ejecuta la consulta dinámica de forma paginada y concatena todos los bloques en un único DataFrame.
+    Así, cualquier cambio en el SQL se refleja automáticamente en los datos extraídos.
+    Con compactar=True el resultado usa los tipos de ESQUEMA_IMPORTACION.
+    """
+    esquema = EsquemaImportacion() if compactar else None
+    lotes = _importar_lotes(config, total_rows, batch_size, paginacion, import_id, workers, en_vuelo)
+    bloques = [df for _, df in _medir_lotes(lotes, paginacion, config, esquema)]
+    if esquema is not None:
+        return esquema.concatenar(bloques)
     return pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame()
 
-def exportar_a_parquet(dataframe, filename="datos.parquet"):
+def importar_a_almacen(config, total_rows=50000, batch_size=10000, paginacion="keyset", presupuesto_bytes=None):
+    """
+    Importa los bloques en un AlmacenResultados en lugar de concatenarlos en un DataFrame.
+    Con un presupuesto de memoria (por defecto MEMORIA_CONFIG['presupuesto_bytes']), los
+    bloques más antiguos se descargan a disco al superarlo, por lo que el tamaño de la
+    importación no queda limitado por la RAM disponible. El almacén puede pasarse a
+    exportar_a_parquet o transformar_datos, que lo recorren bloque a bloque.
     """
-    Exporta el DataFrame a un archivo Parquet y retorna su nombre,
-    o None si ocurre algún error.
+    from model.almacen_resultados import AlmacenResultados
+    almacen = AlmacenResultados() if presupuesto_bytes is None else AlmacenResultados(presupuesto_bytes=presupuesto_bytes)
+    for offset, df in importar_datos_generator(config, total_rows, batch_size, paginacion):
+        almacen.agregar(df)
+    logger.info(f"Importación en almacén: {len(almacen)} filas, {almacen.bytes_memoria / 1e6:.1f} MB en memoria "
+                f"y {almacen.bytes_disco / 1e6:.1f} MB en disco.")
+    return almacen
+
+def exportar_a_parquet(dataframe, filename="datos.parquet", **opciones):
+    """
+    Exporta el DataFrame (o un AlmacenResultados, bloque a bloque) a un archivo Parquet
+    y retorna su nombre, o None si ocurre algún error. Las opciones (row_group_size,
+    compression, compression_level, use_dictionary, ordenar_por) son las de EscritorParquet;
+    con particionar_por=[...] se escribe un dataset particionado en el directorio 'filename'.
     """
     try:
-        dataframe.to_parquet(filename, index=False)
+        escribir_parquet(dataframe, filename, **opciones)
         logger.info("Exportación a Parquet completada.")
         return filename
     except Exception as e:
         logger.error(f"Error al exportar a Parquet: {e}", exc_info=True)
         return None
 
-def consulta_con_duckdb(parquet_file, exist_threshold=0):
+def exportar_importacion_a_parquet(config, filename="datos.parquet", total_rows=50000, batch_size=10000,
+                                   paginacion="keyset", particionar_por=None, **opciones):
+    """
+    Importa y exporta a Parquet en streaming: cada bloque de importar_datos_generator se
+    escribe en cuanto llega y se descarta, por lo que el archivo puede ser mayor que la
+    memoria disponible. Con particionar_por (por ejemplo ["Region", "CodigoMarca"]) se
+    escribe un dataset particionado en el directorio 'filename'.
+    Retorna el nombre del archivo o directorio, o None si ocurre algún error.
+    """
+    try:
+        with crear_escritor(filename, particionar_por, **opciones) as escritor:
+            for offset, df in importar_datos_generator(config, total_rows, batch_size, paginacion):
+                escritor.escribir(df)
+        logger.info(f"Exportación a Parquet completada: {escritor.filas} filas.")
+        return filename
+    except Exception as e:
+        ERROR_COUNT.inc()
+        logger.error(f"Error al exportar a Parquet: {e}", exc_info=True)
+        return None
+
+def consulta_con_duckdb(parquet_file, exist_threshold=0, filtros=None):
     """
-    Ejecuta una consulta analítica con DuckDB sobre el archivo Parquet.
+    Ejecuta una consulta analítica con DuckDB sobre el archivo Parquet, o sobre el
+    directorio de un dataset particionado (ver exportar_a_parquet con particionar_por).
+
+    Parámetros:
+      exist_threshold (int): Se retornan las filas con Existencia mayor a este valor.
+      filtros (dict): Igualdades adicionales {columna: valor}. Sobre columnas de partición
+                      DuckDB solo lee los directorios que coinciden; sobre las demás usa
+                      las estadísticas min/max para saltar grupos de filas.
     """
+    condiciones = ["Existencia > ?"]
+    parametros = [exist_threshold]
+    for columna, valor in (filtros or {}).items():
+        condiciones.append(f"{_validar_identificador(columna)} = ?")
+        parametros.append(valor)
     query = f"""
         SELECT *
-        FROM '{parquet_file}'
-        WHERE Existencia > {exist_threshold}
+        FROM {origen_dataset(parquet_file)}
+        WHERE {" AND ".join(condiciones)}
     """
-    try:
-        result_df = duckdb.query(query).to_df()
-        logger.info("Consulta con DuckDB ejecutada correctamente.")
-        return result_df
-    except Exception as e:
-        logger.error(f"Error en la consulta con DuckDB: {e}", exc_info=True)
-        return pd.DataFrame()
+    def ejecutar():
+        try:
+            with medir_etapa("consulta", "parquet"):
+                resultado = duckdb.execute(query, parametros)
+            with medir_etapa("lectura", "parquet"):
+                result_df = resultado.fetchdf()
+            logger.info("Consulta con DuckDB ejecutada correctamente.")
+            return result_df
+        except Exception as e:
+            logger.error(f"Error en la consulta con DuckDB: {e}", exc_info=True)
+            return pd.DataFrame()
+
+    return obtener_cache().obtener_o_calcular(query, parametros, destino_archivo(parquet_file), ejecutar)
+
+def consultar_inventario(parquet_file, columnas=None, limite=None, config=None, **filtros):
+    """
+    Consulta analítica sobre el Parquet (o dataset particionado) exportado, pensada para
+    filtros interactivos: la sentencia usa parámetros '?' y su texto se genera una vez por
+    combinación de filtros activos; al cambiar solo los valores se reutiliza el mismo texto.
+    Se ejecuta con el cursor del hilo sobre la base DuckDB de 'config' (en memoria por
+    defecto), que se mantiene abierto entre consultas.
+
+    Parámetros:
+      filtros: Valores de FILTROS_INVENTARIO (existencia_minima, marca, region, categoria,
+               nombre); los que son None no se aplican.
+      columnas (list): Columnas a retornar (por defecto todas).
+      limite (int): Máximo de filas a retornar.
+
+    Retorna:
+      DataFrame: Filas ordenadas por COLUMNAS_CLAVE, o un DataFrame vacío si ocurre un error.
+    """
+    desconocidos = set(filtros) - set(FILTROS_INVENTARIO)
+    if desconocidos:
+        raise ValueError(f"Filtros no soportados: {sorted(desconocidos)}")
+    activos = tuple(f for f in FILTROS_INVENTARIO if filtros.get(f) is not None)
+    query = obtener_consulta_inventario(
+        origen_dataset(parquet_file), activos, tuple(columnas) if columnas else None, limite is not None
+    )
+    parametros = [filtros[f] for f in activos] + ([limite] if limite is not None else [])
+
+    def ejecutar():
+        try:
+            inicio = time.time()
+            with medir_etapa("consulta", "inventario", config):
+                resultado = obtener_cursor(config or {}).execute(query, parametros)
+            with medir_etapa("lectura", "inventario", config):
+                result_df = resultado.fetchdf()
+            logger.info(f"Consulta de inventario: {len(result_df)} filas en {time.time() - inicio:.3f} segundos.")
+            return result_df
+        except Exception as e:
+            ERROR_COUNT.inc()
+            logger.error(f"Error en la consulta de inventario: {e}", exc_info=True)
+            return pd.DataFrame()
+
+    return obtener_cache().obtener_o_calcular(query, parametros, destino_archivo(parquet_file), ejecutar)
 
 def conectar_instancia():
     """
@@ -161,12 +698,17 @@ if __name__ == "__main__":
         logger.info("Importación completa. Mostrando algunas filas:")
         print(df_importado.head())
         
-        # Exportar a Parquet y ejecutar consulta analítica
-        parquet_file = exportar_a_parquet(df_importado, filename="datos.parquet")
+        # Exportar a Parquet en streaming (sin reunir los bloques) y ejecutar consulta analítica
+        parquet_file = exportar_importacion_a_parquet(config, filename="datos.parquet", total_rows=50000,
+                                                      batch_size=10000)
         if parquet_file:
             result_df = consulta_con_duckdb(parquet_file, exist_threshold=0)
             logger.info("Resultados de la consulta:")
             print(result_df.head())
+
+            # Consulta con filtros parametrizados, como la haría un filtro interactivo
+            result_df = consultar_inventario(parquet_file, existencia_minima=1, nombre="tornillo", limite=100)
+            print(result_df.head())
         
         # Uso del generador para procesar bloques incrementalmente
         logger.info("Uso del generador para procesar bloques:")
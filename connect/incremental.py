@@ -0,0 +1,142 @@
+# connect/incremental.py
+import time
+import duckdb
+from config.config import WATERMARK_CONFIG
+from config.logging_config import logger, ERROR_COUNT
+from connect.conexion_duckdb import obtener_cursor
+from connect.importacion import crear_snapshot_importacion, eliminar_snapshot_importacion
+from query.sql import (
+    TABLA_REGISTRO_SNAPSHOTS, TABLA_REGISTRO_WATERMARKS, nombre_tabla_snapshot,
+    obtener_consulta_watermark, obtener_consulta_claves_modificadas, obtener_consulta_fusion_snapshot
+)
+
+# Tabla temporal (propia de cada cursor) con las claves a recalcular.
+TABLA_CLAVES_REFRESCO = "importacion_claves_refresco"
+
+def _asegurar_registro_watermarks(con):
+    """Crea, si no existe, la tabla que registra la marca de agua de cada importación."""
+    con.execute(
+        f"CREATE TABLE IF NOT EXISTS {TABLA_REGISTRO_WATERMARKS} ("
+        "import_id VARCHAR PRIMARY KEY, columna VARCHAR, valor VARCHAR, tipo VARCHAR, actualizado TIMESTAMP)"
+    )
+
+def _leer_watermark(con, columna):
+    """Retorna (valor, tipo) de la marca de agua actual de tbHecInventario."""
+    valor, tipo = con.execute(obtener_consulta_watermark(columna)).fetchone()
+    return valor, tipo
+
+def _guardar_watermark(con, import_id, columna, valor, tipo):
+    _asegurar_registro_watermarks(con)
+    con.execute(
+        f"INSERT OR REPLACE INTO {TABLA_REGISTRO_WATERMARKS} VALUES (?, ?, ?, ?, now())",
+        [import_id, columna, valor, tipo]
+    )
+
+def crear_snapshot_incremental(config, import_id=None, columna=None):
+    """
+    Crea el snapshot de la importación y registra su marca de agua para poder
+    refrescarlo después con refrescar_snapshot_incremental.
+
+    La marca de agua se lee antes de ejecutar la consulta completa: los cambios que
+    lleguen mientras se construye el snapshot se vuelven a aplicar en el siguiente
+    refresco, lo que es inocuo porque la fusión reemplaza las claves afectadas.
+    Si la columna de la marca de agua no existe o no se puede leer, se crea un snapshot
+    común sin marca de agua: refrescar_snapshot_incremental retorna None para él y el
+    siguiente refresco se resuelve con una importación completa.
+
+    Parámetros:
+      config (dict): Diccionario de configuración con la clave 'database'.
+      import_id (str): Identificador de la importación; si no se indica se genera uno.
+      columna (str): Columna de tbHecInventario usada como marca de agua
+                     (por defecto WATERMARK_CONFIG['columna']).
+
+    Retorna:
+      str: El identificador de la importación.
+    """
+    columna = columna or WATERMARK_CONFIG['columna']
+    con = obtener_cursor(config)
+    try:
+        valor, tipo = _leer_watermark(con, columna)
+    except duckdb.InterruptException:
+        raise
+    except duckdb.Error as e:
+        logger.warning(f"No se pudo leer la marca de agua {columna} de tbHecInventario ({e}); "
+                       f"se crea un snapshot sin refresco incremental.")
+        return crear_snapshot_importacion(config, import_id)
+    import_id = crear_snapshot_importacion(config, import_id)
+    try:
+        _guardar_watermark(con, import_id, columna, valor, tipo)
+    except Exception:
+        eliminar_snapshot_importacion(config, import_id)  # Sin marca de agua no podría refrescarse
+        raise
+    logger.info(f"Marca de agua de la importación {import_id}: {columna} = {valor}.")
+    return import_id
+
+def refrescar_snapshot_incremental(config, import_id):
+    """
+    Actualiza el snapshot de una importación con los cambios posteriores a su marca de agua.
+
+    Solo se vuelve a agregar la consulta de importación para las claves
+    (Referencia, CodigoMarca) con hechos nuevos o modificados, y su resultado reemplaza
+    esas claves en el snapshot. Las bajas físicas de hechos y los cambios en las
+    dimensiones no mueven la marca de agua; para reflejarlos hace falta un snapshot nuevo.
+
+    Parámetros:
+      config (dict): Diccionario de configuración con la clave 'database'.
+      import_id (str): Importación creada con crear_snapshot_incremental.
+
+    Retorna:
+      int: Número de claves recalculadas, o None si la importación no tiene marca de
+           agua o el refresco falla (en ese caso corresponde una importación completa).
+    """
+    con = obtener_cursor(config)
+    try:
+        _asegurar_registro_watermarks(con)
+        registro = con.execute(
+            f"SELECT columna, valor, tipo FROM {TABLA_REGISTRO_WATERMARKS} WHERE import_id = ?",
+            [import_id]
+        ).fetchone()
+        if registro is None:
+            logger.warning(f"La importación {import_id} no tiene marca de agua; se requiere importación completa.")
+            return None
+        columna, valor_anterior, tipo = registro
+
+        inicio = time.time()
+        valor_actual, tipo_actual = _leer_watermark(con, columna)
+        if valor_anterior is None:
+            # Snapshot creado sobre una tabla de hechos vacía: todo hecho actual es nuevo.
+            consulta_claves = obtener_consulta_claves_modificadas(columna)
+            parametros = []
+        else:
+            consulta_claves = obtener_consulta_claves_modificadas(columna, tipo)
+            parametros = [valor_anterior]
+        con.execute(f"CREATE OR REPLACE TEMP TABLE {TABLA_CLAVES_REFRESCO} AS {consulta_claves}", parametros)
+        claves = con.execute(f"SELECT COUNT(*) FROM {TABLA_CLAVES_REFRESCO}").fetchone()[0]
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            if claves:
+                for sentencia in obtener_consulta_fusion_snapshot(import_id, TABLA_CLAVES_REFRESCO):
+                    con.execute(sentencia)
+                filas = con.execute(f"SELECT COUNT(*) FROM {nombre_tabla_snapshot(import_id)}").fetchone()[0]
+                con.execute(
+                    f"UPDATE {TABLA_REGISTRO_SNAPSHOTS} SET filas = ? WHERE import_id = ?", [filas, import_id]
+                )
+            _guardar_watermark(con, import_id, columna, valor_actual, tipo_actual or tipo)
+            con.execute("COMMIT")
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        finally:
+            con.execute(f"DROP TABLE IF EXISTS {TABLA_CLAVES_REFRESCO}")
+
+        fin = time.time()
+        logger.info(
+            f"Refresco incremental de {import_id}: {claves} claves recalculadas en {fin - inicio:.2f} segundos "
+            f"({columna}: {valor_anterior} -> {valor_actual})."
+        )
+        return claves
+    except Exception as e:
+        ERROR_COUNT.inc()
+        logger.error(f"Error en el refresco incremental de {import_id}: {e}", exc_info=True)
+        return None
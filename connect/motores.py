@@ -0,0 +1,159 @@
+# connect/motores.py
+import atexit
+import threading
+import time
+from urllib.parse import quote_plus
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from config.config import SQLSERVER_POOL_CONFIG
+from config.logging_config import logger, POOL_EN_USO, POOL_DISPONIBLES, POOL_OVERFLOW, POOL_ESPERA, url_sin_credenciales
+
+class PoolMedido(QueuePool):
+    """
+    QueuePool que registra en POOL_ESPERA el tiempo que tarda cada solicitud de conexión,
+    incluida la espera cuando todas las conexiones están en uso. El destino de la métrica
+    es el logging_name del pool, que se conserva cuando el engine recrea el pool.
+    """
+    def _do_get(self):
+        inicio = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            POOL_ESPERA.labels(self.logging_name or "").observe(time.perf_counter() - inicio)
+
+def clave_destino(config):
+    """
+    Retorna la clave del engine de 'config': servidor, base de datos y credenciales.
+    Dos configuraciones con la misma clave comparten el pool.
+    """
+    return (
+        config.get('url'),
+        config.get('server_name'),
+        config.get('database', "BODEGA_DATOS"),
+        config.get('login'),
+        config.get('password'),
+    )
+
+def nombre_destino(config):
+    """Nombre legible del destino (sin credenciales) para logs y métricas."""
+    if config.get('url'):
+        return url_sin_credenciales(config['url'])
+    return f"{config.get('server_name')}/{config.get('database', 'BODEGA_DATOS')}"
+
+def construir_url(config):
+    """
+    Retorna la URL de SQLAlchemy para SQL Server vía ODBC. Si 'config' incluye 'url' se usa
+    esa directamente (por ejemplo, una base SQLite para pruebas).
+    """
+    if config.get('url'):
+        return config['url']
+    connection_string = (
+        f"DRIVER={{{SQLSERVER_POOL_CONFIG['driver']}}};"
+        f"SERVER={config.get('server_name')};"
+        f"DATABASE={config.get('database', 'BODEGA_DATOS')};"
+        f"UID={config.get('login')};"
+        f"PWD={config.get('password')};"
+        f"Connection Timeout={SQLSERVER_POOL_CONFIG['timeout_conexion']};"
+    )
+    return f"mssql+pyodbc:///?odbc_connect={quote_plus(connection_string)}"
+
+class RegistroMotores:
+    """
+    Mantiene un único engine de SQLAlchemy (y por lo tanto un único pool) por destino.
+
+    Crear un engine en cada llamada abre un pool nuevo con sus propias conexiones; con el
+    registro, la ventana, la importación y las consultas reutilizan las mismas conexiones.
+    Los parámetros del pool vienen de SQLSERVER_POOL_CONFIG.
+    """
+    def __init__(self, ajustes=None):
+        self.ajustes = dict(SQLSERVER_POOL_CONFIG, **(ajustes or {}))
+        self._motores = {}  # clave_destino -> engine
+        self._lock = threading.Lock()
+
+    def obtener(self, config):
+        """Retorna el engine del destino de 'config', creándolo la primera vez."""
+        clave = clave_destino(config)
+        with self._lock:
+            engine = self._motores.get(clave)
+            if engine is None:
+                engine = self._crear(config)
+                self._motores[clave] = engine
+            return engine
+
+    def _crear(self, config):
+        url = construir_url(config)
+        destino = nombre_destino(config)
+        opciones = {}
+        if url.startswith("mssql+pyodbc"):
+            opciones['fast_executemany'] = True
+        engine = create_engine(
+            url,
+            poolclass=PoolMedido,
+            pool_logging_name=destino,
+            pool_size=self.ajustes['pool_size'],
+            max_overflow=self.ajustes['max_overflow'],
+            pool_timeout=self.ajustes['pool_timeout'],
+            pool_pre_ping=self.ajustes['pool_pre_ping'],
+            pool_recycle=self.ajustes['pool_recycle'],
+            **opciones
+        )
+        # Las métricas leen el pool vigente del engine en cada consulta de Prometheus
+        POOL_EN_USO.labels(destino).set_function(lambda: engine.pool.checkedout())
+        POOL_DISPONIBLES.labels(destino).set_function(lambda: engine.pool.checkedin())
+        POOL_OVERFLOW.labels(destino).set_function(lambda: max(engine.pool.overflow(), 0))
+        logger.info(f"Engine SQLAlchemy creado para '{destino}' (pool_size={self.ajustes['pool_size']}, "
+                    f"max_overflow={self.ajustes['max_overflow']}).")
+        # La tabla de regiones de SQL Server no se toca aquí: se publica con python -m connect.regiones
+        return engine
+
+    def calentar(self, config, conexiones=None):
+        """
+        Abre 'conexiones' conexiones del pool (por defecto SQLSERVER_POOL_CONFIG['calentar'])
+        y las devuelve, para que las primeras consultas no paguen el costo de conectar.
+
+        Retorna:
+          int: Conexiones abiertas.
+        """
+        conexiones = self.ajustes['calentar'] if conexiones is None else conexiones
+        engine = self.obtener(config)
+        abiertas = []
+        try:
+            for _ in range(min(conexiones, self.ajustes['pool_size'])):
+                abiertas.append(engine.raw_connection())
+        except Exception as e:
+            logger.error(f"Error calentando el pool de '{nombre_destino(config)}': {e}", exc_info=True)
+        finally:
+            for conexion in abiertas:
+                conexion.close()  # Vuelve al pool abierta
+        logger.info(f"Pool de '{nombre_destino(config)}' calentado con {len(abiertas)} conexiones.")
+        return len(abiertas)
+
+    def cerrar(self):
+        """Cierra las conexiones de todos los pools y vacía el registro."""
+        with self._lock:
+            for clave, engine in self._motores.items():
+                engine.dispose()
+            self._motores.clear()
+
+_registro = RegistroMotores()
+
+def obtener_motor(config):
+    """Retorna el engine compartido del proceso para el destino de 'config'."""
+    return _registro.obtener(config)
+
+def calentar_motor(config, conexiones=None, en_segundo_plano=False):
+    """
+    Abre conexiones del pool del destino por adelantado. Con en_segundo_plano=True se
+    hace en un hilo para no demorar el inicio de la interfaz.
+    """
+    if en_segundo_plano:
+        hilo = threading.Thread(target=_registro.calentar, args=(config, conexiones), daemon=True)
+        hilo.start()
+        return hilo
+    return _registro.calentar(config, conexiones)
+
+def cerrar_motores():
+    """Cierra todos los pools del proceso."""
+    _registro.cerrar()
+
+atexit.register(cerrar_motores)
@@ -0,0 +1,68 @@
+# connect/regiones.py
+import csv
+import logging
+import sys
+from sqlalchemy import MetaData, Table, Column, Integer, String
+from config.config import REGIONES_TIENDA_CSV
+from query.sql import TABLA_REGIONES
+
+logger = logging.getLogger("ImportacionLogger")
+
+def cargar_regiones(ruta=None):
+    """
+    Lee la asignación dimID_Tienda -> Region desde el archivo CSV.
+
+    Parámetros:
+      ruta (str): Ruta del CSV; por defecto REGIONES_TIENDA_CSV.
+
+    Retorna:
+      list: Tuplas (dimID_Tienda, Region).
+    """
+    ruta = ruta or REGIONES_TIENDA_CSV
+    with open(ruta, newline="", encoding="utf-8") as f:
+        return [(int(fila["dimID_Tienda"]), fila["Region"].strip()) for fila in csv.DictReader(f)]
+
+def sincronizar_regiones_duckdb(con, ruta=None):
+    """
+    Reemplaza la tabla de regiones de la base DuckDB con el contenido del CSV.
+    Se ejecuta en una transacción para que las consultas concurrentes no vean la tabla vacía.
+    """
+    regiones = cargar_regiones(ruta)
+    con.execute("BEGIN TRANSACTION")
+    try:
+        con.execute(f"CREATE OR REPLACE TABLE {TABLA_REGIONES} (dimID_Tienda INTEGER PRIMARY KEY, Region VARCHAR NOT NULL)")
+        con.executemany(f"INSERT INTO {TABLA_REGIONES} VALUES (?, ?)", regiones)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    logger.info(f"Tabla {TABLA_REGIONES} sincronizada con {len(regiones)} tiendas.")
+
+def sincronizar_regiones_sqlalchemy(engine, ruta=None):
+    """
+    Publica el contenido del CSV en la tabla de regiones de una base accesible por
+    SQLAlchemy (por ejemplo, SQL Server).
+
+    Es un paso de administración que requiere permisos de escritura: se ejecuta de forma
+    explícita (ver el bloque __main__) y no al crear el engine de la aplicación. La tabla
+    solo se crea si no existe; su contenido se reemplaza dentro de una transacción, de
+    modo que las importaciones concurrentes nunca la encuentran ausente ni a medio cargar.
+    """
+    regiones = cargar_regiones(ruta)
+    tabla = Table(
+        TABLA_REGIONES, MetaData(),
+        Column("dimID_Tienda", Integer, primary_key=True, autoincrement=False),
+        Column("Region", String(100), nullable=False),
+    )
+    with engine.begin() as conexion:
+        tabla.create(conexion, checkfirst=True)
+        conexion.execute(tabla.delete())
+        conexion.execute(tabla.insert(), [{"dimID_Tienda": t, "Region": r} for t, r in regiones])
+    logger.info(f"Tabla {TABLA_REGIONES} sincronizada con {len(regiones)} tiendas.")
+
+if __name__ == "__main__":
+    # Uso: python -m connect.regiones SERVIDOR LOGIN CONTRASEÑA
+    from connect.motores import obtener_motor
+    servidor, login, password = sys.argv[1:4]
+    config = {'server_name': servidor, 'login': login, 'password': password, 'database': 'BODEGA_DATOS'}
+    sincronizar_regiones_sqlalchemy(obtener_motor(config))
@@ -0,0 +1,344 @@
+# almacen_resultados.py
+import os
+import shutil
+import sys
+import tempfile
+import weakref
+from bisect import bisect_right
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from pandas.api.types import union_categoricals
+from config.config import MEMORIA_CONFIG
+from config.logging_config import (
+    logger, ALMACEN_BYTES_MEMORIA, ALMACEN_BYTES_DISCO, ALMACEN_DESCARGAS, ALMACEN_RECARGAS
+)
+
+_POR_DEFECTO = object()
+
+class AlmacenResultados:
+    """
+    Almacén columnar de resultados recibidos por bloques.
+
+    Cada bloque se guarda como un arreglo NumPy por columna (o un pd.Categorical para las
+    columnas categóricas, que así conservan sus códigos compactos), sin concatenarlo con los
+    anteriores. Un índice con la fila global donde empieza cada bloque permite resolver
+    cualquier fila con una búsqueda binaria, y las operaciones de lectura (rebanadas de
+    columna, selección de filas, recorrido por bloques) solo copian lo que devuelven.
+    Lo comparten el modelo de la tabla, los exportadores y el pivot.
+
+    Con un presupuesto de memoria (MEMORIA_CONFIG['presupuesto_bytes'] por defecto), al
+    superarlo los bloques usados hace más tiempo se descargan a un archivo Arrow por bloque
+    y se liberan. arrays_bloque (la vista) los vuelve a cargar en memoria; las lecturas de
+    columnas y el recorrido por bloques de los exportadores leen el archivo mapeado en
+    memoria sin volver a cargar el bloque completo.
+    """
+    def __init__(self, columnas=None, presupuesto_bytes=_POR_DEFECTO, directorio=None):
+        self.columnas = list(columnas) if columnas is not None else []
+        self.presupuesto_bytes = (
+            MEMORIA_CONFIG.get('presupuesto_bytes') if presupuesto_bytes is _POR_DEFECTO else presupuesto_bytes
+        )
+        self.directorio = directorio or MEMORIA_CONFIG.get('directorio')
+        self._bloques = []   # Lista de bloques; cada bloque es una lista de arreglos por columna (None si está en disco)
+        self._inicios = []   # Fila global donde empieza cada bloque
+        self._filas = 0
+        self._bytes = []     # Bytes estimados de cada bloque en memoria
+        self._archivos = []  # Archivo Arrow de cada bloque descargado (o None)
+        self._residentes = OrderedDict()  # Bloques en memoria, del usado hace más tiempo al más reciente
+        self._bytes_memoria = 0
+        self._bytes_disco = 0
+        self._carpeta = None
+        self._limpieza = None
+        self.al_descargar = None  # Función opcional que recibe el índice de cada bloque descargado
+
+    def __len__(self):
+        return self._filas
+
+    @property
+    def num_bloques(self):
+        return len(self._bloques)
+
+    @property
+    def inicios(self):
+        """Fila global de inicio de cada bloque."""
+        return list(self._inicios)
+
+    @property
+    def bytes_memoria(self):
+        """Bytes estimados de los bloques que están en memoria."""
+        return self._bytes_memoria
+
+    @property
+    def bytes_disco(self):
+        """Bytes de los archivos de los bloques descargados."""
+        return self._bytes_disco
+
+    @staticmethod
+    def _bytes_arreglo(arr):
+        """Estimación de la memoria de un arreglo; el texto se estima con una muestra."""
+        if isinstance(arr, pd.Categorical):
+            return arr.codes.nbytes + int(arr.categories.memory_usage(deep=True))
+        if arr.dtype != object or len(arr) == 0:
+            return arr.nbytes
+        muestra = arr[:: max(len(arr) // 1000, 1)]
+        return arr.nbytes + int(np.mean([sys.getsizeof(v) for v in muestra]) * len(arr))
+
+    @staticmethod
+    def _arrays_arrow(datos, columnas):
+        """
+        Extrae arreglos NumPy de un RecordBatch o Table; los decimales pasan a float64 y
+        las columnas de diccionario a pd.Categorical.
+        """
+        arrays = []
+        for nombre in columnas:
+            columna = datos.column(datos.schema.get_field_index(nombre))
+            if pa.types.is_decimal(columna.type):
+                columna = columna.cast(pa.float64())
+            if pa.types.is_dictionary(columna.type):
+                arrays.append(columna.to_pandas().array)
+            else:
+                arrays.append(columna.to_numpy(zero_copy_only=False))
+        return arrays
+
+    @staticmethod
+    def _array_serie(serie):
+        """
+        Arreglo de una columna de pandas: las categóricas se guardan sin expandir. Los
+        enteros con nulos (Int32, ver ESQUEMA_IMPORTACION) pasan a su tipo NumPy o, si tienen
+        nulos, a float64 con NaN, que los representa exactamente.
+        """
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            return serie.array
+        if isinstance(serie.dtype, pd.api.extensions.ExtensionDtype) and serie.dtype.kind in "iu":
+            if serie.hasnans:
+                return serie.to_numpy(dtype=np.float64, na_value=np.nan)
+            return serie.to_numpy(dtype=serie.dtype.numpy_dtype)
+        return serie.to_numpy()
+
+    @staticmethod
+    def _concatenar(partes):
+        """Concatena tramos de una columna; los categóricos se unen sin expandirse."""
+        if len(partes) == 1:
+            return partes[0]
+        if all(isinstance(p, pd.Categorical) for p in partes):
+            return union_categoricals(partes)
+        return np.concatenate([np.asarray(p) for p in partes])
+
+    def agregar(self, datos):
+        """
+        Agrega un bloque al final del almacén.
+
+        Parámetros:
+          datos: DataFrame, pyarrow.RecordBatch o pyarrow.Table. Si el almacén ya tiene
+                 columnas, se toman en ese orden (las que falten quedan como nulas en pandas).
+
+        Retorna:
+          int: Número de filas agregadas.
+        """
+        if datos is None or len(datos) == 0:
+            return 0
+        if isinstance(datos, (pa.RecordBatch, pa.Table)):
+            if not self.columnas:
+                self.columnas = list(datos.schema.names)
+            arrays = self._arrays_arrow(datos, self.columnas)
+        else:
+            if not self.columnas:
+                self.columnas = list(datos.columns)
+            elif list(datos.columns) != self.columnas:
+                datos = datos.reindex(columns=self.columnas)
+            arrays = [self._array_serie(datos[c]) for c in self.columnas]
+
+        self._bloques.append(arrays)
+        self._inicios.append(self._filas)
+        self._filas += len(datos)
+        self._bytes.append(sum(self._bytes_arreglo(a) for a in arrays))
+        self._archivos.append(None)
+        self._marcar_residente(len(self._bloques) - 1)
+        return len(datos)
+
+    def limpiar(self):
+        """Elimina todos los bloques y columnas, incluidos los archivos de los bloques descargados."""
+        ALMACEN_BYTES_MEMORIA.dec(self._bytes_memoria)
+        ALMACEN_BYTES_DISCO.dec(self._bytes_disco)
+        if self._limpieza is not None:
+            self._limpieza()  # Borra la carpeta de los bloques descargados
+        self.columnas = []
+        self._bloques = []
+        self._inicios = []
+        self._filas = 0
+        self._bytes = []
+        self._archivos = []
+        self._residentes = OrderedDict()
+        self._bytes_memoria = 0
+        self._bytes_disco = 0
+        self._carpeta = None
+        self._limpieza = None
+
+    def _marcar_residente(self, bloque):
+        """Registra el bloque como el más reciente en memoria y aplica el presupuesto."""
+        if bloque in self._residentes:
+            self._residentes.move_to_end(bloque)
+            return
+        self._residentes[bloque] = None
+        self._bytes_memoria += self._bytes[bloque]
+        ALMACEN_BYTES_MEMORIA.inc(self._bytes[bloque])
+        if self.presupuesto_bytes is None:
+            return
+        # El bloque más reciente se conserva aunque por sí solo supere el presupuesto
+        while self._bytes_memoria > self.presupuesto_bytes and len(self._residentes) > 1:
+            antiguo = next(iter(self._residentes))
+            if not self._descargar(antiguo):
+                break
+
+    def _ruta_bloque(self, bloque):
+        if self._carpeta is None:
+            if self.directorio:
+                os.makedirs(self.directorio, exist_ok=True)
+            self._carpeta = tempfile.mkdtemp(prefix="almacen_", dir=self.directorio)
+            self._limpieza = weakref.finalize(self, shutil.rmtree, self._carpeta, True)
+        return os.path.join(self._carpeta, f"bloque-{bloque}.arrow")
+
+    def _descargar(self, bloque):
+        """
+        Libera un bloque de la memoria, escribiéndolo antes a su archivo Arrow si aún no lo
+        tiene. Retorna False si el bloque no pudo escribirse (queda en memoria).
+        """
+        if self._archivos[bloque] is None:
+            ruta = self._ruta_bloque(bloque)
+            try:
+                arrays = self._bloques[bloque]
+                tabla = pa.table({str(i): pa.array(a, from_pandas=True) for i, a in enumerate(arrays)})
+                with pa.OSFile(ruta, "wb") as archivo, pa.ipc.new_file(archivo, tabla.schema) as escritor:
+                    escritor.write_table(tabla)
+            except (pa.ArrowException, OSError) as e:
+                logger.error(f"No se pudo descargar el bloque {bloque} a disco: {e}", exc_info=True)
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+                return False
+            self._archivos[bloque] = ruta
+            tamano = os.path.getsize(ruta)
+            self._bytes_disco += tamano
+            ALMACEN_BYTES_DISCO.inc(tamano)
+            ALMACEN_DESCARGAS.inc()
+        del self._residentes[bloque]
+        self._bloques[bloque] = None
+        self._bytes_memoria -= self._bytes[bloque]
+        ALMACEN_BYTES_MEMORIA.dec(self._bytes[bloque])
+        logger.info(f"Bloque {bloque} ({self._bytes[bloque] / 1e6:.1f} MB) descargado a disco; "
+                    f"en memoria {self._bytes_memoria / 1e6:.1f} MB de {self.presupuesto_bytes / 1e6:.1f} MB.")
+        if self.al_descargar is not None:
+            self.al_descargar(bloque)
+        return True
+
+    def _leer_archivo(self, bloque, indices=None):
+        """Lee del archivo del bloque las columnas indicadas (por defecto todas), sin cargarlo."""
+        indices = range(len(self.columnas)) if indices is None else indices
+        with pa.memory_map(self._archivos[bloque]) as archivo:
+            tabla = pa.ipc.open_file(archivo).read_all()
+            return self._arrays_arrow(tabla, [str(i) for i in indices])
+
+    def _columna_bloque(self, bloque, col):
+        """Arreglo de una columna de un bloque, esté en memoria o en disco."""
+        arrays = self._bloques[bloque]
+        if arrays is not None:
+            self._residentes.move_to_end(bloque)
+            return arrays[col]
+        return self._leer_archivo(bloque, [col])[0]
+
+    def ubicar(self, fila):
+        """Retorna (índice del bloque, fila dentro del bloque) para una fila global."""
+        if not 0 <= fila < self._filas:
+            raise IndexError(f"Fila fuera de rango: {fila}")
+        bloque = bisect_right(self._inicios, fila) - 1
+        return bloque, fila - self._inicios[bloque]
+
+    def arrays_bloque(self, bloque):
+        """
+        Retorna los arreglos (uno por columna) de un bloque, sin copiarlos. Un bloque
+        descargado se vuelve a cargar en memoria, lo que puede descargar otros.
+        """
+        if self._bloques[bloque] is None:
+            self._bloques[bloque] = self._leer_archivo(bloque)
+            ALMACEN_RECARGAS.inc()
+            logger.debug(f"Bloque {bloque} leído de nuevo desde disco.")
+        arrays = self._bloques[bloque]
+        self._marcar_residente(bloque)
+        return arrays
+
+    def valor(self, fila, columna):
+        """Retorna el valor de una celda; 'columna' puede ser el nombre o la posición."""
+        col = columna if isinstance(columna, int) else self.columnas.index(columna)
+        bloque, local = self.ubicar(fila)
+        return self._columna_bloque(bloque, col)[local]
+
+    def columna(self, nombre, inicio=0, fin=None):
+        """
+        Retorna como un único arreglo las filas [inicio, fin) de una columna. Solo se
+        concatenan los tramos de los bloques que cubren el rango.
+        """
+        col = self.columnas.index(nombre)
+        fin = self._filas if fin is None else min(fin, self._filas)
+        if inicio >= fin:
+            return self._columna_bloque(0, col)[:0] if self._bloques else np.array([], dtype=object)
+        partes = []
+        bloque, local = self.ubicar(inicio)
+        restantes = fin - inicio
+        while restantes > 0:
+            arr = self._columna_bloque(bloque, col)
+            parte = arr[local:local + restantes]
+            partes.append(parte)
+            restantes -= len(parte)
+            bloque, local = bloque + 1, 0
+        return self._concatenar(partes)
+
+    def tomar(self, filas, columnas=None):
+        """
+        Retorna un DataFrame con las filas globales indicadas (en ese orden) y las columnas
+        pedidas (por defecto todas). La ubicación de cada fila se resuelve de forma vectorizada.
+        """
+        columnas = list(columnas) if columnas is not None else self.columnas
+        filas = np.asarray(filas, dtype=np.int64)
+        if len(filas) and (filas.min() < 0 or filas.max() >= self._filas):
+            raise IndexError("Filas fuera de rango")
+        bloques = np.searchsorted(np.asarray(self._inicios), filas, side="right") - 1
+        locales = filas - np.asarray(self._inicios, dtype=np.int64)[bloques] if len(filas) else filas
+        datos = {}
+        for nombre in columnas:
+            col = self.columnas.index(nombre)
+            partes = []
+            posiciones = []
+            for bloque in np.unique(bloques):
+                mascara = bloques == bloque
+                partes.append(self._columna_bloque(bloque, col)[locales[mascara]])
+                posiciones.append(np.flatnonzero(mascara))
+            if partes:
+                # Los valores quedan agrupados por bloque: se reordenan a la posición pedida
+                orden = np.empty(len(filas), dtype=np.int64)
+                orden[np.concatenate(posiciones)] = np.arange(len(filas))
+                resultado = self._concatenar(partes)[orden]
+            else:
+                resultado = np.array([])
+            datos[nombre] = resultado
+        return pd.DataFrame(datos, columns=columnas)
+
+    def iterar_bloques(self, columnas=None):
+        """
+        Recorre el almacén entregando un DataFrame por bloque, construido sobre sus arreglos.
+        Los bloques descargados se leen de su archivo sin volver a cargarlos en memoria.
+        """
+        columnas = list(columnas) if columnas is not None else self.columnas
+        indices = [self.columnas.index(c) for c in columnas]
+        for bloque, arrays in enumerate(self._bloques):
+            if arrays is None:
+                leidos = self._leer_archivo(bloque, indices)
+            else:
+                leidos = [arrays[i] for i in indices]
+            yield pd.DataFrame(dict(zip(columnas, leidos)), columns=columnas, copy=False)
+
+    def a_dataframe(self, columnas=None):
+        """Materializa el almacén (o solo las columnas indicadas) en un único DataFrame."""
+        columnas = list(columnas) if columnas is not None else self.columnas
+        if not self._bloques:
+            return pd.DataFrame(columns=columnas)
+        return pd.DataFrame({c: self.columna(c) for c in columnas}, columns=columnas)
@@ -1,33 +1,173 @@
 # pandas_model.py
+from collections import OrderedDict
 from PyQt5.QtCore import QAbstractTableModel, Qt, QModelIndex
+import numpy as np
 import pandas as pd
+from config.config import MEMORIA_CONFIG
+from model.almacen_resultados import AlmacenResultados
 
 class PandasModel(QAbstractTableModel):
-    def __init__(self, df=pd.DataFrame(), parent=None):
+    """
+    Modelo de tabla sobre uno o varios DataFrames.
+
+    Los datos viven en un AlmacenResultados (un arreglo NumPy por columna y bloque), de
+    modo que agregar un lote (agregar_bloque) no concatena ni copia lo anterior y se
+    notifica a la vista con beginInsertRows/endInsertRows, conservando la posición del
+    scroll. El almacén queda expuesto en 'almacen' para exportar o pivotar lo cargado.
+    El texto que se muestra se formatea de forma perezosa, por tramos de TAMANO_TRAMO
+    filas y de manera vectorizada, quedando en caché. La caché conserva a lo sumo
+    MEMORIA_CONFIG['tramos_texto'] tramos, descartando los usados hace más tiempo, y olvida
+    los de un bloque cuando el almacén lo descarga a disco.
+    """
+    TAMANO_TRAMO = 512
+
+    def __init__(self, df=None, parent=None, decimales=2, max_tramos=None):
         super().__init__(parent)
-        self._data = df
+        self.decimales = decimales
+        self.max_tramos = max_tramos if max_tramos is not None else MEMORIA_CONFIG.get('tramos_texto')
+        self.almacen = AlmacenResultados()
+        self.almacen.al_descargar = self._olvidar_bloque
+        self._cargar(df if df is not None else pd.DataFrame())
+
+    def _cargar(self, df):
+        """Reinicia el modelo con un único bloque."""
+        self.almacen.limpiar()
+        self.almacen.columnas = list(df.columns)
+        self._formatos = ["entero"] * len(self.almacen.columnas)
+        self._cache = OrderedDict()  # (columna, bloque, tramo) -> lista de textos, del usado hace más tiempo al más reciente
+        if len(df):
+            self._anexar(df)
+
+    def _anexar(self, df):
+        """
+        Agrega el bloque al almacén y ajusta el formato de las columnas.
+        Retorna las columnas que cambiaron de formato y cuyo texto ya mostrado quedó invalidado.
+        """
+        habia_filas = len(self.almacen) > 0
+        self.almacen.agregar(df)
+        arrays = self.almacen.arrays_bloque(self.almacen.num_bloques - 1)
+        cambiadas = []
+        for col, arr in enumerate(arrays):
+            formato = self._combinar_formato(self._formatos[col], self._tipo_formato(arr))
+            if formato != self._formatos[col] and habia_filas:
+                cambiadas.append(col)
+            self._formatos[col] = formato
+        if cambiadas:
+            self._cache = OrderedDict((k, v) for k, v in self._cache.items() if k[0] not in cambiadas)
+        return cambiadas
+
+    def _olvidar_bloque(self, bloque):
+        """Descarta el texto en caché de un bloque que el almacén descargó a disco."""
+        for clave in [k for k in self._cache if k[1] == bloque]:
+            del self._cache[clave]
+
+    @staticmethod
+    def _tipo_formato(arr):
+        """
+        Clasifica la columna: 'entero', 'decimal' o 'texto'. Las columnas decimales cuyos
+        valores son todos enteros (por ejemplo, sumas de existencias) se muestran como enteros.
+        """
+        if arr.dtype.kind in "iu":
+            return "entero"
+        if arr.dtype.kind == "f":
+            validos = arr[~np.isnan(arr)]
+            return "entero" if np.array_equal(validos, np.floor(validos)) else "decimal"
+        return "texto"
+
+    @staticmethod
+    def _combinar_formato(actual, nuevo):
+        """Formato de una columna que ya tenía 'actual' y recibe un bloque de tipo 'nuevo'."""
+        orden = ("entero", "decimal", "texto")
+        return max(actual, nuevo, key=orden.index)
+
+    def _formatear(self, col, arr):
+        """Formatea de una vez un tramo de la columna."""
+        formato = self._formatos[col]
+        if isinstance(arr, pd.Categorical):
+            # Se formatean solo las categorías; el tramo toma su texto por código
+            textos = np.append(arr.categories.astype(str).to_numpy(dtype=object), "")
+            return textos[arr.codes].tolist()
+        if formato == "texto" or arr.dtype.kind not in "iuf":
+            textos = arr.astype(str)
+            nulos = pd.isna(arr)
+        elif arr.dtype.kind == "f":
+            nulos = np.isnan(arr)
+            patron = "%.0f" if formato == "entero" else f"%.{self.decimales}f"
+            textos = np.char.mod(patron, np.where(nulos, 0, arr))
+        else:
+            nulos = None
+            patron = "%d" if formato == "entero" else f"%.{self.decimales}f"
+            textos = np.char.mod(patron, arr)
+        if nulos is not None and nulos.any():
+            textos = np.where(nulos, "", textos)
+        return textos.tolist()
+
+    def _texto(self, fila, col):
+        bloque, local = self.almacen.ubicar(fila)
+        tramo = local // self.TAMANO_TRAMO
+        clave = (col, bloque, tramo)
+        textos = self._cache.get(clave)
+        if textos is None:
+            inicio = tramo * self.TAMANO_TRAMO
+            arr = self.almacen.arrays_bloque(bloque)[col][inicio:inicio + self.TAMANO_TRAMO]
+            textos = self._formatear(col, arr)
+            self._cache[clave] = textos
+            if self.max_tramos is not None:
+                while len(self._cache) > self.max_tramos:
+                    self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(clave)
+        return textos[local - tramo * self.TAMANO_TRAMO]
 
     def actualizar_datos(self, df):
+        """Reemplaza todo el contenido del modelo por el DataFrame."""
         self.beginResetModel()
-        self._data = df.copy()
+        self._cargar(df)
         self.endResetModel()
 
+    def agregar_bloque(self, df):
+        """
+        Agrega las filas del DataFrame al final del modelo sin copiar ni concatenar
+        los bloques anteriores. El costo depende solo del tamaño del bloque agregado.
+        """
+        if df is None or df.empty:
+            return
+        if not self.almacen.columnas:
+            self.actualizar_datos(df)
+            return
+        filas_previas = len(self.almacen)
+        self.beginInsertRows(QModelIndex(), filas_previas, filas_previas + len(df) - 1)
+        cambiadas = self._anexar(df)
+        self.endInsertRows()
+        for col in cambiadas:
+            self.dataChanged.emit(self.index(0, col), self.index(filas_previas - 1, col))
+
+    def limpiar(self):
+        """Deja el modelo vacío."""
+        self.actualizar_datos(pd.DataFrame())
+
     def rowCount(self, parent=QModelIndex()):
-        return self._data.shape[0]
+        return len(self.almacen)
 
     def columnCount(self, parent=QModelIndex()):
-        return self._data.shape[1]
+        return len(self.almacen.columnas)
 
     def data(self, index, role=Qt.DisplayRole):
-        if index.isValid() and role == Qt.DisplayRole:
-            return str(self._data.iloc[index.row(), index.column()])
+        if not index.isValid():
+            return None
+        if role == Qt.DisplayRole:
+            return self._texto(index.row(), index.column())
+        if role == Qt.TextAlignmentRole:
+            if self._formatos[index.column()] == "texto":
+                return int(Qt.AlignLeft | Qt.AlignVCenter)
+            return int(Qt.AlignRight | Qt.AlignVCenter)
         return None
 
     def headerData(self, section, orientation, role=Qt.DisplayRole):
         if role == Qt.DisplayRole:
             if orientation == Qt.Horizontal:
                 try:
-                    return self._data.columns[section]
+                    return str(self.almacen.columnas[section])
                 except IndexError:
                     return ""
             else:
@@ -1,35 +1,155 @@
 from PyQt5.QtCore import QObject, pyqtSignal
-import pandas as pd
-import time
+import threading
+from config.logging_config import LOTES_EN_VUELO, etiqueta_destino
 
 class ImportWorker(QObject):
+    """
+    Ejecuta la importación por bloques en un hilo y entrega cada bloque a la interfaz.
+
+    Entre la lectura y la interfaz hay una cola acotada: como máximo 'max_pendientes'
+    bloques emitidos que la vista todavía no confirmó con confirmar_lote(). Mientras la
+    cola está llena el worker no pide el siguiente bloque, de modo que la lectura avanza
+    al ritmo en que la vista puede mostrar los datos. Los bloques de la cola se reflejan
+    en el gauge LOTES_EN_VUELO del destino.
+
+    cancelar() puede llamarse desde el hilo de la interfaz: detiene la entrega de bloques
+    e interrumpe la consulta DuckDB en curso. Con SQL Server la cancelación se aplica al
+    terminar el bloque que se está leyendo.
+
+    Con paginacion='snapshot' (DuckDB), el worker refresca el snapshot 'import_id' de la
+    importación anterior o crea uno nuevo antes de leer, y emite 'snapshot_listo' con su
+    identificador: todas las páginas, también las que la vista pida después, se leen de él.
+    """
     # Definición de las señales
     finished = pyqtSignal()              # Se emite cuando todo el proceso finaliza
     lote_recibido = pyqtSignal(int, object)  # Emite el offset (int) y el DataFrame (object)
+    progreso = pyqtSignal(int, int)      # Emite las filas recibidas y el total solicitado
+    cancelado = pyqtSignal()             # Se emite si la importación terminó por cancelar()
     error = pyqtSignal(str)              # Emite un mensaje de error (str)
+    snapshot_listo = pyqtSignal(str)     # Emite el import_id del snapshot que se está recorriendo
 
-    def __init__(self, connection_config, total_rows, batch_size, parent=None):
+    def __init__(self, connection_config, total_rows, batch_size, origen="duckdb", paginacion="keyset",
+                 max_pendientes=2, import_id=None, parent=None):
         super().__init__(parent)
         self.connection_config = connection_config
         self.total_rows = total_rows
         self.batch_size = batch_size
+        self.origen = origen
+        self.paginacion = paginacion
+        self.import_id = import_id
+        self._pendientes = threading.Semaphore(max(max_pendientes, 1))
+        self._cancelar = threading.Event()
+        self._hilo = None  # Hilo que ejecuta run(); solo se interrumpen sus consultas
+        self._en_vuelo = LOTES_EN_VUELO.labels(etiqueta_destino(connection_config))
+
+    def _lotes(self):
+        """Generador de (offset, DataFrame) del origen configurado."""
+        if self.origen == "sqlserver":
+            from query.consulta import obtener_datos_por_lotes
+            offset = 0
+            for df in obtener_datos_por_lotes(self.connection_config, self.total_rows, self.batch_size,
+                                              self.paginacion):
+                yield offset, df
+                offset += len(df)
+        elif self.origen == "duckdb":
+            from connect.importacion import importar_datos_generator
+            import_id = self._preparar_snapshot() if self.paginacion == "snapshot" else None
+            yield from importar_datos_generator(self.connection_config, self.total_rows, self.batch_size,
+                                                self.paginacion, import_id=import_id)
+        else:
+            raise ValueError(f"Origen de datos no soportado: {self.origen}")
+
+    def _preparar_snapshot(self):
+        """
+        Refresca con los cambios posteriores a su marca de agua el snapshot de la
+        importación anterior o, si no hay uno o el refresco falla, crea uno nuevo.
+        Retorna el import_id a recorrer.
+        """
+        from connect.importacion import eliminar_snapshot_importacion
+        from connect.incremental import crear_snapshot_incremental, refrescar_snapshot_incremental
+        if self.import_id is not None:
+            if refrescar_snapshot_incremental(self.connection_config, self.import_id) is None:
+                # El snapshot que no se pudo refrescar se reemplaza: no debe quedar en la base
+                eliminar_snapshot_importacion(self.connection_config, self.import_id)
+                self.import_id = None
+        if self.import_id is None:
+            self.import_id = crear_snapshot_incremental(self.connection_config)
+        self.snapshot_listo.emit(self.import_id)
+        return self.import_id
+
+    def _esperar_turno(self):
+        """Espera a que haya lugar en la cola. Retorna False si la importación se canceló."""
+        while not self._pendientes.acquire(timeout=0.1):
+            if self._cancelar.is_set():
+                return False
+        return not self._cancelar.is_set()
+
+    def confirmar_lote(self):
+        """La vista la llama cuando terminó de mostrar un bloque, liberando un lugar en la cola."""
+        self._en_vuelo.dec()
+        self._pendientes.release()
+
+    def cancelar(self):
+        """
+        Solicita la cancelación e interrumpe la consulta DuckDB en curso de este worker.
+        Las de otras importaciones o de la lectura anticipada de páginas sobre la misma
+        base no se ven afectadas.
+        """
+        self._cancelar.set()
+        if self.origen == "duckdb" and self._hilo is not None:
+            from connect.conexion_duckdb import obtener_gestor
+            obtener_gestor(self.connection_config.get("database", ":memory:")).interrumpir(self._hilo)
 
     def run(self):
         """
-        Método que se ejecuta en el hilo. Este método obtiene datos en bloques
-        y emite la señal 'lote_recibido' por cada bloque.
-        Al finalizar, emite 'finished'. En caso de error, emite 'error'.
+        Método que se ejecuta en el hilo. Recorre el generador de bloques, emite
+        'lote_recibido' y 'progreso' por cada bloque y, al finalizar, 'finished'.
+        En caso de error, emite 'error'.
         """
+        self._hilo = threading.current_thread()
+        # Una cancelación anterior a registrar el hilo no pudo interrumpir nada: no se empieza
+        lotes = self._lotes() if not self._cancelar.is_set() else (lote for lote in ())
+        filas = 0
         try:
-            for offset in range(0, self.total_rows, self.batch_size):
-                # Aquí deberías colocar la lógica real de importación.
-                # En este ejemplo se crea un DataFrame de muestra (dummy).
-                data = {'dummy_column': [f"Fila {i + offset}" for i in range(self.batch_size)]}
-                df = pd.DataFrame(data)
-                
-                # Emitir la señal con el offset y el DataFrame obtenido.
+            for offset, df in lotes:
+                if not self._esperar_turno():
+                    break
+                filas += len(df)
+                self._en_vuelo.inc()
                 self.lote_recibido.emit(offset, df)
-                time.sleep(0.5)  # Simula un retraso en el proceso.
+                self.progreso.emit(filas, self.total_rows)
+        except Exception as e:
+            if not self._cancelar.is_set():
+                self.error.emit(str(e))
+        finally:
+            lotes.close()  # Libera el cursor de la lectura en curso
+            if self._cancelar.is_set():
+                self.cancelado.emit()
+            self.finished.emit()
+
+class PaginaWorker(QObject):
+    """
+    Lee en un hilo una página del snapshot de la importación, creando el snapshot si aún
+    no existe, para que la vista pueda anticipar la carga de la página siguiente.
+    """
+    pagina_lista = pyqtSignal(str, int, object)  # Emite el import_id, el offset y el DataFrame
+    error = pyqtSignal(str)
+    finished = pyqtSignal()
+
+    def __init__(self, connection_config, import_id, offset, limit, parent=None):
+        super().__init__(parent)
+        self.connection_config = connection_config
+        self.import_id = import_id
+        self.offset = offset
+        self.limit = limit
+
+    def run(self):
+        try:
+            from connect.importacion import obtener_datos_snapshot
+            from connect.incremental import crear_snapshot_incremental
+            import_id = self.import_id or crear_snapshot_incremental(self.connection_config)
+            df = obtener_datos_snapshot(self.connection_config, import_id, self.offset, self.limit)
+            self.pagina_lista.emit(import_id, self.offset, df)
         except Exception as e:
             self.error.emit(str(e))
         finally:
@@ -0,0 +1,144 @@
+# query/benchmark_sql.py
+"""
+Compara las variantes de la consulta de importación (ver VARIANTES_IMPORTACION en query/sql.py)
+sobre datos sintéticos en DuckDB: verifica que devuelven el mismo resultado, que la paginación
+por keyset entrega exactamente las mismas filas que la consulta completa, y mide su tiempo.
+
+Uso:
+    python -m query.benchmark_sql [n_referencias] [repeticiones] [lote_keyset]
+"""
+import sys
+import time
+import duckdb
+import pandas as pd
+from connect.regiones import sincronizar_regiones_duckdb
+from query.sql import VARIANTES_IMPORTACION, obtener_consulta_importacion_completa
+from query.sql import obtener_consulta_importacion_keyset, obtener_ultima_clave
+
+# Tiendas de las distintas regiones, incluida una sin región asignada (9999).
+TIENDAS_SINTETICAS = [1, 1002, 1004, 1026, 1032, 1033, 2003, 2004, 2005, 2006, 2007, 9999]
+
+def crear_datos_sinteticos(con, n_referencias=50000):
+    """
+    Crea en 'con' las tablas de inventario con datos pseudoaleatorios reproducibles.
+    Incluye referencias sin hechos, referencias con existencia total 0 y existencias negativas,
+    y referencias repetidas en la dimensión (misma Referencia y CodigoMarca con otro Nombre),
+    algunas sin Fabricante ni categoría, para que los grupos difieran solo en esas columnas.
+    """
+    tiendas = ", ".join(f"({t}, 'Tienda {t}')" for t in TIENDAS_SINTETICAS)
+    n_tiendas = len(TIENDAS_SINTETICAS)
+    con.execute(f"CREATE OR REPLACE TABLE tbDimTiendas AS SELECT * FROM (VALUES {tiendas}) t(dimID_Tienda, NombreTienda)")
+    con.execute("""
+        CREATE OR REPLACE TABLE tbDimCategorias AS
+        SELECT range::INTEGER AS dimID_Categoria, 'Sublinea ' || range AS NombreSubLinea FROM range(40)
+    """)
+    con.execute(f"""
+        CREATE OR REPLACE TABLE tbDimInventario AS
+        SELECT
+            range::INTEGER AS dimID_Inventario,
+            'REF' || lpad(((range * 7919) % {n_referencias})::VARCHAR, 8, '0') AS Referencia,
+            'Marca ' || (range % 97) AS NombreMarca,
+            'M' || lpad((range % 97)::VARCHAR, 3, '0') AS CodigoMarca,
+            'Producto ' || range AS Nombre,
+            'Fabricante ' || (range % 13) AS Fabricante,
+            'Categoria ' || (range % 11) AS NombreCategoria,
+            (range % 40)::INTEGER AS dimID_Categoria
+        FROM range({n_referencias})
+    """)
+    # Una de cada 20 referencias se repite con otro Nombre; la mitad de las repetidas no tiene
+    # Fabricante y apunta a una categoría inexistente (NombreSubLinea NULL).
+    con.execute(f"""
+        INSERT INTO tbDimInventario
+        SELECT
+            {n_referencias} + dimID_Inventario + 1,  -- Id impar: sus hechos no son todos 0
+            Referencia,
+            NombreMarca,
+            CodigoMarca,
+            Nombre || ' bis',
+            CASE WHEN dimID_Inventario % 40 = 0 THEN NULL ELSE Fabricante END,
+            NombreCategoria,
+            CASE WHEN dimID_Inventario % 40 = 0 THEN -1 ELSE dimID_Categoria END
+        FROM tbDimInventario
+        WHERE dimID_Inventario % 20 = 0
+    """)
+    # Cada referencia tiene hechos en varias tiendas (algunas repetidas); el 3% no tiene hechos
+    # y el 10% tiene existencia 0 en todas sus tiendas.
+    con.execute(f"""
+        CREATE OR REPLACE TABLE tbHecInventario AS
+        SELECT
+            i.dimID_Inventario AS dimid_inventario,
+            list_extract({TIENDAS_SINTETICAS}, 1 + (hash(i.dimID_Inventario, h.range) % {n_tiendas})::INTEGER) AS dimid_tienda,
+            CASE
+                WHEN i.dimID_Inventario % 10 = 0 THEN 0
+                ELSE (hash(h.range, i.dimID_Inventario) % 25)::INTEGER - 4
+            END AS Existencia
+        FROM tbDimInventario i, range(8) h
+        WHERE i.dimID_Inventario % 33 <> 0
+          AND h.range < 1 + i.dimID_Inventario % 8
+    """)
+    sincronizar_regiones_duckdb(con)
+
+def ejecutar_variante(con, variante, repeticiones=3):
+    """
+    Ejecuta la consulta completa de la variante y retorna (DataFrame, mejor tiempo en segundos).
+    """
+    consulta = obtener_consulta_importacion_completa(variante)
+    mejor = None
+    df = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        df = con.execute(consulta).fetchdf()
+        transcurrido = time.perf_counter() - inicio
+        mejor = transcurrido if mejor is None else min(mejor, transcurrido)
+    return df, mejor
+
+def recorrer_keyset(con, variante, limit):
+    """Recorre la consulta de la variante página a página por keyset y retorna las filas concatenadas."""
+    bloques = []
+    ultima_clave = None
+    while True:
+        consulta, parametros = obtener_consulta_importacion_keyset(ultima_clave, limit, variante)
+        df = con.execute(consulta, parametros).fetchdf()
+        if df.empty:
+            break
+        bloques.append(df)
+        if len(df) < limit:
+            break
+        ultima_clave = obtener_ultima_clave(df)
+    return pd.concat(bloques, ignore_index=True) if bloques else pd.DataFrame()
+
+def comparar_variantes(n_referencias=50000, repeticiones=3, lote_keyset=997):
+    """
+    Compara todas las variantes contra la 'clasica' sobre los mismos datos sintéticos y
+    verifica que la paginación por keyset con lotes de 'lote_keyset' filas no pierde ni
+    repite filas.
+
+    Retorna:
+      DataFrame: Una fila por variante con filas devueltas, mejor tiempo, si coincide con la
+                 clásica y si el recorrido por keyset coincide con la consulta completa.
+    """
+    con = duckdb.connect(":memory:")
+    crear_datos_sinteticos(con, n_referencias)
+
+    referencia, _ = ejecutar_variante(con, "clasica", 1)
+    resultados = []
+    for variante in VARIANTES_IMPORTACION:
+        df, segundos = ejecutar_variante(con, variante, repeticiones)
+        coincide = df.reset_index(drop=True).equals(referencia.reset_index(drop=True))
+        keyset = recorrer_keyset(con, variante, lote_keyset)
+        resultados.append({
+            "variante": variante,
+            "filas": len(df),
+            "segundos": round(segundos, 4),
+            "coincide_con_clasica": coincide,
+            "keyset_coincide": keyset.equals(df.reset_index(drop=True)),
+        })
+    con.close()
+    return pd.DataFrame(resultados)
+
+if __name__ == "__main__":
+    n_referencias = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    repeticiones = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    lote_keyset = int(sys.argv[3]) if len(sys.argv) > 3 else 997
+    print(f"Comparando variantes con {n_referencias} referencias ({repeticiones} repeticiones):")
+    print(comparar_variantes(n_referencias, repeticiones, lote_keyset).to_string(index=False))
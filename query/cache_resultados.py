@@ -0,0 +1,170 @@
+# query/cache_resultados.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+import pandas as pd
+from config.config import RESULT_CACHE_CONFIG
+from config.logging_config import url_sin_credenciales
+
+logger = logging.getLogger("ImportacionLogger")
+
+class CacheResultados:
+    """
+    Caché en disco de resultados de consultas, almacenados como archivos Parquet.
+
+    La clave es un hash del texto SQL, sus parámetros y el destino de la conexión.
+    Cada entrada usa dos marcas de tiempo del archivo: 'mtime' es el momento en que se
+    guardó (para el TTL) y 'atime' se actualiza en cada acierto (para el desalojo LRU
+    cuando se supera el presupuesto de tamaño).
+    """
+    def __init__(self, directorio, max_bytes, ttl_segundos, habilitado=True):
+        self.directorio = directorio
+        self.max_bytes = max_bytes
+        self.ttl_segundos = ttl_segundos
+        self.habilitado = habilitado
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def clave(sql, parametros=None, destino=None):
+        """Retorna el hash que identifica una consulta contra un destino concreto."""
+        contenido = json.dumps([sql, list(parametros or []), destino], default=str, ensure_ascii=False)
+        return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+    def _ruta(self, clave):
+        return os.path.join(self.directorio, f"{clave}.parquet")
+
+    def obtener(self, clave):
+        """Retorna el DataFrame guardado para 'clave', o None si no existe o ya expiró."""
+        ruta = self._ruta(clave)
+        try:
+            guardado = os.stat(ruta).st_mtime
+        except OSError:
+            return None
+        ahora = time.time()
+        if ahora - guardado > self.ttl_segundos:
+            self._eliminar(ruta)
+            return None
+        try:
+            df = pd.read_parquet(ruta)
+            os.utime(ruta, (ahora, guardado))  # Marca el uso sin alterar la antigüedad
+            return df
+        except Exception as e:
+            logger.warning(f"Entrada de caché ilegible, se descarta: {e}")
+            self._eliminar(ruta)
+            return None
+
+    def guardar(self, clave, df):
+        """Guarda el DataFrame en la caché y desaloja entradas si se supera el presupuesto."""
+        os.makedirs(self.directorio, exist_ok=True)
+        ruta = self._ruta(clave)
+        temporal = f"{ruta}.{uuid.uuid4().hex}.tmp"
+        try:
+            df.to_parquet(temporal, index=False)
+            os.replace(temporal, ruta)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar el resultado en caché: {e}")
+            self._eliminar(temporal)
+            return
+        self._desalojar()
+
+    def obtener_o_calcular(self, sql, parametros, destino, calcular):
+        """
+        Retorna el resultado en caché de la consulta o lo calcula con 'calcular()' y lo guarda.
+        Los resultados vacíos no se guardan, y si 'calcular()' falla la excepción se propaga
+        sin guardar nada.
+        """
+        if not self.habilitado:
+            return calcular()
+        clave = self.clave(sql, parametros, destino)
+        df = self.obtener(clave)
+        if df is not None:
+            logger.debug(f"Resultado servido desde la caché ({clave[:12]}).")
+            return df
+        df = calcular()
+        if df is not None and not df.empty:
+            self.guardar(clave, df)
+        return df
+
+    def _desalojar(self):
+        """Elimina entradas expiradas y, después, las menos usadas hasta cumplir 'max_bytes'."""
+        with self._lock:
+            ahora = time.time()
+            entradas = []
+            for nombre in os.listdir(self.directorio):
+                if not nombre.endswith(".parquet"):
+                    continue
+                ruta = os.path.join(self.directorio, nombre)
+                try:
+                    info = os.stat(ruta)
+                except OSError:
+                    continue
+                if ahora - info.st_mtime > self.ttl_segundos:
+                    self._eliminar(ruta)
+                else:
+                    entradas.append((info.st_atime, info.st_size, ruta))
+
+            total = sum(tamano for _, tamano, _ in entradas)
+            for _, tamano, ruta in sorted(entradas):
+                if total <= self.max_bytes:
+                    break
+                self._eliminar(ruta)
+                total -= tamano
+
+    def limpiar(self):
+        """Elimina todas las entradas de la caché."""
+        if os.path.isdir(self.directorio):
+            for nombre in os.listdir(self.directorio):
+                self._eliminar(os.path.join(self.directorio, nombre))
+
+    @staticmethod
+    def _eliminar(ruta):
+        try:
+            os.remove(ruta)
+        except OSError:
+            pass
+
+_cache = None
+
+def obtener_cache():
+    """Retorna la caché de resultados del proceso, configurada con RESULT_CACHE_CONFIG."""
+    global _cache
+    if _cache is None:
+        _cache = CacheResultados(
+            RESULT_CACHE_CONFIG['directorio'],
+            RESULT_CACHE_CONFIG['max_bytes'],
+            RESULT_CACHE_CONFIG['ttl_segundos'],
+            RESULT_CACHE_CONFIG.get('habilitado', True)
+        )
+    return _cache
+
+def destino_conexion(config):
+    """
+    Retorna la parte de la clave de caché que identifica el destino de la conexión:
+    usuario, servidor y base de datos para SQL Server, o la base DuckDB. Si la configuración
+    trae 'url' se incluye sin credenciales (ver url_sin_credenciales), de modo que dos URL
+    distintas no comparten entradas.
+    """
+    destino = f"{config.get('login', '')}@{config.get('server_name', '')}/{config.get('database', ':memory:')}"
+    if config.get('url'):
+        destino = f"{destino}|{url_sin_credenciales(config['url'])}"
+    return destino
+
+def destino_archivo(ruta):
+    """
+    Retorna la parte de la clave de caché de un archivo local (por ejemplo, un Parquet
+    exportado). Incluye su tamaño y fecha de modificación para invalidar la caché al reescribirlo.
+    Para un dataset particionado se usa su manifiesto, que se reemplaza en cada escritura.
+    """
+    try:
+        if os.path.isdir(ruta):
+            from connect.exportacion import MANIFIESTO_DATASET
+            info = os.stat(os.path.join(ruta, MANIFIESTO_DATASET))
+            return f"{os.path.abspath(ruta)}:{info.st_size}:{info.st_mtime_ns}"
+        info = os.stat(ruta)
+        return f"{os.path.abspath(ruta)}:{info.st_size}:{info.st_mtime_ns}"
+    except OSError:
+        return os.path.abspath(ruta)
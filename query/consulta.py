@@ -1,9 +1,12 @@
 import pandas as pd
-import time
-from sqlalchemy import create_engine
-from urllib.parse import quote_plus
-from functools import lru_cache
-from query.sql import obtener_consulta_importacion
+import numpy as np
+import pyarrow as pa
+from query.sql import obtener_consulta_importacion, obtener_consulta_importacion_keyset, obtener_ultima_clave
+from query.sql import obtener_consulta_importacion_completa
+from query.cache_resultados import obtener_cache, destino_conexion
+from query.esquema import EsquemaImportacion
+from connect.motores import obtener_motor
+from config.logging_config import medir_etapa, registrar_lote
 from contextlib import contextmanager
 
 # Se ha eliminado toda la configuración y llamadas a logging.
@@ -15,53 +18,15 @@ def disable_logs(level=None):
     """
     yield
 
-def _engine_cache_key(config: dict):
-    """
-    Crea una clave inmutable a partir de la configuración para cachear la conexión.
-    Se asume que los campos relevantes son: server_name, database, login y password.
-    """
-    return (
-        config.get('server_name'),
-        config.get('database', "BODEGA_DATOS"),
-        config.get('login'),
-        config.get('password')
-    )
-
-@lru_cache(maxsize=5)
-def connect_sql_cached(server_name, database, login, password):
-    """
-    Crea y retorna un engine de SQLAlchemy basado en los parámetros de conexión.
-    Se cachea este engine para evitar recrearlo si la configuración no cambia.
-    """
-    driver = "SQL Server Native Client 11.0"
-    connection_string = (
-        f"DRIVER={{{driver}}};"
-        f"SERVER={server_name};"
-        f"DATABASE={database};"
-        f"UID={login};"
-        f"PWD={password};"
-        "Connection Timeout=30;"
-    )
-    params = quote_plus(connection_string)
-    connection_url = f"mssql+pyodbc:///?odbc_connect={params}"
-    try:
-        engine = create_engine(
-            connection_url,
-            pool_size=10,
-            max_overflow=20,
-            fast_executemany=True
-        )
-        return engine
-    except Exception as e:
-        return None
-
 def connect_sql(config):
     """
-    Retorna un engine de SQLAlchemy utilizando caché.
+    Retorna el engine de SQLAlchemy compartido para el destino de 'config'
+    (ver connect/motores.py).
     """
-    key = _engine_cache_key(config)
-    engine = connect_sql_cached(*key)
-    return engine
+    try:
+        return obtener_motor(config)
+    except Exception as e:
+        return None
 
 def obtener_datos(config, offset=0, limit=10000):
     """
@@ -73,29 +38,140 @@ def obtener_datos(config, offset=0, limit=10000):
       limit (int): Cantidad de registros a retornar.
     
     Retorna:
-      DataFrame: Datos obtenidos, o uno vacío en caso de error.
+      DataFrame: Datos obtenidos (vacío si no quedan filas). Un error de conexión o de
+                 la consulta se propaga, para no confundirlo con el final de los datos.
     """
-    engine = connect_sql(config)
-    if engine is None:
-        return pd.DataFrame()
+    engine = obtener_motor(config)
 
-    query = obtener_consulta_importacion(offset, limit)
+    query = obtener_consulta_importacion(offset, limit, dialecto=engine.dialect.name)
     if not query or not query.strip():
         return pd.DataFrame()
 
-    try:
+    def ejecutar():
         with disable_logs():
-            inicio = time.time()
-            df = pd.read_sql(query, con=engine)
-            fin = time.time()
-        elapsed_time = fin - inicio
-        if df is None or df.empty:
-            return pd.DataFrame()
-        return df
-    except Exception as e:
-        return pd.DataFrame()
+            # read_sql ejecuta y lee en una sola llamada: se mide como una única etapa
+            with medir_etapa("consulta", "sqlserver_offset", config):
+                df = pd.read_sql(query, con=engine)
+        return df if df is not None else pd.DataFrame()
+
+    # Una consulta repetida dentro del TTL se sirve desde la caché local sin ir al servidor
+    return obtener_cache().obtener_o_calcular(query, None, destino_conexion(config), ejecutar)
+
+def obtener_datos_keyset(config, ultima_clave=None, limit=10000):
+    """
+    Ejecuta la consulta SQL paginada por keyset y retorna el bloque siguiente a 'ultima_clave'.
+    
+    Parámetros:
+      config (dict): Configuración de conexión.
+      ultima_clave (tuple): Clave de la última fila del bloque anterior, o None para el primero.
+      limit (int): Cantidad de registros a retornar.
+    
+    Retorna:
+      DataFrame: Datos obtenidos (vacío si no quedan filas). Un error de conexión o de
+                 la consulta se propaga, para no confundirlo con el final de los datos.
+    """
+    engine = obtener_motor(config)
+
+    # SQL Server no admite LIMIT: la consulta se genera en el dialecto del engine
+    query, parametros = obtener_consulta_importacion_keyset(ultima_clave, limit, dialecto=engine.dialect.name)
+    def ejecutar():
+        with medir_etapa("consulta", "sqlserver_keyset", config):
+            df = pd.read_sql(query, con=engine, params=tuple(parametros) or None)
+        return df if df is not None else pd.DataFrame()
+
+    return obtener_cache().obtener_o_calcular(query, parametros, destino_conexion(config), ejecutar)
+
+def _columna_arrow(valores, tipo=None):
+    """
+    Convierte un buffer de valores de Python a un arreglo Arrow, con el tipo de los bloques
+    anteriores si se conoce. Los decimales pasan a float64, como en pd.read_sql.
+
+    Retorna:
+      tuple: (arreglo convertido, tipo a usar en los bloques siguientes)
+    """
+    arreglo = None
+    if tipo is not None and not pa.types.is_null(tipo):
+        try:
+            arreglo = pa.array(valores, type=tipo, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            arreglo = None  # Valores fuera del tipo del primer bloque: se infiere de nuevo
+    if arreglo is None:
+        arreglo = pa.array(valores, from_pandas=True)
+        tipo = arreglo.type
+    if pa.types.is_decimal(arreglo.type):
+        arreglo = arreglo.cast(pa.float64())
+    return arreglo, tipo
+
+def iterar_lotes_servidor(config, batch_size=10000, consulta=None, parametros=None):
+    """
+    Ejecuta la consulta una sola vez con un cursor del lado del servidor (stream_results)
+    y entrega el resultado en pyarrow.RecordBatch de 'batch_size' filas. Las filas se leen
+    con fetchmany y se copian por columna a buffers de tamaño fijo que se reutilizan en
+    cada bloque, de modo que solo un bloque del resultado está en memoria a la vez.
+
+    Funciona con cualquier engine de SQLAlchemy cuyo driver use marcadores '?' (SQL Server
+    con pyodbc, o SQLite para pruebas mediante config['url']).
+
+    Parámetros:
+      config (dict): Configuración de conexión.
+      batch_size (int): Filas por bloque.
+      consulta (str): Consulta a ejecutar; por defecto la consulta de importación completa.
+      parametros (list): Parámetros de la consulta, si los tiene.
+
+    Yields:
+      pyarrow.RecordBatch: Bloques del resultado en orden.
+    """
+    engine = obtener_motor(config)
+    consulta = consulta or obtener_consulta_importacion_completa(dialecto=engine.dialect.name)
+    with engine.connect().execution_options(stream_results=True, max_row_buffer=batch_size) as conexion:
+        with medir_etapa("consulta", "sqlserver_flujo", config):
+            resultado = conexion.exec_driver_sql(consulta, tuple(parametros or ()))
+        columnas = list(resultado.keys())
+        buffers = [np.empty(batch_size, dtype=object) for _ in columnas]
+        tipos = [None] * len(columnas)
+        while True:
+            with medir_etapa("lectura", "sqlserver_flujo", config):
+                filas = resultado.fetchmany(batch_size)
+            if not filas:
+                break
+            n = len(filas)
+            arreglos = []
+            with medir_etapa("conversion", "sqlserver_flujo", config):
+                for j, valores in enumerate(zip(*filas)):
+                    buffers[j][:n] = valores
+                    arreglo, tipos[j] = _columna_arrow(buffers[j][:n], tipos[j])
+                    arreglos.append(arreglo)
+            yield pa.RecordBatch.from_arrays(arreglos, names=columnas)
+
+def obtener_datos_en_flujo(config, total_rows=None, batch_size=10000, formato="pandas"):
+    """
+    Extrae la importación con una única ejecución de la consulta en el servidor, en lugar
+    de una consulta paginada por bloque.
+
+    Parámetros:
+      total_rows (int): Máximo de filas a extraer (None para todas).
+      formato (str): 'pandas' entrega DataFrames; 'arrow' entrega pyarrow.RecordBatch.
+
+    Yields:
+      DataFrame | pyarrow.RecordBatch: Bloques de 'batch_size' filas (el último puede ser menor).
+    """
+    if formato not in ("pandas", "arrow"):
+        raise ValueError(f"Formato no soportado: {formato}")
+    extraidas = 0
+    for lote in iterar_lotes_servidor(config, batch_size):
+        if total_rows is not None:
+            lote = lote.slice(0, total_rows - extraidas)
+        extraidas += lote.num_rows
+        if formato == "arrow":
+            yield lote
+        else:
+            with medir_etapa("conversion", "sqlserver_flujo", config):
+                df = lote.to_pandas()
+            yield df
+        if total_rows is not None and extraidas >= total_rows:
+            return
 
-def obtener_datos_por_lotes(config, total_rows, batch_size=10000):
+def obtener_datos_por_lotes(config, total_rows, batch_size=10000, paginacion="keyset", compactar=True):
     """
     Generador que extrae datos SQL en bloques y entrega cada bloque.
     
@@ -103,15 +179,48 @@ def obtener_datos_por_lotes(config, total_rows, batch_size=10000):
       config (dict): Configuración de conexión.
       total_rows (int): Cantidad total de registros que se desea extraer.
       batch_size (int): Número de registros por cada bloque.
+      paginacion (str): 'keyset' (por defecto) continúa desde la última clave de cada bloque;
+                        'offset' usa LIMIT/OFFSET sobre la consulta completa;
+                        'flujo' ejecuta la consulta una sola vez con un cursor del servidor.
+      compactar (bool): Aplica a cada bloque los tipos de ESQUEMA_IMPORTACION.
     
     Yields:
       DataFrame: Bloque de datos obtenido de la consulta.
     """
-    for offset in range(0, total_rows, batch_size):
-        df = obtener_datos(config, offset=offset, limit=batch_size)
+    esquema = EsquemaImportacion() if compactar else None
+    etiqueta = f"sqlserver_{paginacion}"
+    for df in _lotes_sqlserver(config, total_rows, batch_size, paginacion):
+        if esquema is not None:
+            with medir_etapa("conversion", etiqueta, config):
+                df = esquema.aplicar(df)
+        registrar_lote(etiqueta, config, df)
+        yield df
+
+def _lotes_sqlserver(config, total_rows, batch_size, paginacion):
+    """Recorre la extracción en el modo de paginación indicado (ver obtener_datos_por_lotes)."""
+    if paginacion == "flujo":
+        yield from obtener_datos_en_flujo(config, total_rows, batch_size)
+        return
+    if paginacion == "offset":
+        for offset in range(0, total_rows, batch_size):
+            df = obtener_datos(config, offset=offset, limit=batch_size)
+            if df.empty:
+                break
+            yield df
+        return
+
+    ultima_clave = None
+    extraidas = 0
+    while extraidas < total_rows:
+        limite = min(batch_size, total_rows - extraidas)
+        df = obtener_datos_keyset(config, ultima_clave, limit=limite)
         if df.empty:
             break
         yield df
+        if len(df) < limite:
+            break
+        ultima_clave = obtener_ultima_clave(df)
+        extraidas += len(df)
 
 if __name__ == "__main__":
     # Configuración de conexión
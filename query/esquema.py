@@ -0,0 +1,105 @@
+# query/esquema.py
+import numpy as np
+import pandas as pd
+from query.sql import ESQUEMA_IMPORTACION
+
+class EsquemaImportacion:
+    """
+    Aplica a cada bloque de una importación los tipos compactos declarados en
+    ESQUEMA_IMPORTACION (o en 'tipos').
+
+    Las columnas 'category' comparten un único conjunto de categorías entre todos los
+    bloques: las categorías nuevas de cada bloque se agregan al final, por lo que los
+    códigos de los bloques anteriores siguen siendo válidos y todos los bloques pueden
+    llevarse al conjunto final sin recalcularlos (ver unificar). Se usa una instancia
+    por importación.
+
+    Los numéricos se convierten siempre al tipo declarado, de modo que todos los bloques de
+    la importación tienen el mismo tipo (el Parquet que los recibe fija su esquema con el
+    primero). Si un valor no se representa exactamente en ese tipo se lanza ValueError en
+    lugar de redondearlo o de cambiar el tipo a mitad de la importación.
+    """
+    def __init__(self, tipos=None):
+        self.tipos = dict(ESQUEMA_IMPORTACION if tipos is None else tipos)
+        self._categorias = {}  # columna -> pd.Index con las categorías en orden de aparición
+
+    def categorias(self, columna):
+        """Categorías conocidas de la columna hasta el momento."""
+        return self._categorias.get(columna, pd.Index([], dtype=object))
+
+    def _categorizar(self, columna, serie):
+        if isinstance(serie.dtype, pd.CategoricalDtype):
+            categorica = serie.array
+        else:
+            categorica = pd.Categorical(serie)
+        conocidas = self.categorias(columna)
+        nuevas = categorica.categories[~categorica.categories.isin(conocidas)]
+        if len(nuevas):
+            conocidas = conocidas.append(nuevas) if len(conocidas) else nuevas
+            self._categorias[columna] = conocidas
+        return categorica.set_categories(conocidas)
+
+    @staticmethod
+    def _convertir(columna, serie, tipo):
+        """
+        Retorna la serie en 'tipo'; lanza ValueError si algún valor no cabe exactamente en él
+        (fuera del rango de un tipo entero, o con decimales).
+        """
+        if serie.dtype == tipo:
+            return serie
+        destino = pd.api.types.pandas_dtype(tipo)
+        if destino.kind in "iu" and serie.dtype.kind in "iuf":
+            rango = np.iinfo(destino.numpy_dtype if hasattr(destino, "numpy_dtype") else destino)
+            minimo, maximo = serie.min(), serie.max()
+            if pd.notna(minimo) and (minimo < rango.min or maximo > rango.max):
+                raise ValueError(f"La columna {columna} tiene valores fuera del rango de {tipo}: [{minimo}, {maximo}].")
+        try:
+            with np.errstate(invalid="ignore"):
+                convertida = serie.astype(destino)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"La columna {columna} no puede convertirse a {tipo}: {e}") from e
+        if serie.dtype.kind in "iuf":
+            flotante = serie.dtype.kind == "f"
+            valores = serie.to_numpy(dtype=np.float64 if flotante else None, na_value=np.nan if flotante else None)
+            vuelta = convertida.to_numpy(dtype=valores.dtype, na_value=np.nan if flotante else None)
+            if not np.array_equal(vuelta, valores, equal_nan=flotante):
+                raise ValueError(f"La columna {columna} tiene valores que no se representan exactamente en {tipo}.")
+        return convertida
+
+    def aplicar(self, df):
+        """Retorna el bloque con los tipos compactos; las columnas no declaradas no cambian."""
+        if df is None or df.empty:
+            return df
+        columnas = {}
+        for columna, tipo in self.tipos.items():
+            if columna not in df.columns:
+                continue
+            if tipo == "category":
+                columnas[columna] = self._categorizar(columna, df[columna])
+            else:
+                columnas[columna] = self._convertir(columna, df[columna], tipo)
+        return df.assign(**columnas) if columnas else df
+
+    def unificar(self, df):
+        """Lleva las columnas categóricas del bloque al conjunto de categorías actual."""
+        columnas = {
+            c: df[c].cat.set_categories(self._categorias[c])
+            for c in self._categorias
+            if c in df.columns and isinstance(df[c].dtype, pd.CategoricalDtype)
+        }
+        return df.assign(**columnas) if columnas else df
+
+    def concatenar(self, bloques):
+        """Concatena bloques compactados conservando las columnas categóricas."""
+        if not bloques:
+            return pd.DataFrame()
+        return pd.concat([self.unificar(df) for df in bloques], ignore_index=True)
+
+if __name__ == "__main__":
+    esquema = EsquemaImportacion()
+    lote1 = pd.DataFrame({"Region": ["Norte", "Sur", "Norte"], "dimID_Tienda": [1, 2, 3], "Existencia_Total": [1.0, 2.0, None]})
+    lote2 = pd.DataFrame({"Region": ["Este", "Sur"], "dimID_Tienda": [4, 5], "Existencia_Total": [3.0, 4.0]})
+    bloques = [esquema.aplicar(lote1), esquema.aplicar(lote2)]
+    df = esquema.concatenar(bloques)
+    print(df.dtypes)
+    print(df)
@@ -1,40 +1,312 @@
 # pivoting.py
+import numpy as np
 import pandas as pd
+from model.almacen_resultados import AlmacenResultados
+from query.sql import AGREGACIONES_PIVOT, nombre_tabla_snapshot, obtener_consulta_pivot, origen_dataset
 
-def transformar_datos(df):
+class PivotDisperso:
+    """
+    Resultado de un pivot en memoria con representación dispersa.
+
+    Las etiquetas del índice (por ejemplo, referencias) y de las columnas (tiendas) se
+    codifican como enteros según su posición en 'filas' y 'columnas', ordenadas. Solo se
+    guardan las celdas con datos, como tres arreglos paralelos ordenados por fila y
+    columna: código de fila, código de columna y valor. El tamaño depende del número de
+    filas de origen y no del producto filas × columnas; la tabla densa se construye solo
+    al pedirla con a_dataframe().
+    """
+    def __init__(self, filas, columnas, codigo_fila, codigo_columna, valores,
+                 indice="Referencia", nombre_columnas="dimID_Tienda"):
+        self.filas = pd.Index(filas, name=indice)
+        self.columnas = pd.Index(columnas, name=nombre_columnas)
+        self.codigo_fila = np.asarray(codigo_fila, dtype=np.int64)
+        self.codigo_columna = np.asarray(codigo_columna, dtype=np.int64)
+        self.valores = np.asarray(valores)
+
+    @property
+    def shape(self):
+        return len(self.filas), len(self.columnas)
+
+    @property
+    def nbytes(self):
+        """Memoria ocupada por las celdas (sin contar las etiquetas)."""
+        return self.codigo_fila.nbytes + self.codigo_columna.nbytes + self.valores.nbytes
+
+    def __len__(self):
+        """Número de celdas con datos."""
+        return len(self.valores)
+
+    def fila(self, etiqueta):
+        """Retorna las celdas con datos de una etiqueta del índice como Series columna -> valor."""
+        codigo = self.filas.get_loc(etiqueta)
+        inicio, fin = np.searchsorted(self.codigo_fila, [codigo, codigo + 1])
+        return pd.Series(
+            self.valores[inicio:fin],
+            index=self.columnas[self.codigo_columna[inicio:fin]],
+            name=etiqueta,
+        )
+
+    def valor(self, fila, columna, defecto=np.nan):
+        """Retorna el valor de una celda, o 'defecto' si no tiene datos."""
+        return self.fila(fila).get(columna, defecto)
+
+    def a_dataframe(self):
+        """
+        Construye la tabla densa con el mismo formato que DataFrame.pivot(...).reset_index():
+        el índice como primera columna y NaN en las celdas sin datos.
+        """
+        matriz = np.full(self.shape, np.nan)
+        matriz[self.codigo_fila, self.codigo_columna] = self.valores
+        return pd.DataFrame(matriz, index=self.filas, columns=self.columnas).reset_index()
+
+def _factorizar(etiquetas):
+    """
+    Como pd.factorize(etiquetas, sort=True), pero también ordena por valor las columnas
+    categóricas, cuyas categorías quedan en orden de aparición (ver query/esquema.py). Los
+    códigos se traducen a partir de las categorías, sin expandir la columna a texto.
+    """
+    if not isinstance(etiquetas.dtype, pd.CategoricalDtype):
+        return pd.factorize(etiquetas, sort=True)
+    categorias = etiquetas.cat.categories
+    orden = categorias.argsort()
+    rango = np.empty(len(categorias), dtype=np.int64)
+    rango[orden] = np.arange(len(categorias))
+    codigos = etiquetas.cat.codes.to_numpy()
+    validos = codigos >= 0
+    ordenados = rango[codigos[validos]]
+    # Solo las categorías presentes reciben código, como en pd.factorize
+    presentes = np.bincount(ordenados, minlength=len(categorias)) > 0
+    traduccion = np.cumsum(presentes) - 1
+    resultado = np.full(len(codigos), -1, dtype=np.int64)
+    resultado[validos] = traduccion[ordenados]
+    return resultado, pd.Index(categorias[orden[presentes]])
+
+def pivot_disperso(datos, indice="Referencia", columnas="dimID_Tienda", valores="Existencia_Total", agregacion="sum"):
+    """
+    Pivota en memoria y retorna un PivotDisperso.
+
+    Parámetros:
+      datos: DataFrame o AlmacenResultados; de un almacén solo se materializan las tres columnas.
+      agregacion (str): Una de AGREGACIONES_PIVOT, aplicada cuando hay varias filas con el
+                        mismo índice y columna (en lugar de fallar como DataFrame.pivot).
+
+    Retorna:
+      PivotDisperso: Filas y columnas ordenadas; las filas con etiqueta o valor nulo se descartan.
+    """
+    if agregacion not in AGREGACIONES_PIVOT:
+        raise ValueError(f"Agregación no soportada: {agregacion!r}")
+    if isinstance(datos, AlmacenResultados):
+        datos = datos.a_dataframe(columnas=[indice, columnas, valores])
+
+    codigo_fila, filas = _factorizar(datos[indice])
+    codigo_columna, etiquetas_columnas = _factorizar(datos[columnas])
+    valores_origen = datos[valores].to_numpy()
+    validas = (codigo_fila >= 0) & (codigo_columna >= 0) & pd.notna(valores_origen)
+
+    # Cada celda se identifica con un único entero; agrupar por él resuelve los duplicados
+    celda = codigo_fila[validas].astype(np.int64) * len(etiquetas_columnas) + codigo_columna[validas]
+    agregado = pd.Series(valores_origen[validas]).groupby(celda, sort=True).agg(agregacion)
+    celdas = agregado.index.to_numpy()
+    return PivotDisperso(
+        filas, etiquetas_columnas,
+        celdas // max(len(etiquetas_columnas), 1), celdas % max(len(etiquetas_columnas), 1),
+        agregado.to_numpy(), indice, columnas,
+    )
+
+class AcumuladorPivot:
+    """
+    Pivot que se construye bloque a bloque, a medida que llegan los lotes de la importación.
+
+    Las etiquetas del índice y de las columnas se codifican como enteros (su posición en
+    índices que crecen al aparecer etiquetas nuevas), y cada lote se acumula en el lugar sobre
+    matrices filas × columnas preasignadas (su capacidad se duplica cuando hace falta).
+    Al llegar el último lote la tabla ancha ya está calculada: a_dataframe() solo ordena
+    y da formato, sin otra pasada sobre los datos.
+    """
+    def __init__(self, indice="Referencia", columnas="dimID_Tienda", valores="Existencia_Total", agregacion="sum",
+                 filas_estimadas=1024, columnas_estimadas=64):
+        if agregacion not in AGREGACIONES_PIVOT:
+            raise ValueError(f"Agregación no soportada: {agregacion!r}")
+        self.indice = indice
+        self.columnas = columnas
+        self.valores = valores
+        self.agregacion = agregacion
+        # La posición de cada etiqueta en estos índices es su código
+        self._filas = pd.Index([], dtype=object)
+        self._columnas = pd.Index([], dtype=object)
+        capacidad = (max(filas_estimadas, 1), max(columnas_estimadas, 1))
+        inicial = {"min": np.inf, "max": -np.inf}.get(agregacion, 0.0)
+        self._acumulado = np.full(capacidad, inicial)
+        self._conteo = np.zeros(capacidad, dtype=np.int32)
+
+    def __len__(self):
+        """Número de filas (etiquetas del índice) acumuladas."""
+        return len(self._filas)
+
+    @staticmethod
+    def _codificar(etiquetas, conocidas):
+        """
+        Retorna (códigos de 'etiquetas', índice de etiquetas conocidas actualizado). Las
+        etiquetas nuevas reciben los códigos siguientes y se agregan al final del índice;
+        las nulas quedan con código -1.
+        """
+        locales, unicas = pd.factorize(etiquetas)
+        if isinstance(unicas, pd.CategoricalIndex):
+            unicas = pd.Index(np.asarray(unicas))  # Las categorías de cada lote pueden diferir
+        if len(unicas) == 0:
+            return np.full(len(locales), -1, dtype=np.int64), conocidas
+        traduccion = conocidas.get_indexer(unicas)
+        nuevas = traduccion < 0
+        if nuevas.any():
+            traduccion[nuevas] = len(conocidas) + np.arange(nuevas.sum())
+            conocidas = conocidas.append(pd.Index(unicas[nuevas]))
+        return np.where(locales >= 0, traduccion[locales], -1), conocidas
+
+    def _asegurar_capacidad(self):
+        filas, columnas = self._acumulado.shape
+        necesarias = (len(self._filas), len(self._columnas))
+        if necesarias[0] <= filas and necesarias[1] <= columnas:
+            return
+        nueva = (max(filas, 1), max(columnas, 1))
+        nueva = tuple(n * 2 ** int(np.ceil(np.log2(max(req / n, 1)))) for n, req in zip(nueva, necesarias))
+        inicial = {"min": np.inf, "max": -np.inf}.get(self.agregacion, 0.0)
+        acumulado = np.full(nueva, inicial)
+        conteo = np.zeros(nueva, dtype=np.int32)
+        acumulado[:filas, :columnas] = self._acumulado
+        conteo[:filas, :columnas] = self._conteo
+        self._acumulado, self._conteo = acumulado, conteo
+
+    def agregar(self, df):
+        """Acumula un lote (DataFrame con las columnas de índice, columnas y valores)."""
+        if df is None or len(df) == 0:
+            return
+        fila, self._filas = self._codificar(df[self.indice], self._filas)
+        columna, self._columnas = self._codificar(df[self.columnas], self._columnas)
+        valores = df[self.valores].to_numpy(dtype=float, na_value=np.nan)
+        validas = (fila >= 0) & (columna >= 0) & ~np.isnan(valores)
+        fila, columna, valores = fila[validas], columna[validas], valores[validas]
+        self._asegurar_capacidad()
+
+        if self.agregacion == "first":
+            # Primera aparición de cada celda en el lote, y solo si la celda aún no tenía valor
+            celda = fila * self._acumulado.shape[1] + columna
+            _, primeras = np.unique(celda, return_index=True)
+            fila, columna, valores = fila[primeras], columna[primeras], valores[primeras]
+            nuevas = self._conteo[fila, columna] == 0
+            self._acumulado[fila[nuevas], columna[nuevas]] = valores[nuevas]
+        elif self.agregacion == "min":
+            np.minimum.at(self._acumulado, (fila, columna), valores)
+        elif self.agregacion == "max":
+            np.maximum.at(self._acumulado, (fila, columna), valores)
+        elif self.agregacion in ("sum", "mean"):
+            np.add.at(self._acumulado, (fila, columna), valores)
+        np.add.at(self._conteo, (fila, columna), 1)
+
+    def a_dataframe(self):
+        """
+        Retorna la tabla ancha con el mismo formato que transformar_datos: filas y columnas
+        ordenadas, el índice como primera columna y NaN en las celdas sin datos.
+        """
+        filas = self._filas.rename(self.indice)
+        columnas = self._columnas.rename(self.columnas)
+        conteo = self._conteo[:len(filas), :len(columnas)]
+        if self.agregacion == "count":
+            matriz = conteo.astype(float)
+        elif self.agregacion == "mean":
+            with np.errstate(invalid="ignore", divide="ignore"):
+                matriz = self._acumulado[:len(filas), :len(columnas)] / conteo
+        else:
+            matriz = self._acumulado[:len(filas), :len(columnas)].copy()
+        matriz[conteo == 0] = np.nan
+
+        orden_filas = np.argsort(filas.to_numpy(), kind="stable")
+        orden_columnas = np.argsort(columnas.to_numpy(), kind="stable")
+        matriz = matriz[np.ix_(orden_filas, orden_columnas)]
+        return pd.DataFrame(matriz, index=filas[orden_filas], columns=columnas[orden_columnas]).reset_index()
+
+def pivot_snapshot(config, import_id, indice="Referencia", columnas="dimID_Tienda", valores="Existencia_Total",
+                   agregacion="sum"):
+    """
+    Ejecuta el pivot con PIVOT de DuckDB sobre el snapshot de una importación
+    (ver connect.importacion.crear_snapshot_importacion), sin traer las filas a pandas.
+
+    Retorna:
+      DataFrame: Una fila por valor de 'indice' y una columna por valor de 'columnas'.
+    """
+    from connect.conexion_duckdb import obtener_cursor
+    consulta = obtener_consulta_pivot(nombre_tabla_snapshot(import_id), indice, columnas, valores, agregacion)
+    return obtener_cursor(config).execute(consulta).fetchdf()
+
+def pivot_parquet(parquet_file, indice="Referencia", columnas="dimID_Tienda", valores="Existencia_Total",
+                  agregacion="sum", config=None):
+    """
+    Ejecuta el pivot con PIVOT de DuckDB directamente sobre un archivo Parquet (por ejemplo,
+    el generado por exportar_a_parquet) o sobre el directorio de un dataset particionado.
+    Por defecto usa una base DuckDB en memoria.
+    """
+    from connect.conexion_duckdb import obtener_cursor
+    consulta = obtener_consulta_pivot(origen_dataset(parquet_file), indice, columnas, valores, agregacion)
+    return obtener_cursor(config or {"database": ":memory:"}).execute(consulta).fetchdf()
+
+def transformar_datos(df, indice="Referencia", columnas="dimID_Tienda", valores="Existencia_Total", agregacion="sum"):
     """
     Transforma el DataFrame realizando un pivot.
 
-    Se asume que el DataFrame contiene, al menos, las siguientes columnas:
+    Por defecto usa las columnas de la consulta de importación:
       - Referencia: identificador o nombre del producto.
-      - NombreTienda: nombre de la tienda (se convertirá en columnas).
-      - Existencia: valor correspondiente que se asignará a cada celda pivotada.
-    
+      - dimID_Tienda: identificador de la tienda (se convertirá en columnas).
+      - Existencia_Total: valor correspondiente que se asignará a cada celda pivotada.
+
+    También acepta un AlmacenResultados o un iterable de lotes (DataFrames, o tuplas
+    (offset, DataFrame) como las de importar_datos_generator); en esos casos el pivot se
+    acumula bloque a bloque con AcumuladorPivot. Las filas repetidas para la misma
+    referencia y tienda se combinan con 'agregacion' (por defecto, suma).
+
     Retorna un DataFrame transformado donde cada tienda es una columna.
     """
-    try:
-        # Realiza el pivot: cada 'NombreTienda' se convierte en columna,
-        # y se asigna el valor de 'Existencia' correspondiente para cada 'Referencia'
-        pivot_df = df.pivot(index='Referencia', columns='NombreTienda', values='Existencia')
-        # Reinicia el índice para que 'Referencia' pase a ser una columna normal
-        pivot_df = pivot_df.reset_index()
-    except Exception as e:
-        print("Error al transformar los datos:", e)
-        # En caso de error, retorna el DataFrame original
-        pivot_df = df
-    return pivot_df
+    if isinstance(df, pd.DataFrame):
+        return pivot_disperso(df, indice, columnas, valores, agregacion).a_dataframe()
+
+    acumulador = AcumuladorPivot(indice, columnas, valores, agregacion)
+    lotes = df.iterar_bloques(columnas=[indice, columnas, valores]) if isinstance(df, AlmacenResultados) else df
+    for lote in lotes:
+        acumulador.agregar(lote[1] if isinstance(lote, tuple) else lote)
+    return acumulador.a_dataframe()
 
 if __name__ == "__main__":
-    # Ejemplo de uso:
+    import sys
+
+    # Ejemplo de uso (la última fila repite la referencia 'A' en la tienda 2):
     data = {
-        'Referencia': ['A', 'B', 'A', 'B'],
-        'NombreTienda': ['Tienda1', 'Tienda1', 'Tienda2', 'Tienda2'],
-        'Existencia': [10, 20, 30, 40]
+        'Referencia': ['A', 'B', 'A', 'B', 'A'],
+        'dimID_Tienda': [1, 1, 2, 2, 2],
+        'Existencia_Total': [10, 20, 30, 40, 5]
     }
     df = pd.DataFrame(data)
     print("DataFrame original:")
     print(df, "\n")
-    
+
     df_transformado = transformar_datos(df)
     print("DataFrame transformado (pivot):")
     print(df_transformado)
+
+    # Con una base DuckDB (python -m query.pivoting BASE.duckdb), los lotes de la importación
+    # se pivotan con las columnas por defecto y se comparan con el PIVOT sobre su snapshot.
+    if len(sys.argv) > 1:
+        from connect.importacion import (
+            importar_datos_generator, crear_snapshot_importacion, eliminar_snapshot_importacion
+        )
+        config = {'database': sys.argv[1]}
+        acumulado = transformar_datos(importar_datos_generator(config, total_rows=10**9, batch_size=10000))
+        acumulado = acumulado.set_index("Referencia")
+        import_id = crear_snapshot_importacion(config)
+        try:
+            esperado = pivot_snapshot(config, import_id).set_index("Referencia")
+        finally:
+            eliminar_snapshot_importacion(config, import_id)
+        # PIVOT nombra las columnas con el texto de cada tienda
+        esperado.columns = pd.to_numeric(esperado.columns)
+        acumulado.columns = pd.to_numeric(acumulado.columns)
+        esperado = esperado.reindex(index=acumulado.index, columns=acumulado.columns)
+        coincide = np.allclose(acumulado.to_numpy(float), esperado.to_numpy(float), equal_nan=True)
+        print(f"Pivot de la importación: {acumulado.shape}, coincide con el snapshot: {coincide}")
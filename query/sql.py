@@ -1,6 +1,25 @@
 # query/sql.py
+import os
+import re
+from functools import lru_cache
+import pandas as pd
 
-QUERY_IMPORTACION = """
+# Columnas que identifican de forma única cada fila de la importación y definen su orden:
+# todas las columnas del GROUP BY, ya que una misma Referencia y CodigoMarca puede repetirse
+# en tbDimInventario con otro Nombre, Fabricante o categoría. Se usan como clave en la
+# paginación por keyset (seek); los NULL se ordenan antes que cualquier valor (ver _orden_clave).
+COLUMNAS_CLAVE = (
+    "Referencia", "CodigoMarca", "Region", "dimID_Tienda",
+    "NombreMarca", "Nombre", "Fabricante", "NombreSubLinea", "NombreCategoria",
+)
+
+# Dimensión dimID_Tienda -> Region, cargada desde config/regiones_tienda.csv (ver connect/regiones.py).
+TABLA_REGIONES = "tbDimRegionTienda"
+
+# Plantilla de la consulta de importación. Los marcadores {filtro_cte} y {filtro_principal}
+# permiten acotar el recorrido de las tablas de inventario (por ejemplo, en la paginación
+# por keyset) sin duplicar el texto de la consulta.
+PLANTILLA_IMPORTACION = """
 WITH ReferenciasSinExistenciaTotal AS (
     -- Identifica referencias donde la suma de existencias en todas las tiendas es 0
     SELECT 
@@ -10,6 +29,7 @@ WITH ReferenciasSinExistenciaTotal AS (
         tbDimInventario
     LEFT JOIN 
         tbHecInventario ON tbDimInventario.dimID_Inventario = tbHecInventario.dimid_inventario
+    {filtro_cte}
     GROUP BY 
         tbDimInventario.Referencia, 
         tbDimInventario.CodigoMarca
@@ -24,24 +44,8 @@ SELECT
     tbDimInventario.Fabricante,
     tbDimCategorias.NombreSubLinea,
     tbDimInventario.NombreCategoria,
-    CASE 
-        WHEN tbDimTiendas.dimID_Tienda IN (2003) THEN 'Valencia Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (2005) THEN 'Oriente - Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (
-             1, 1002, 1004, 1006, 1009, 1010, 1011, 1012, 
-             1013, 1014, 1017, 1018, 1019, 1020, 1021, 1022, 
-             1023, 1024
-        ) THEN 'Oriente - Sucursales'
-        WHEN tbDimTiendas.dimID_Tienda IN (2004) THEN 'Occidente - Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (
-             1026, 1027, 1028, 1029, 1030, 1031, 1037, 1038, 1039, 1040, 
-             1041, 1042, 1043, 1044, 1045, 1046, 1047, 1048, 1050, 1052, 
-             1053, 1055, 2007
-        ) THEN 'Occidente - Sucursales'
-        WHEN tbDimTiendas.dimID_Tienda IN (2006) THEN 'Margarita - Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (1032, 1033, 1034, 1035, 1036) THEN 'Margarita - Sucursales'
-        ELSE 'Sin region'
-    END AS Region,
+    tbDimTiendas.dimID_Tienda,
+    COALESCE(tbDimRegionTienda.Region, 'Sin region') AS Region,
     SUM(tbHecInventario.Existencia) AS Existencia_Total
 FROM 
     tbDimInventario
@@ -49,6 +53,8 @@ LEFT JOIN
     tbHecInventario ON tbDimInventario.dimID_Inventario = tbHecInventario.dimid_inventario
 LEFT JOIN 
     tbDimTiendas ON tbHecInventario.dimid_tienda = tbDimTiendas.dimID_Tienda
+LEFT JOIN
+    tbDimRegionTienda ON tbDimTiendas.dimID_Tienda = tbDimRegionTienda.dimID_Tienda
 LEFT JOIN
     tbDimCategorias ON tbDimInventario.dimID_Categoria = tbDimCategorias.dimID_Categoria
 WHERE 
@@ -58,6 +64,7 @@ WHERE
         WHERE R.Referencia = tbDimInventario.Referencia 
           AND R.CodigoMarca = tbDimInventario.CodigoMarca
     )
+    {filtro_principal}
 GROUP BY 
     tbDimInventario.Referencia,
     tbDimInventario.NombreMarca,
@@ -67,34 +74,480 @@ GROUP BY
     tbDimCategorias.NombreSubLinea,
     tbDimInventario.NombreCategoria,
     tbDimTiendas.dimID_Tienda,
-    CASE 
-        WHEN tbDimTiendas.dimID_Tienda IN (2003) THEN 'Valencia Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (2005) THEN 'Oriente - Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (
-             1, 1002, 1004, 1006, 1009, 1010, 1011, 1012, 
-             1013, 1014, 1017, 1018, 1019, 1020, 1021, 1022, 
-             1023, 1024
-        ) THEN 'Oriente - Sucursales'
-        WHEN tbDimTiendas.dimID_Tienda IN (2004) THEN 'Occidente - Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (
-             1026, 1027, 1028, 1029, 1030, 1031, 1037, 1038, 1039, 1040, 
-             1041, 1042, 1043, 1044, 1045, 1046, 1047, 1048, 1050, 1052, 
-             1053, 1055, 2007
-        ) THEN 'Occidente - Sucursales'
-        WHEN tbDimTiendas.dimID_Tienda IN (2006) THEN 'Margarita - Casa Matriz'
-        WHEN tbDimTiendas.dimID_Tienda IN (1032, 1033, 1034, 1035, 1036) THEN 'Margarita - Sucursales'
-        ELSE 'Sin region'
-    END
+    tbDimRegionTienda.Region
 HAVING 
     (tbDimTiendas.dimID_Tienda <> 2003 OR SUM(tbHecInventario.Existencia) > 0)
-ORDER BY 
-    tbDimInventario.Referencia;
 """
 
-def obtener_consulta_importacion(offset=0, limit=10000):
-    # Usa directamente la consulta por defecto
-    consulta_base = QUERY_IMPORTACION.strip().rstrip(';')
-    consulta = f"{consulta_base} LIMIT {limit} OFFSET {offset};"
+# Variante de una sola pasada: en lugar de agregar tbHecInventario una segunda vez en una CTE
+# para el anti-join, el total por referencia se calcula con una función de ventana sobre los
+# mismos grupos (SUM(SUM(...)) OVER (PARTITION BY Referencia, CodigoMarca)). Es equivalente a
+# PLANTILLA_IMPORTACION siempre que las dimensiones unidas tengan clave única, ya que entonces
+# los grupos por tienda suman exactamente lo mismo que la CTE. Los filtros de esta variante
+# deben conservar referencias completas, por eso solo usa {filtro_cte}.
+PLANTILLA_IMPORTACION_UNA_PASADA = """
+SELECT 
+    Referencia,
+    NombreMarca,
+    CodigoMarca,
+    Nombre,
+    Fabricante,
+    NombreSubLinea,
+    NombreCategoria,
+    dimID_Tienda,
+    Region,
+    Existencia_Total
+FROM (
+    SELECT 
+        tbDimInventario.Referencia,
+        tbDimInventario.NombreMarca,
+        tbDimInventario.CodigoMarca,
+        tbDimInventario.Nombre,
+        tbDimInventario.Fabricante,
+        tbDimCategorias.NombreSubLinea,
+        tbDimInventario.NombreCategoria,
+        tbDimTiendas.dimID_Tienda,
+        COALESCE(tbDimRegionTienda.Region, 'Sin region') AS Region,
+        SUM(tbHecInventario.Existencia) AS Existencia_Total,
+        -- Total de la referencia en todas las tiendas, calculado en la misma pasada
+        SUM(SUM(tbHecInventario.Existencia)) OVER (
+            PARTITION BY tbDimInventario.Referencia, tbDimInventario.CodigoMarca
+        ) AS Existencia_Referencia
+    FROM 
+        tbDimInventario
+    LEFT JOIN 
+        tbHecInventario ON tbDimInventario.dimID_Inventario = tbHecInventario.dimid_inventario
+    LEFT JOIN 
+        tbDimTiendas ON tbHecInventario.dimid_tienda = tbDimTiendas.dimID_Tienda
+    LEFT JOIN
+        tbDimRegionTienda ON tbDimTiendas.dimID_Tienda = tbDimRegionTienda.dimID_Tienda
+    LEFT JOIN
+        tbDimCategorias ON tbDimInventario.dimID_Categoria = tbDimCategorias.dimID_Categoria
+    {filtro_cte}
+    GROUP BY 
+        tbDimInventario.Referencia,
+        tbDimInventario.NombreMarca,
+        tbDimInventario.CodigoMarca,
+        tbDimInventario.Nombre,
+        tbDimInventario.Fabricante,
+        tbDimCategorias.NombreSubLinea,
+        tbDimInventario.NombreCategoria,
+        tbDimTiendas.dimID_Tienda,
+        tbDimRegionTienda.Region
+) AS grupos
+WHERE 
+    -- Excluye referencias cuya existencia total es 0 (un total NULL no se excluye)
+    (Existencia_Referencia <> 0 OR Existencia_Referencia IS NULL)
+    AND (dimID_Tienda <> 2003 OR Existencia_Total > 0)
+"""
+
+# Variantes disponibles de la consulta de importación. VARIANTE_IMPORTACION define la que se
+# usa cuando no se indica otra; ver query/benchmark_sql.py para comparar ambas.
+VARIANTES_IMPORTACION = {
+    "clasica": PLANTILLA_IMPORTACION,
+    "una_pasada": PLANTILLA_IMPORTACION_UNA_PASADA,
+}
+VARIANTE_IMPORTACION = "clasica"
+
+def obtener_plantilla_importacion(variante=None):
+    """Retorna la plantilla de la variante indicada (por defecto VARIANTE_IMPORTACION)."""
+    variante = variante or VARIANTE_IMPORTACION
+    try:
+        return VARIANTES_IMPORTACION[variante]
+    except KeyError:
+        raise ValueError(f"Variante de consulta no soportada: {variante}")
+
+def _orden_clave(dialecto="duckdb", separador=", "):
+    """
+    Retorna la lista ORDER BY de COLUMNAS_CLAVE con los NULL primero. SQL Server ya los
+    ordena así y no admite NULLS FIRST; en DuckDB (y SQLite) se indica explícitamente.
+    """
+    if dialecto == "mssql":
+        return separador.join(COLUMNAS_CLAVE)
+    return separador.join(f"{c} NULLS FIRST" for c in COLUMNAS_CLAVE)
+
+def _limitar(consulta, limit, offset=None, dialecto="duckdb"):
+    """
+    Agrega la paginación a una consulta que ya termina en ORDER BY: LIMIT/OFFSET, o
+    OFFSET ... ROWS FETCH NEXT ... ROWS ONLY en SQL Server, que no admite LIMIT.
+    """
+    if dialecto == "mssql":
+        return f"{consulta}\nOFFSET {int(offset or 0)} ROWS FETCH NEXT {int(limit)} ROWS ONLY;"
+    consulta = f"{consulta}\nLIMIT {int(limit)}"
+    return f"{consulta} OFFSET {int(offset)};" if offset is not None else f"{consulta};"
+
+def obtener_consulta_importacion_completa(variante=None, dialecto="duckdb"):
+    """Retorna la consulta de importación completa, sin filtros y ordenada por COLUMNAS_CLAVE."""
+    consulta_base = obtener_plantilla_importacion(variante).format(filtro_cte="", filtro_principal="").rstrip()
+    orden = _orden_clave(dialecto, ",\n    ")
+    return f"{consulta_base}\nORDER BY \n    {orden};\n"
+
+# Tipos compactos de las columnas de QUERY_IMPORTACION (ver query/esquema.py). Las columnas
+# 'category' repiten unos pocos miles de valores en millones de filas. Los numéricos se fijan
+# para toda la importación, como enteros con nulos (las referencias sin hechos de inventario
+# no tienen tienda ni existencia): dimID_Tienda y tbHecInventario.Existencia son INTEGER,
+# por lo que Int32 los representa sin pérdida. Existencia_Total es una suma: un valor fuera
+# del rango de Int32, o con decimales, detiene la importación con ValueError en lugar de
+# truncarse.
+ESQUEMA_IMPORTACION = {
+    "NombreMarca": "category",
+    "CodigoMarca": "category",
+    "Fabricante": "category",
+    "NombreSubLinea": "category",
+    "NombreCategoria": "category",
+    "Region": "category",
+    "dimID_Tienda": "Int32",
+    "Existencia_Total": "Int32",
+}
+
+QUERY_IMPORTACION = obtener_consulta_importacion_completa("clasica")
+QUERY_IMPORTACION_UNA_PASADA = obtener_consulta_importacion_completa("una_pasada")
+
+def obtener_consulta_importacion(offset=0, limit=10000, variante=None, dialecto="duckdb"):
+    # Usa la consulta de la variante por defecto
+    consulta_base = obtener_consulta_importacion_completa(variante, dialecto).strip().rstrip(';')
+    return _limitar(consulta_base, limit, offset, dialecto)
+
+def _predicado_posterior_a(columnas, valores):
+    """
+    Construye la condición "fila posterior a la clave" de forma expandida
+    (a > ? OR (a = ? AND b > ?) OR ...), ya que SQL Server no admite la
+    comparación de tuplas que sí soporta DuckDB.
+
+    Los NULL se ordenan primero (ver _orden_clave) y no se comparan con '=' ni '>':
+    una columna en NULL en la clave se iguala con IS NULL y cualquier valor no nulo
+    es posterior a ella (IS NOT NULL); una columna en NULL en la fila nunca es
+    posterior a un valor de la clave.
+
+    Retorna:
+      tuple: (condición SQL con marcadores '?', lista de parámetros)
+    """
+    condiciones = []
+    parametros = []
+    for i, columna in enumerate(columnas):
+        partes = []
+        for c, v in zip(columnas[:i], valores[:i]):
+            partes.append(f"{c} IS NULL" if v is None else f"{c} = ?")
+            if v is not None:
+                parametros.append(v)
+        if valores[i] is None:
+            partes.append(f"{columna} IS NOT NULL")
+        else:
+            partes.append(f"{columna} > ?")
+            parametros.append(valores[i])
+        condiciones.append("(" + " AND ".join(partes) + ")")
+    return " OR ".join(condiciones), parametros
+
+def _como_cte(consulta, nombre):
+    """
+    Reescribe la consulta para que su SELECT principal quede como una CTE más con el
+    nombre indicado: "WITH a AS (...) SELECT ..." pasa a "WITH a AS (...), nombre AS (SELECT ...)".
+    Así se puede filtrar y ordenar el resultado desde afuera sin anidar un WITH dentro de
+    una tabla derivada, que SQL Server no admite.
+    """
+    consulta = consulta.strip()
+    if not re.match(r"WITH\b", consulta, re.IGNORECASE):
+        return f"WITH {nombre} AS (\n{consulta}\n)"
+    # Recorre las CTE existentes (nombre AS (...), ...) hasta el SELECT principal
+    posicion = 4
+    while True:
+        apertura = consulta.index("(", posicion)
+        nivel = 0
+        for i in range(apertura, len(consulta)):
+            if consulta[i] == "(":
+                nivel += 1
+            elif consulta[i] == ")":
+                nivel -= 1
+                if nivel == 0:
+                    break
+        posicion = i + 1
+        resto = consulta[posicion:].lstrip()
+        if not resto.startswith(","):
+            break
+        posicion = consulta.index(",", posicion) + 1
+    return f"{consulta[:posicion]},\n{nombre} AS (\n{consulta[posicion:].strip()}\n)"
+
+def obtener_consulta_importacion_keyset(ultima_clave=None, limit=10000, variante=None, dialecto="duckdb"):
+    """
+    Genera la consulta de importación paginada por keyset (seek) en lugar de OFFSET.
+
+    En vez de descartar 'offset' filas, cada página continúa a partir de la última
+    clave (COLUMNAS_CLAVE) del bloque anterior. Además, la condición 'Referencia >= ?'
+    se inyecta en la CTE y en la consulta principal para que el motor descarte antes de
+    agregar las filas de las referencias ya leídas.
+
+    Limitación: la agregación no tiene cota superior, por lo que cada página agrega
+    todos los grupos a partir de la clave y solo después se queda con las primeras
+    'limit' filas. El costo de una página baja a medida que avanza la importación, pero
+    no es constante: la primera cuesta lo mismo que la consulta completa. Para recorrer
+    toda la importación con una sola agregación conviene la paginación 'snapshot' o 'flujo'.
+
+    Parámetros:
+      ultima_clave (tuple): Valores de COLUMNAS_CLAVE de la última fila recibida,
+                            o None para la primera página.
+      limit (int): Número de filas a retornar.
+      variante (str): Variante de la consulta (por defecto VARIANTE_IMPORTACION).
+      dialecto (str): 'mssql' genera OFFSET/FETCH en lugar de LIMIT; cualquier otro
+                      valor (DuckDB, SQLite) usa LIMIT.
+
+    Retorna:
+      tuple: (consulta SQL con marcadores '?', lista de parámetros)
+    """
+    if ultima_clave is None:
+        consulta_base = obtener_consulta_importacion_completa(variante, dialecto).strip().rstrip(';')
+        return _limitar(consulta_base, limit, dialecto=dialecto), []
+
+    if len(ultima_clave) != len(COLUMNAS_CLAVE):
+        raise ValueError(f"La clave debe tener {len(COLUMNAS_CLAVE)} valores: {COLUMNAS_CLAVE}")
+
+    referencia = ultima_clave[0]
+    plantilla = obtener_plantilla_importacion(variante)
+    if referencia is None:
+        # Las referencias en NULL van primero: todavía no se puede descartar ninguna
+        consulta_base = plantilla.format(filtro_cte="", filtro_principal="").rstrip()
+        parametros_filtro = []
+    else:
+        consulta_base = plantilla.format(
+            filtro_cte="WHERE tbDimInventario.Referencia >= ?",
+            filtro_principal="AND tbDimInventario.Referencia >= ?",
+        ).rstrip()
+        # Un parámetro por cada marcador presente en la plantilla
+        parametros_filtro = [referencia] * sum(m in plantilla for m in ("{filtro_cte}", "{filtro_principal}"))
+    predicado, parametros = _predicado_posterior_a(COLUMNAS_CLAVE, list(ultima_clave))
+    consulta = (
+        f"{_como_cte(consulta_base, 'importacion')}\n"
+        f"SELECT * FROM importacion\n"
+        f"WHERE {predicado}\n"
+        f"ORDER BY {_orden_clave(dialecto)}"
+    )
+    return _limitar(consulta, limit, dialecto=dialecto), parametros_filtro + parametros
+
+def obtener_ultima_clave(df):
+    """
+    Retorna la clave (COLUMNAS_CLAVE) de la última fila del DataFrame, lista para
+    pasarse a obtener_consulta_importacion_keyset, o None si el DataFrame está vacío.
+    """
+    if df is None or df.empty:
+        return None
+    fila = df[list(COLUMNAS_CLAVE)].iloc[-1].tolist()
+    # Los escalares de NumPy se convierten a tipos nativos para que los drivers los acepten,
+    # y los nulos (NaN, NA) a None para que la consulta los compare con IS NULL.
+    return tuple(None if pd.isna(v) else v.item() if hasattr(v, "item") else v for v in fila)
+
+# Registro de snapshots de importación materializados en DuckDB.
+TABLA_REGISTRO_SNAPSHOTS = "importacion_snapshots"
+
+def nombre_tabla_snapshot(import_id):
+    """
+    Retorna el nombre de la tabla DuckDB que almacena el snapshot de una importación.
+    El identificador solo puede contener letras, dígitos y '_' porque forma parte del nombre.
+    """
+    if not re.fullmatch(r"\w+", str(import_id)):
+        raise ValueError(f"Identificador de importación no válido: {import_id!r}")
+    return f"importacion_snapshot_{import_id}"
+
+def obtener_consulta_snapshot(import_id, variante=None):
+    """
+    Genera la sentencia que ejecuta QUERY_IMPORTACION una sola vez y materializa el
+    resultado en una tabla propia de la importación. Cada fila recibe un número
+    correlativo ('fila_snapshot') en el orden de COLUMNAS_CLAVE para paginar
+    el snapshot por rango en lugar de OFFSET.
+    """
+    tabla = nombre_tabla_snapshot(import_id)
+    consulta_base = obtener_plantilla_importacion(variante).format(filtro_cte="", filtro_principal="").rstrip()
+    orden = _orden_clave()
+    return (
+        f"CREATE OR REPLACE TABLE {tabla} AS\n"
+        f"SELECT ROW_NUMBER() OVER (ORDER BY {orden}) AS fila_snapshot, *\n"
+        f"FROM ({consulta_base}\n) AS importacion\n"
+        f"ORDER BY fila_snapshot;"
+    )
+
+def obtener_consulta_pagina_snapshot(import_id, offset=0, limit=10000):
+    """
+    Genera la consulta que lee una página del snapshot de una importación.
+
+    Retorna:
+      tuple: (consulta SQL con marcadores '?', lista de parámetros)
+    """
+    tabla = nombre_tabla_snapshot(import_id)
+    consulta = (
+        f"SELECT * EXCLUDE (fila_snapshot) FROM {tabla} "
+        f"WHERE fila_snapshot > ? AND fila_snapshot <= ? "
+        f"ORDER BY fila_snapshot;"
+    )
+    return consulta, [offset, offset + limit]
+
+# Registro de marcas de agua por importación para el refresco incremental.
+TABLA_REGISTRO_WATERMARKS = "importacion_watermarks"
+
+def _validar_identificador(nombre):
+    """Valida un nombre de columna que se interpola en la consulta."""
+    if not re.fullmatch(r"[A-Za-z_]\w*", str(nombre)):
+        raise ValueError(f"Identificador SQL no válido: {nombre!r}")
+    return nombre
+
+def obtener_consulta_watermark(columna):
+    """
+    Genera la consulta que lee la marca de agua actual de tbHecInventario: su valor
+    máximo como texto y su tipo, para poder compararla luego con CAST(? AS tipo).
+    """
+    columna = _validar_identificador(columna)
+    return (
+        f"SELECT CAST(MAX(tbHecInventario.{columna}) AS VARCHAR), "
+        f"typeof(MAX(tbHecInventario.{columna})) FROM tbHecInventario;"
+    )
+
+def obtener_consulta_claves_modificadas(columna, tipo=None):
+    """
+    Genera la consulta con las claves (Referencia, CodigoMarca) que tienen hechos
+    de inventario posteriores a la marca de agua indicada como parámetro. Con
+    tipo=None (marca de agua vacía) se consideran todos los hechos con valor en la columna.
+    """
+    columna = _validar_identificador(columna)
+    if tipo is None:
+        condicion = f"tbHecInventario.{columna} IS NOT NULL"
+    elif re.fullmatch(r"[A-Za-z0-9_ (),]+", str(tipo)):
+        condicion = f"tbHecInventario.{columna} > CAST(? AS {tipo})"
+    else:
+        raise ValueError(f"Tipo SQL no válido: {tipo!r}")
+    return (
+        "SELECT DISTINCT tbDimInventario.Referencia, tbDimInventario.CodigoMarca\n"
+        "FROM tbHecInventario\n"
+        "JOIN tbDimInventario ON tbDimInventario.dimID_Inventario = tbHecInventario.dimid_inventario\n"
+        f"WHERE {condicion}"
+    )
+
+def obtener_consulta_importacion_claves(tabla_claves, variante=None):
+    """
+    Genera QUERY_IMPORTACION restringida a las claves (Referencia, CodigoMarca) presentes
+    en 'tabla_claves'. La restricción se aplica también a la CTE, lo que es equivalente
+    porque el total por referencia solo depende de las filas de esa misma clave.
+    """
+    tabla_claves = _validar_identificador(tabla_claves)
+    existe = (
+        f"EXISTS (SELECT 1 FROM {tabla_claves} K "
+        "WHERE K.Referencia = tbDimInventario.Referencia AND K.CodigoMarca = tbDimInventario.CodigoMarca)"
+    )
+    return obtener_plantilla_importacion(variante).format(
+        filtro_cte=f"WHERE {existe}",
+        filtro_principal=f"AND {existe}",
+    ).rstrip()
+
+def obtener_consulta_fusion_snapshot(import_id, tabla_claves, variante=None):
+    """
+    Genera las sentencias que reemplazan en el snapshot las filas de las claves de
+    'tabla_claves' por su agregación actual y renumeran 'fila_snapshot' en el orden
+    de COLUMNAS_CLAVE.
+
+    Retorna:
+      list: Sentencias SQL a ejecutar en orden dentro de una transacción.
+    """
+    tabla = nombre_tabla_snapshot(import_id)
+    tabla_claves = _validar_identificador(tabla_claves)
+    orden = _orden_clave()
+    return [
+        f"DELETE FROM {tabla} WHERE (Referencia, CodigoMarca) IN "
+        f"(SELECT Referencia, CodigoMarca FROM {tabla_claves});",
+        f"INSERT INTO {tabla} BY NAME SELECT * FROM ({obtener_consulta_importacion_claves(tabla_claves, variante)}\n) AS importacion;",
+        f"CREATE OR REPLACE TABLE {tabla} AS "
+        f"SELECT ROW_NUMBER() OVER (ORDER BY {orden}) AS fila_snapshot, * EXCLUDE (fila_snapshot) "
+        f"FROM {tabla} ORDER BY fila_snapshot;",
+    ]
+
+# Agregaciones admitidas en el pivot para resolver claves (índice, columna) repetidas.
+AGREGACIONES_PIVOT = {
+    "sum": "SUM",
+    "min": "MIN",
+    "max": "MAX",
+    "mean": "AVG",
+    "count": "COUNT",
+    "first": "FIRST",
+}
+
+def origen_parquet(ruta):
+    """Retorna la expresión FROM que lee un archivo Parquet (o un patrón glob) con DuckDB."""
+    return "read_parquet('{}')".format(str(ruta).replace("'", "''"))
+
+def obtener_consulta_ordenada(origen, columnas):
+    """
+    Genera la consulta que lee todo 'origen' ordenado por 'columnas', con los NULL primero
+    (ver _orden_clave). DuckDB ordena fuera de memoria si el resultado no cabe en ella.
+    """
+    orden = ", ".join(f"{_validar_identificador(c)} NULLS FIRST" for c in columnas)
+    return f"SELECT * FROM {origen} ORDER BY {orden}"
+
+def origen_dataset(ruta):
+    """
+    Retorna la expresión FROM para un archivo Parquet o, si 'ruta' es un directorio, para
+    un dataset particionado al estilo Hive (columna=valor/...). En este caso DuckDB agrega
+    las columnas de partición y descarta los directorios que no cumplen los filtros sobre ellas.
+    """
+    if os.path.isdir(ruta):
+        patron = os.path.join(str(ruta), "**", "*.parquet").replace("'", "''")
+        return f"read_parquet('{patron}', hive_partitioning = true)"
+    return origen_parquet(ruta)
+
+def obtener_consulta_pivot(origen, indice="Referencia", columnas="dimID_Tienda", valores="Existencia_Total",
+                           agregacion="sum"):
+    """
+    Genera un PIVOT de DuckDB: una fila por valor de 'indice', una columna por valor
+    distinto de 'columnas' y en cada celda la agregación de 'valores'.
+
+    Parámetros:
+      origen (str): Nombre de tabla (por ejemplo, el snapshot de una importación) o una
+                    expresión FROM como la que retorna origen_parquet.
+      agregacion (str): Una de AGREGACIONES_PIVOT; se aplica cuando hay filas repetidas
+                        para el mismo índice y columna.
+    """
+    if agregacion not in AGREGACIONES_PIVOT:
+        raise ValueError(f"Agregación no soportada: {agregacion!r}")
+    if not origen.startswith("read_parquet("):
+        origen = _validar_identificador(origen)
+    indice = _validar_identificador(indice)
+    columnas = _validar_identificador(columnas)
+    valores = _validar_identificador(valores)
+    return (
+        f"PIVOT (SELECT {indice}, {columnas}, {valores} FROM {origen}) "
+        f"ON {columnas} USING {AGREGACIONES_PIVOT[agregacion]}({valores}) "
+        f"GROUP BY {indice} ORDER BY {indice}"
+    )
+
+# Filtros de la consulta de inventario sobre datos exportados: nombre del filtro -> condición
+# con un único parámetro. El filtro 'nombre' busca el texto en cualquier parte de Nombre.
+FILTROS_INVENTARIO = {
+    "existencia_minima": "Existencia_Total >= ?",
+    "marca": "CodigoMarca = ?",
+    "region": "Region = ?",
+    "categoria": "NombreCategoria = ?",
+    "nombre": "contains(lower(Nombre), lower(?))",
+}
+
+@lru_cache(maxsize=256)
+def obtener_consulta_inventario(origen, filtros=(), columnas=None, con_limite=False):
+    """
+    Genera la consulta de inventario sobre un origen Parquet con los filtros indicados.
+    Los valores no se interpolan: cada filtro agrega un parámetro '?', en el orden de
+    'filtros', y con_limite=True agrega un último parámetro para LIMIT. El texto depende
+    solo de qué filtros están activos, por lo que se genera una vez por combinación.
+
+    Parámetros:
+      origen (str): Expresión FROM como la que retorna origen_dataset.
+      filtros (tuple): Nombres de FILTROS_INVENTARIO activos.
+      columnas (tuple): Columnas a retornar (por defecto todas).
+    """
+    if not origen.startswith("read_parquet("):
+        origen = _validar_identificador(origen)
+    desconocidos = [f for f in filtros if f not in FILTROS_INVENTARIO]
+    if desconocidos:
+        raise ValueError(f"Filtros no soportados: {desconocidos}")
+    seleccion = ", ".join(_validar_identificador(c) for c in columnas) if columnas else "*"
+    consulta = f"SELECT {seleccion} FROM {origen}"
+    if filtros:
+        consulta += " WHERE " + " AND ".join(FILTROS_INVENTARIO[f] for f in filtros)
+    consulta += f" ORDER BY {_orden_clave()}"
+    if con_limite:
+        consulta += " LIMIT ?"
     return consulta
 
 if __name__ == "__main__":
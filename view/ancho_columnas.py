@@ -0,0 +1,72 @@
+# ancho_columnas.py
+from PyQt5.QtCore import QObject, Qt
+import numpy as np
+
+class AjustadorColumnas(QObject):
+    """
+    Ajusta el ancho de las columnas de un QTableView a medida que el modelo recibe filas.
+
+    A diferencia de resizeColumnsToContents(), que mide el texto de todas las filas en
+    cada llamada, solo se mide una muestra acotada de las filas nuevas de cada columna
+    (más el encabezado), usando el texto que el modelo ya tiene formateado en caché. De
+    la muestra se miden con QFontMetrics únicamente los textos más largos, y una columna
+    solo se ensancha: nunca se angosta al llegar un bloque nuevo.
+    """
+    def __init__(self, table_view, model, muestra=200, candidatos=8, margen=16, ancho_maximo=400, parent=None):
+        super().__init__(parent or table_view)
+        self.table_view = table_view
+        self.model = model
+        self.muestra = muestra
+        self.candidatos = candidatos
+        self.margen = margen
+        self.ancho_maximo = ancho_maximo
+        self._anchos = {}  # columna -> ancho aplicado
+
+        model.rowsInserted.connect(self._filas_insertadas)
+        model.modelReset.connect(self.reiniciar)
+        model.dataChanged.connect(self._datos_cambiados)
+
+    def _filas_muestra(self, inicio, fin):
+        """Hasta 'muestra' filas repartidas uniformemente entre inicio y fin (inclusive)."""
+        cantidad = fin - inicio + 1
+        if cantidad <= 0:
+            return []
+        if cantidad <= self.muestra:
+            return range(inicio, fin + 1)
+        return np.unique(np.linspace(inicio, fin, self.muestra).astype(int)).tolist()
+
+    def _ancho_columna(self, col, filas):
+        """Ancho necesario para el encabezado y los textos más largos de las filas de muestra."""
+        metricas = self.table_view.fontMetrics()
+        textos = [self.model.data(self.model.index(fila, col), Qt.DisplayRole) or "" for fila in filas]
+        textos = sorted(set(textos), key=len, reverse=True)[:self.candidatos]
+        ancho = max((metricas.horizontalAdvance(t) for t in textos), default=0)
+
+        encabezado = self.model.headerData(col, Qt.Horizontal, Qt.DisplayRole) or ""
+        ancho_encabezado = self.table_view.horizontalHeader().fontMetrics().horizontalAdvance(str(encabezado))
+        return min(max(ancho, ancho_encabezado) + self.margen, self.ancho_maximo)
+
+    def ajustar(self, inicio, fin, columnas=None):
+        """Ensancha las columnas indicadas (por defecto todas) según las filas [inicio, fin]."""
+        filas = self._filas_muestra(inicio, fin)
+        if columnas is None:
+            columnas = range(self.model.columnCount())
+        for col in columnas:
+            ancho = self._ancho_columna(col, filas)
+            if ancho > self._anchos.get(col, 0):
+                self._anchos[col] = ancho
+                self.table_view.setColumnWidth(col, ancho)
+
+    def reiniciar(self):
+        """Olvida los anchos aplicados y mide de nuevo sobre las filas actuales del modelo."""
+        self._anchos = {}
+        if self.model.rowCount() or self.model.columnCount():
+            self.ajustar(0, self.model.rowCount() - 1)
+
+    def _filas_insertadas(self, parent, inicio, fin):
+        self.ajustar(inicio, fin)
+
+    def _datos_cambiados(self, arriba_izquierda, abajo_derecha, roles=None):
+        # Un cambio de formato invalida el texto de toda la columna: se vuelve a medir
+        columnas = range(arriba_izquierda.column(), abajo_derecha.column() + 1)
+        self.ajustar(arriba_izquierda.row(), abajo_derecha.row(), columnas)
@@ -2,13 +2,16 @@ from PyQt5.QtWidgets import (
     QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
     QLabel, QTableView, QFrame, QProgressBar
 )
-from PyQt5.QtCore import pyqtSlot, Qt
+from PyQt5.QtCore import pyqtSlot, Qt, QThread
 from PyQt5.QtGui import QStandardItemModel, QStandardItem
-import pandas as pd
 import time
-from connect.importacion import importar_datos_generator
+from connect.importacion import obtener_datos_keyset
+from query.sql import COLUMNAS_CLAVE, obtener_ultima_clave
 from style.importacionStyle import get_style_sheet_importacion
+from view.ancho_columnas import AjustadorColumnas
 from model.pandas_model import PandasModel
+from model.workers import ImportWorker
+from config.logging_config import medir_etapa
 
 class ImportWindow(QMainWindow):
     """Ventana con scroll infinito para importar datos dinámicamente."""
@@ -21,8 +24,9 @@ class ImportWindow(QMainWindow):
         # Paginación y acumulación de bloques de datos
         self.offset = 0  
         self.limit = 10000  
-        self.data_blocks = []  # Lista para almacenar cada bloque de datos
-        self.pandas_model = PandasModel()  
+        self.total_rows = 50000  # Máximo de filas de la importación inicial
+        self.worker = None
+        self.pandas_model = PandasModel()  # Los bloques recibidos se acumulan en self.pandas_model.almacen
 
         # Widget central y layout principal
         self.central_widget = QWidget()
@@ -53,53 +57,89 @@ class ImportWindow(QMainWindow):
         # QTableView con scroll infinito; se mantiene la conexión al scroll
         self.table_view = QTableView()
         self.table_view.setModel(self.pandas_model)
+        # Los anchos de columna se estiman con una muestra de cada bloque que llega al modelo
+        self.ajustador_columnas = AjustadorColumnas(self.table_view, self.pandas_model)
         self.table_view.verticalScrollBar().valueChanged.connect(self.detectar_scroll)
         self.main_layout.addWidget(self.table_view)
 
     @pyqtSlot()
     def on_importar_datos(self):
-        """Carga los datos iniciales y acumula el primer bloque."""
+        """
+        Inicia la importación en un worker en segundo plano; los bloques se agregan
+        al modelo a medida que llegan.
+        """
         self.import_button.setEnabled(False)
         self.progress_bar.setVisible(True)
+        self.progress_bar.setMaximum(self.total_rows)
         self.progress_bar.setValue(0)
 
+        # Reiniciamos la paginación y el modelo
+        self.offset = 0
+        self.pandas_model.limpiar()
+        self.table_view.setModel(self.pandas_model)
+        self.inicio_importacion = time.time()
+
+        self.thread = QThread()
+        self.worker = ImportWorker(self.connection_config, total_rows=self.total_rows, batch_size=self.limit)
+        self.worker.moveToThread(self.thread)
+
+        self.thread.started.connect(self.worker.run)
+        self.worker.lote_recibido.connect(self.handle_lote_recibido)
+        self.worker.error.connect(lambda mensaje: self.mostrar_error(f"Error durante la importación: {mensaje}"))
+        self.worker.progreso.connect(lambda filas, total: self.progress_bar.setValue(min(filas, total)))
+        self.worker.finished.connect(self.thread.quit)
+        self.worker.finished.connect(self.worker.deleteLater)
+        self.thread.finished.connect(self.thread.deleteLater)
+        self.thread.finished.connect(self.on_importacion_terminada)
+
+        self.thread.start()
+
+    @pyqtSlot(int, object)
+    def handle_lote_recibido(self, offset, df):
+        """Agrega el bloque al modelo y confirma su recepción al worker."""
         try:
-            inicio = time.time()
-            df = importar_datos_generator(self.connection_config, total_rows=50000, batch_size=self.limit)
-            fin = time.time()
-            tiempo = fin - inicio
-
             if df is None or df.empty:
-                self.mostrar_error("No se encontraron datos.")
                 return
-
-            # Reiniciamos la paginación y acumulación
-            self.offset = self.limit  
-            self.data_blocks = [df]
-            # Actualizamos el modelo con el bloque inicial
-            self.pandas_model.actualizar_datos(df)
-            self.table_view.resizeColumnsToContents()
-            print(f"✅ Bloque importado: OFFSET 0 - {self.limit} filas ({tiempo:.2f} segundos)")
-
-        except Exception as e:
-            self.mostrar_error(f"Error durante la importación: {e}")
-
+            with medir_etapa("modelo", "importacion", self.connection_config):
+                self.pandas_model.agregar_bloque(df)
+            tiempo = time.time() - self.inicio_importacion
+            print(f"✅ Bloque importado: OFFSET {offset} - {len(df)} filas ({tiempo:.2f} segundos)")
+            self.offset = offset + len(df)
         finally:
-            self.import_button.setEnabled(True)
-            self.progress_bar.setVisible(False)
+            if self.worker is not None:
+                self.worker.confirmar_lote()
+
+    @pyqtSlot()
+    def on_importacion_terminada(self):
+        """Restablece los controles al terminar la importación."""
+        self.worker = None
+        self.thread = None
+        if len(self.pandas_model.almacen) == 0:
+            self.mostrar_error("No se encontraron datos.")
+        self.import_button.setEnabled(True)
+        self.progress_bar.setVisible(False)
 
     def detectar_scroll(self, value):
         """Detecta si se alcanzó el final del scroll para disparar la carga de más datos."""
+        if self.worker is not None:
+            return  # La importación en curso ya está entregando los bloques siguientes
         if value == self.table_view.verticalScrollBar().maximum():
             self.on_cargar_mas_datos()
 
     @pyqtSlot()
     def on_cargar_mas_datos(self):
-        """Carga más datos, acumula el bloque y actualiza el modelo sin reiniciarlo."""
+        """
+        Carga el bloque siguiente a la última fila mostrada (paginación por keyset) y lo
+        agrega al modelo sin reiniciarlo.
+        """
+        almacen = self.pandas_model.almacen
+        if len(almacen) == 0:
+            return
         self.progress_bar.setVisible(True)
         try:
             inicio = time.time()
-            df_more = importar_datos_generator(self.connection_config, total_rows=50000, batch_size=self.limit)
+            ultima_fila = almacen.tomar([len(almacen) - 1], COLUMNAS_CLAVE)
+            df_more = obtener_datos_keyset(self.connection_config, obtener_ultima_clave(ultima_fila), self.limit)
             fin = time.time()
             tiempo = fin - inicio
 
@@ -107,14 +147,11 @@ class ImportWindow(QMainWindow):
                 print("⚠️ No se encontraron datos en el siguiente bloque.")
                 return
 
-            # Acumulamos el nuevo bloque (opción: evitar concatenar cada vez, pero si deseas el total actualizado)
-            self.data_blocks.append(df_more)
-            self.df_data = pd.concat(self.data_blocks, ignore_index=True)
-            # Se actualiza el modelo con el nuevo bloque; se asume que 'actualizar_datos' agrega datos y emite señales de cambio
-            self.pandas_model.actualizar_datos(df_more)
-            self.table_view.resizeColumnsToContents()
-            print(f"✅ Bloque importado: OFFSET {self.offset} - {self.limit} filas ({tiempo:.2f} segundos)")
-            self.offset += self.limit
+            # El bloque se agrega al almacén del modelo y solo se insertan sus filas, sin concatenar
+            with medir_etapa("modelo", "pagina", self.connection_config):
+                self.pandas_model.agregar_bloque(df_more)
+            print(f"✅ Bloque importado: OFFSET {self.offset} - {len(df_more)} filas ({tiempo:.2f} segundos)")
+            self.offset += len(df_more)
 
         except Exception as e:
             self.mostrar_error(f"Error al cargar más datos: {e}")
@@ -3,11 +3,14 @@ from PyQt5.QtWidgets import (
     QLabel, QTableView, QFrame, QProgressBar
 )
 from PyQt5.QtCore import pyqtSlot, Qt, QThread
-import pandas as pd
 import time
+from functools import partial
 from style.importacionStyle import get_style_sheet_importacion  # Función que retorna un style sheet
+from view.ancho_columnas import AjustadorColumnas
 from model.pandas_model import PandasModel  # Asegúrate de que PandasModel esté definido
-from model.workers import ImportWorker  # Worker definido previamente
+from model.workers import ImportWorker, PaginaWorker  # Workers de importación y de páginas adicionales
+from config.logging_config import medir_etapa
+from connect.importacion import eliminar_snapshot_importacion
 
 class ImportWindow(QMainWindow):
     """Ventana con scroll infinito para importar datos de manera incremental."""
@@ -20,8 +23,17 @@ class ImportWindow(QMainWindow):
         # Variables de paginación y almacenamiento
         self.offset = 0  
         self.limit = 10000  
-        self.data_blocks = []  # Almacena cada bloque de datos
-        self.pandas_model = PandasModel()  
+        self.total_rows = 50000  # Máximo de filas de la importación en segundo plano
+        self.worker = None
+        self.prefetch_filas = 2000  # La página siguiente se pide al quedar menos de estas filas por mostrar
+        self.pagina_worker = None  # Lectura de página en curso; mientras exista no se piden más
+        # Hilos de página que siguen corriendo, también los de páginas ya descartadas: se
+        # conserva la referencia hasta su señal finished para que Qt no destruya un hilo activo
+        self.hilos_pagina = set()
+        self.fin_de_datos = False
+        self.import_id = None  # Snapshot DuckDB desde el que se sirven las páginas adicionales
+        self.cerrada = False  # Al cerrar la ventana su snapshot se elimina de la base
+        self.pandas_model = PandasModel()  # Los bloques recibidos se acumulan en self.pandas_model.almacen
 
         # Configuración del widget central y layout
         self.central_widget = QWidget()
@@ -47,11 +59,19 @@ class ImportWindow(QMainWindow):
         self.import_button.clicked.connect(self.on_importar_datos)
         control_layout.addWidget(self.import_button)
 
+        # Botón para cancelar la importación en curso
+        self.cancel_button = QPushButton("Cancelar")
+        self.cancel_button.setEnabled(False)
+        self.cancel_button.clicked.connect(self.on_cancelar_importacion)
+        control_layout.addWidget(self.cancel_button)
+
         self.main_layout.addWidget(self.control_frame)
 
         # QTableView con scroll infinito
         self.table_view = QTableView()
         self.table_view.setModel(self.pandas_model)
+        # Los anchos de columna se estiman con una muestra de cada bloque que llega al modelo
+        self.ajustador_columnas = AjustadorColumnas(self.table_view, self.pandas_model)
         self.table_view.verticalScrollBar().valueChanged.connect(self.detectar_scroll)
         self.main_layout.addWidget(self.table_view)
 
@@ -59,79 +79,179 @@ class ImportWindow(QMainWindow):
     def on_importar_datos(self):
         """Inicia la importación en un worker, movido a un hilo independiente."""
         self.import_button.setEnabled(False)
+        self.cancel_button.setEnabled(True)
         self.progress_bar.setVisible(True)
 
-        # Configuramos la barra de progreso basado en el número total de bloques
-        total_blocks = 50000 // self.limit  # Ejemplo: 50000 filas / 10000 = 5 bloques
-        self.progress_bar.setMaximum(total_blocks)
+        # La barra de progreso avanza con las filas recibidas
+        self.progress_bar.setMaximum(self.total_rows)
         self.progress_bar.setValue(0)
         self.offset = 0  # Reiniciamos el offset
+        self.fin_de_datos = False
+        self.pagina_worker = None  # Una página pedida antes del reinicio se descarta al llegar
+        self.pandas_model.limpiar()
 
-        # Configuración del thread y el worker
+        # El worker refresca el snapshot existente (solo las referencias modificadas desde la
+        # última importación) o crea uno nuevo, y lee de él tanto los bloques iniciales como
+        # las páginas adicionales, de modo que todas provienen de la misma foto.
         self.thread = QThread()
-        self.worker = ImportWorker(self.connection_config, total_rows=50000, batch_size=self.limit)
+        self.worker = ImportWorker(self.connection_config, total_rows=self.total_rows, batch_size=self.limit,
+                                   paginacion="snapshot", import_id=self.import_id)
         self.worker.moveToThread(self.thread)
 
         # Conectar señales y slots
         self.thread.started.connect(self.worker.run)
+        self.worker.snapshot_listo.connect(self.on_snapshot_listo)
         self.worker.lote_recibido.connect(self.handle_lote_recibido)
         self.worker.error.connect(self.mostrar_error)
-        self.worker.lote_recibido.connect(lambda offset, df: self.progress_bar.setValue(
-            self.progress_bar.value() + 1))
+        self.worker.progreso.connect(lambda filas, total: self.progress_bar.setValue(min(filas, total)))
+        self.worker.cancelado.connect(lambda: print("⚠️ Importación cancelada."))
         self.worker.finished.connect(self.thread.quit)
         self.worker.finished.connect(self.worker.deleteLater)
         self.thread.finished.connect(self.thread.deleteLater)
-        self.thread.finished.connect(lambda: self.import_button.setEnabled(True))
+        self.thread.finished.connect(self.on_importacion_terminada)
 
         self.thread.start()
 
-    @pyqtSlot(int, pd.DataFrame)
-    def handle_lote_recibido(self, offset, df):
-        """Actualiza el modelo agregando cada nuevo lote recibido."""
-        if df is None or df.empty:
-            self.mostrar_error("No se encontraron datos en el lote recibido.")
+    @pyqtSlot(str)
+    def on_snapshot_listo(self, import_id):
+        """Registra el snapshot que recorre la importación; las páginas adicionales se leen de él."""
+        anterior, self.import_id = self.import_id, import_id
+        if anterior is not None and anterior != import_id:
+            self.descartar_snapshot(anterior)
+
+    def descartar_snapshot(self, import_id=None):
+        """Elimina de la base un snapshot que ya no se va a leer (por defecto, el de la ventana)."""
+        if import_id is None:
+            import_id, self.import_id = self.import_id, None
+        if import_id is not None:
+            eliminar_snapshot_importacion(self.connection_config, import_id)
+
+    def closeEvent(self, event):
+        """Cancela la importación en curso y elimina el snapshot de la ventana."""
+        self.cerrada = True
+        self.pagina_worker = None  # Una página en camino se descarta al llegar
+        if self.worker is not None:
+            self.worker.cancelar()  # El snapshot se elimina en on_importacion_terminada
+        else:
+            self.descartar_snapshot()
+        super().closeEvent(event)
+
+    @pyqtSlot()
+    def on_cancelar_importacion(self):
+        """Cancela la importación en curso; los bloques ya mostrados se conservan."""
+        if self.worker is not None:
+            self.cancel_button.setEnabled(False)
+            self.worker.cancelar()
+
+    @pyqtSlot()
+    def on_importacion_terminada(self):
+        """Restablece los controles al terminar (o cancelarse) la importación."""
+        self.worker = None
+        self.thread = None
+        if self.cerrada:
+            self.descartar_snapshot()
             return
+        self.import_button.setEnabled(True)
+        self.cancel_button.setEnabled(False)
+        self.progress_bar.setVisible(False)
+        self.verificar_prefetch()
 
-        self.data_blocks.append(df)
+    @pyqtSlot(int, object)
+    def handle_lote_recibido(self, offset, df):
+        """Actualiza el modelo agregando cada nuevo lote recibido."""
         try:
-            df_total = pd.concat(self.data_blocks, ignore_index=True)
-        except Exception as e:
-            self.mostrar_error(f"Error al concatenar datos: {e}")
-            return
+            if df is None or df.empty:
+                self.mostrar_error("No se encontraron datos en el lote recibido.")
+                return
 
-        self.pandas_model.actualizar_datos(df_total)
-        self.table_view.resizeColumnsToContents()
-        print(f"✅ Lote recibido: OFFSET {offset} - {self.limit} filas")
-        self.offset = offset + self.limit
+            # Solo se insertan las filas del lote: no se concatena ni se reinicia el modelo
+            with medir_etapa("modelo", "importacion", self.connection_config):
+                self.pandas_model.agregar_bloque(df)
+            print(f"✅ Lote recibido: OFFSET {offset} - {len(df)} filas")
+            self.offset = offset + len(df)
+        finally:
+            # El lote ya se mostró: el worker puede entregar el siguiente
+            if self.worker is not None:
+                self.worker.confirmar_lote()
 
     def detectar_scroll(self, value):
-        """Si se llega al final del scroll, dispara la carga de más datos."""
-        if value == self.table_view.verticalScrollBar().maximum():
+        """Al acercarse al final de los datos cargados, anticipa la carga de la página siguiente."""
+        self.verificar_prefetch()
+
+    def filas_restantes(self):
+        """Filas cargadas que quedan por debajo de la última fila visible."""
+        viewport = self.table_view.viewport()
+        ultima_visible = self.table_view.rowAt(viewport.height() - 1)
+        if ultima_visible < 0:
+            ultima_visible = self.pandas_model.rowCount() - 1  # La tabla no llena el viewport
+        return self.pandas_model.rowCount() - 1 - ultima_visible
+
+    def verificar_prefetch(self):
+        """Pide la página siguiente si quedan menos de 'prefetch_filas' filas por mostrar."""
+        if self.worker is not None:
+            return  # La importación en curso ya está entregando los bloques siguientes
+        if self.pandas_model.rowCount() and self.filas_restantes() <= self.prefetch_filas:
             self.on_cargar_mas_datos()
 
     @pyqtSlot()
     def on_cargar_mas_datos(self):
-        """Carga adicional de datos (en este ejemplo se hace sin worker)."""
+        """
+        Pide en segundo plano la siguiente página del snapshot de la importación. La consulta
+        completa se ejecuta una sola vez al crear el snapshot; las páginas siguientes solo leen
+        de esa tabla. Si ya hay una página en camino, la solicitud se descarta.
+        """
+        if self.pagina_worker is not None or self.fin_de_datos:
+            return
         self.progress_bar.setVisible(True)
-        try:
-            from connect.importacion import importar_datos_con_metricas
-            inicio = time.time()
-            df_more = importar_datos_con_metricas(self.connection_config, total_rows=50000, batch_size=self.limit)
-            fin = time.time()
-            if df_more is None or df_more.empty:
-                print("⚠️ No se encontraron datos en el siguiente bloque.")
-                return
+        self.inicio_pagina = time.time()
+        hilo = QThread()
+        self.hilos_pagina.add(hilo)
+        self.pagina_worker = PaginaWorker(self.connection_config, self.import_id, self.offset, self.limit)
+        self.pagina_worker.moveToThread(hilo)
 
-            self.data_blocks.append(df_more)
-            df_total = pd.concat(self.data_blocks, ignore_index=True)
-            self.pandas_model.actualizar_datos(df_total)
-            self.table_view.resizeColumnsToContents()
-            print(f"✅ Bloque adicional importado: OFFSET {self.offset} - {self.limit} filas ({fin - inicio:.2f} seg)")
-            self.offset += self.limit
-        except Exception as e:
-            self.mostrar_error(f"Error al cargar más datos: {e}")
-        finally:
-            self.progress_bar.setVisible(False)
+        hilo.started.connect(self.pagina_worker.run)
+        # Cada respuesta llega junto con su worker para descartar las de solicitudes ya reemplazadas
+        self.pagina_worker.pagina_lista.connect(partial(self.handle_pagina_lista, self.pagina_worker))
+        self.pagina_worker.error.connect(partial(self.handle_error_pagina, self.pagina_worker))
+        self.pagina_worker.finished.connect(hilo.quit)
+        self.pagina_worker.finished.connect(self.pagina_worker.deleteLater)
+        hilo.finished.connect(hilo.deleteLater)
+        hilo.finished.connect(partial(self.hilos_pagina.discard, hilo))
+
+        hilo.start()
+
+    def handle_pagina_lista(self, worker, import_id, offset, df):
+        """Agrega la página recibida y, si el usuario sigue cerca del final, pide la siguiente."""
+        if worker is not self.pagina_worker:
+            # Página pedida antes de reiniciar la importación: si para leerla se creó un
+            # snapshot distinto del de la ventana, nadie más lo va a usar
+            if import_id != self.import_id:
+                self.descartar_snapshot(import_id)
+            return
+        self.pagina_worker = None
+        self.progress_bar.setVisible(self.worker is not None)
+        self.import_id = import_id
+        if df is None or df.empty:
+            self.fin_de_datos = True
+            print("⚠️ No se encontraron datos en el siguiente bloque.")
+            return
+
+        with medir_etapa("modelo", "pagina", self.connection_config):
+            self.pandas_model.agregar_bloque(df)
+        print(f"✅ Bloque adicional importado: OFFSET {offset} - {len(df)} filas "
+              f"({time.time() - self.inicio_pagina:.2f} seg)")
+        self.offset = offset + len(df)
+        if len(df) < self.limit:
+            self.fin_de_datos = True
+        else:
+            self.verificar_prefetch()
+
+    def handle_error_pagina(self, worker, mensaje):
+        if worker is not self.pagina_worker:
+            return
+        self.pagina_worker = None
+        self.progress_bar.setVisible(self.worker is not None)
+        self.mostrar_error(f"Error al cargar más datos: {mensaje}")
 
     def mostrar_error(self, mensaje):
         """Muestra el mensaje de error (aquí se imprime en consola)."""